@@ -1,10 +1,27 @@
-from flask import Flask, render_template
+from pathlib import Path
+
+from flask import Flask, Response, render_template
 
 
 import faces
+from faces.builder import DefaultBuilder
+from faces.metrics import Metrics
 
 app = Flask(__name__)
 
+# time spent in each stage of the pipeline, across requests
+metrics = Metrics()
+
+# shared by all requests, so that models are loaded once; when the registry
+# changes, the identifier is refitted in the background while requests
+# keep using the previous one
+builder = DefaultBuilder(
+    device=None,
+    registry_path=Path('~/.faces.pkl').expanduser(),
+    background_refresh=True,
+    metrics=metrics,
+)
+
 
 
 
@@ -17,16 +34,10 @@ def hello():
 def detectmi():
 
     # import
-    from pathlib import Path
-    from faces import Image
-    from faces.builder import DefaultBuilder
     from faces.main import Main
 
-    # initialize pipeline
-    builder = DefaultBuilder.from_defaults()
-
     # open an image
-    image = Image.open(Path('data/douglas_adams.jpg'))
+    image = builder.open_image(Path('data/douglas_adams.jpg'))
 
     # detect using the built-in function
     #Main().detect(builder, image).show()
@@ -50,16 +61,13 @@ def detectmi():
 def identmi():
 
     # import
-    from pathlib import Path
-    from faces import Image
-    from faces.builder import DefaultBuilder
     from faces.main import Main
 
-    # initialize pipeline
-    builder = DefaultBuilder.from_defaults()
+    # pick up faces that were added to the registry
+    builder.refresh()
 
     # open an image
-    image = Image.open(Path('data/who-is-this.jpg'))
+    image = builder.open_image(Path('data/who-is-this.jpg'))
 
     # identify using the built-in function
     #Main().identify(builder, image).show()
@@ -246,5 +254,11 @@ def capturemi():
 
 
 
+@app.route('/metrics')
+def prometheus_metrics():
+    # scraped by prometheus
+    return Response(metrics.prometheus(), mimetype='text/plain; version=0.0.4')
+
+
 if __name__ == '__main__':
     app.run('0.0.0.0', debug=True)
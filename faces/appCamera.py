@@ -4,7 +4,8 @@ import cv2
 from datetime import datetime
 # import the faces library
 from faces.builder import DefaultBuilder
-from faces.types import Image
+from faces.drawing import as_bgr
+from faces.types import Frame
 
 # create a builder
 builder = DefaultBuilder.from_defaults()
@@ -17,7 +18,7 @@ while(True):
 
     # Capture the video frame
     ret, raw_image = vid.read()
-    image = Image.from_array(raw_image)
+    image = Frame.from_array(raw_image)
 
     # identify faces in the image
     extracts = [
@@ -26,10 +27,10 @@ while(True):
     ]
 
     # annotate the image show it
-    builder.annotate.with_identity(
+    cv2.imwrite("static/faceCapture.jpg", as_bgr(builder.annotate.with_identity(
         image, ((bbox, identity)
         for bbox, _, identity in extracts
-    )).save("static/faceCapture.jpg")
+    ))))
 
     # show status
     print("captured image at", datetime.now().isoformat())
@@ -0,0 +1,132 @@
+"""Measure the throughput and latency of the pipeline's components.
+
+Run ``python -m benchmarks run`` from the repository folder to write a JSON
+report, and ``python -m benchmarks compare BASE NEW`` to compare two reports.
+"""
+
+import gc
+import platform
+import statistics
+import subprocess
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import torch
+
+# directory of the images and face patches used by the benchmarks.
+DATA_DIR = Path(__file__).parent.parent / "test" / "data"
+
+
+@dataclass
+class Result:
+    """Timings of a benchmark."""
+
+    # name of the measured operation.
+    benchmark: str
+
+    # parameters the operation was measured with.
+    params: Dict[str, Any]
+
+    # seconds per call, one entry per repetition.
+    seconds: List[float]
+
+    # number of items (e.g. images or faces) processed per call.
+    items: int = 1
+
+    def summary(self) -> Dict[str, Any]:
+        """Return the result with summary statistics of its timings."""
+        median = statistics.median(self.seconds)
+        return {
+            "benchmark": self.benchmark,
+            "params": self.params,
+            "items": self.items,
+            "repeat": len(self.seconds),
+            "min": min(self.seconds),
+            "median": median,
+            "mean": statistics.fmean(self.seconds),
+            "max": max(self.seconds),
+            "items_per_second": self.items / median if median > 0 else None,
+        }
+
+
+def key(summary: Dict[str, Any]) -> str:
+    """Return a name that identifies a benchmark *summary* across reports."""
+    params = ",".join(f"{name}={value}" for name, value in summary["params"].items())
+    return f"{summary['benchmark']}[{params}]"
+
+
+@dataclass
+class Config:
+    """Settings shared by all benchmarks."""
+
+    device: torch.device = torch.device("cpu")
+
+    # number of timed repetitions per measurement.
+    repeat: int = 5
+
+    # number of untimed repetitions before the measurement.
+    warmup: int = 1
+
+    # use smaller sizes, to check the suite rather than to measure.
+    quick: bool = False
+
+    # number of references of the identifier benchmarks.
+    gallery_sizes: List[int] = field(default_factory=lambda: [1000, 10000, 100000])
+
+    # number of faces of the registry benchmarks.
+    registry_sizes: List[int] = field(default_factory=lambda: [100, 1000])
+
+
+def measure(
+    benchmark: str,
+    function: Callable[[], Any],
+    config: Config,
+    items: int = 1,
+    setup: Optional[Callable[[], Any]] = None,
+    **params: Any,
+) -> Result:
+    """Time *function* after *config.warmup* untimed calls. Call *setup*,
+    if any, before each call without timing it.
+    """
+    seconds = []
+    for repetition in range(config.warmup + config.repeat):
+        if setup is not None:
+            setup()
+        gc.collect()
+        start = time.perf_counter()
+        function()
+        if config.device.type == "cuda":
+            torch.cuda.synchronize(config.device)
+        elapsed = time.perf_counter() - start
+        if repetition >= config.warmup:
+            seconds.append(elapsed)
+    return Result(benchmark, params, seconds, items)
+
+
+def environment(config: Config) -> Dict[str, Any]:
+    """Return a description of the machine and code that is measured."""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=Path(__file__).parent,
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "threads": torch.get_num_threads(),
+        "config": {
+            name: str(value) if isinstance(value, torch.device) else value
+            for name, value in asdict(config).items()
+        },
+    }
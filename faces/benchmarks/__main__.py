@@ -0,0 +1,140 @@
+import argparse
+import json
+import logging
+import sys
+from pathlib import Path
+from typing import Any, Dict, List
+
+import torch
+
+from benchmarks import Config, detector, encoder, environment, identifier, key, registry
+
+# benchmarks by name, in the order they are run.
+SUITES = {
+    "detector": detector.run,
+    "encoder": encoder.run,
+    "identifier": identifier.run,
+    "registry": registry.run,
+}
+
+
+def run(args: argparse.Namespace) -> None:
+    """Run the benchmarks and write their report."""
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    config = Config(
+        device=torch.device(args.device),
+        repeat=args.repeat,
+        warmup=args.warmup,
+        quick=args.quick,
+        gallery_sizes=args.gallery_sizes,
+        registry_sizes=args.registry_sizes,
+    )
+    results: List[Dict[str, Any]] = []
+    for name in args.only or SUITES:
+        for result in SUITES[name](config):
+            summary = result.summary()
+            logging.info(f"{key(summary)}: {1000 * summary['median']:0.2f}ms")
+            results.append(summary)
+    report = {"environment": environment(config), "results": results}
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, "w") as report_file:
+            json.dump(report, report_file, indent=2)
+
+
+def compare(args: argparse.Namespace) -> None:
+    """Print the change of the median time of each benchmark between two reports."""
+    with open(args.base) as base_file, open(args.new) as new_file:
+        base = {key(result): result for result in json.load(base_file)["results"]}
+        new = {key(result): result for result in json.load(new_file)["results"]}
+    for name in sorted(base.keys() & new.keys()):
+        change = new[name]["median"] / base[name]["median"] - 1.0
+        marker = ""
+        if change > args.threshold:
+            marker = "  slower"
+        elif change < -args.threshold:
+            marker = "  faster"
+        print(
+            f"{name}: {1000 * base[name]['median']:0.2f}ms"
+            f" -> {1000 * new[name]['median']:0.2f}ms ({100 * change:+0.1f}%){marker}"
+        )
+    for name in sorted(base.keys() - new.keys()):
+        print(f"{name}: only in {args.base}")
+    for name in sorted(new.keys() - base.keys()):
+        print(f"{name}: only in {args.new}")
+
+
+def main(argv=None) -> None:
+    """Measure the pipeline's components, or compare two measurements."""
+    parser = argparse.ArgumentParser(description=main.__doc__, prog="benchmarks")
+    subparsers = parser.add_subparsers(dest="action", required=True)
+    # run
+    run_parser = subparsers.add_parser("run", help="run the benchmarks")
+    run_parser.add_argument(
+        "--only",
+        nargs="+",
+        choices=sorted(SUITES),
+        default=None,
+        help="benchmarks to run. All if omitted.",
+    )
+    run_parser.add_argument(
+        "--output", type=Path, default=None, help="report file. stdout if omitted."
+    )
+    run_parser.add_argument("--device", type=str, default="cpu", help="torch device.")
+    run_parser.add_argument(
+        "--threads", type=int, default=None, help="size of torch's thread pool."
+    )
+    run_parser.add_argument(
+        "--repeat", type=int, default=5, help="timed repetitions per measurement."
+    )
+    run_parser.add_argument(
+        "--warmup", type=int, default=1, help="untimed repetitions per measurement."
+    )
+    run_parser.add_argument(
+        "--quick",
+        action="store_true",
+        default=False,
+        help="use small sizes, to check that the benchmarks run.",
+    )
+    run_parser.add_argument(
+        "--gallery-sizes",
+        type=int,
+        nargs="+",
+        default=[1000, 10000, 100000],
+        help="numbers of random references to identify against, e.g. up to 1000000.",
+    )
+    run_parser.add_argument(
+        "--registry-sizes",
+        type=int,
+        nargs="+",
+        default=[100, 1000],
+        help="numbers of faces in the measured registries.",
+    )
+    # compare
+    compare_parser = subparsers.add_parser(
+        "compare", help="compare the reports of two runs"
+    )
+    compare_parser.add_argument("base", type=Path, help="report to compare against.")
+    compare_parser.add_argument("new", type=Path, help="report to compare.")
+    compare_parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="relative change of the median above which a benchmark is marked.",
+    )
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    if args.action == "run":
+        run(args)
+    elif args.action == "compare":
+        compare(args)
+    else:
+        raise ValueError(args.action)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""Detection time per image size and number of faces."""
+
+from typing import Dict, Iterator
+
+import numpy as np
+
+from benchmarks import DATA_DIR, Config, Result, measure
+from faces import Image
+from faces.detector import MTCNNDetector
+
+
+def _images(size: int) -> Dict[str, Image]:
+    """Return test images with 0, 1, and 7 faces, scaled to *size*."""
+    return {
+        "blank": Image.from_array(
+            np.full((750, 1000, 3), 127, dtype=np.uint8), target_size=size, rotate=0
+        ),
+        "douglas_adams": Image.open(
+            DATA_DIR / "images" / "douglas_adams.jpg", target_size=size
+        ),
+        "monty_python": Image.open(
+            DATA_DIR / "images" / "monty_python.jpg", target_size=size
+        ),
+    }
+
+
+def run(config: Config) -> Iterator[Result]:
+    """Measure `MTCNNDetector.detect` and `MTCNNDetector.extract`."""
+    detector = MTCNNDetector(device=config.device)
+    for size in (500, 1000) if config.quick else (500, 1000, 2000):
+        for name, image in _images(size).items():
+            faces = len(list(detector.detect(image)))
+            yield measure(
+                "detector.detect",
+                # pylint: disable=cell-var-from-loop
+                lambda: list(detector.detect(image)),
+                config,
+                image=name,
+                size=size,
+                faces=faces,
+            )
+            yield measure(
+                "detector.extract",
+                # pylint: disable=cell-var-from-loop
+                lambda: list(detector.extract(image)),
+                config,
+                image=name,
+                size=size,
+                faces=faces,
+            )
@@ -0,0 +1,27 @@
+"""Encoding throughput per batch size."""
+
+from typing import Iterator
+
+import torch
+
+from benchmarks import Config, Result, measure
+from faces.encoder import ResnetEncoder
+
+
+def run(config: Config) -> Iterator[Result]:
+    """Measure `ResnetEncoder.many`. The encoder has random weights, so
+    that it can be measured offline, at the speed of the trained one.
+    """
+    encoder = ResnetEncoder(config.device, pretrained=False)
+    generator = torch.Generator().manual_seed(0)
+    for batch_size in (1, 8, 32) if config.quick else (1, 8, 32, 64, 128):
+        patches = torch.rand(batch_size, 3, 160, 160, generator=generator).to(
+            config.device
+        )
+        yield measure(
+            "encoder.many",
+            lambda: encoder.many(patches),  # pylint: disable=cell-var-from-loop
+            config,
+            items=batch_size,
+            batch_size=batch_size,
+        )
@@ -0,0 +1,79 @@
+"""Identification latency per number of references."""
+
+from typing import Iterator, Union
+
+import torch
+from torch.nn import functional as F
+
+from benchmarks import Config, Result, measure
+from faces import Encoder
+from faces.encoder import ResnetEncoder
+from faces.identifier import (
+    ConstrainedNearestNeighbourClassifier,
+    CosineNearestNeighbour,
+    NearestNeighbour,
+    Projection,
+    ShortlistNearestNeighbour,
+)
+
+# number of references per identity of the synthetic galleries.
+FACES_PER_IDENTITY = 10
+
+
+def _identifier(
+    encoder: Encoder, encodings: torch.Tensor, method: str
+) -> ConstrainedNearestNeighbourClassifier:
+    """Return an identifier of the references *encodings*, compared by *method*."""
+    targets = torch.arange(len(encodings)) // FACES_PER_IDENTITY
+    classifier: Union[NearestNeighbour, ShortlistNearestNeighbour]
+    if method == "euclidean":
+        classifier = NearestNeighbour(encodings=encodings, targets=targets)
+    elif method == "int8":
+        classifier = CosineNearestNeighbour.from_encodings(encodings, targets, "int8")
+    elif method == "pca64":
+        classifier = ShortlistNearestNeighbour.from_classifier(
+            NearestNeighbour(encodings=encodings, targets=targets),
+            encodings,
+            Projection.fit(encodings, 64),
+            shortlist=100,
+        )
+    else:
+        raise ValueError(f"unknown method: {method}")
+    return ConstrainedNearestNeighbourClassifier(
+        encoder=encoder,
+        distance_threshold=1.0,
+        restklasse="Anonymous",
+        index2identity={
+            index: f"person {index}"
+            for index in range(len(encodings) // FACES_PER_IDENTITY + 1)
+        },
+        classifier=classifier,
+    )
+
+
+def run(config: Config) -> Iterator[Result]:
+    """Measure `ConstrainedNearestNeighbourClassifier.identify_encodings`
+    on galleries of random encodings.
+    """
+    # encodings are given, the encoder is not used
+    encoder = ResnetEncoder(config.device, pretrained=False)
+    generator = torch.Generator().manual_seed(0)
+    gallery_sizes = [1000, 10000] if config.quick else config.gallery_sizes
+    for gallery_size in gallery_sizes:
+        encodings = F.normalize(torch.randn(gallery_size, 512, generator=generator))
+        encodings = encodings.to(config.device)
+        for method in ("euclidean", "int8", "pca64"):
+            identifier = _identifier(encoder, encodings, method)
+            for queries in (1, 64):
+                batch = F.normalize(torch.randn(queries, 512, generator=generator))
+                batch = batch.to(config.device)
+                yield measure(
+                    "identifier.identify_encodings",
+                    # pylint: disable=cell-var-from-loop
+                    lambda: identifier.identify_encodings(batch),
+                    config,
+                    items=queries,
+                    gallery_size=gallery_size,
+                    method=method,
+                    queries=queries,
+                )
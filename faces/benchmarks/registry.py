@@ -0,0 +1,81 @@
+"""Registry access time per number of faces."""
+
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Iterator, List, Tuple
+
+import torch
+
+from benchmarks import Config, Result, measure
+from faces import FacePatch, Identity, Registry
+from faces.registry import ColumnarRegistry, PickleRegistry, unpack_patch
+
+
+def _faces(count: int, generator: torch.Generator) -> List[Tuple[FacePatch, Identity]]:
+    """Return *count* random face patches of 8-bit pixels, ten per identity."""
+    return [
+        (
+            unpack_patch(
+                torch.randint(
+                    0, 256, (3, 160, 160), dtype=torch.uint8, generator=generator
+                )
+            ),
+            f"person {index // 10}",
+        )
+        for index in range(count)
+    ]
+
+
+def _measure_registry(
+    name: str, path: Path, config: Config, size: int, generator: torch.Generator
+) -> Iterator[Result]:
+    """Measure the *name* registry at *path*."""
+    kind = PickleRegistry if name == "pickle" else ColumnarRegistry
+    opened: List[Registry] = []
+
+    def _open() -> None:
+        opened[:] = [kind.open(path, config.device)]
+
+    def _load() -> None:
+        _open()
+        len(list(opened[0]))
+
+    yield measure(f"registry.{name}.open", _open, config, size=size)
+    yield measure(f"registry.{name}.iterate", _load, config, items=size, size=size)
+    additions = iter(_faces(10 * (config.warmup + config.repeat), generator))
+    yield measure(
+        f"registry.{name}.add",
+        lambda: opened[0].add(*next(additions)),
+        config,
+        setup=_load,
+        size=size,
+    )
+    yield measure(
+        f"registry.{name}.add_many",
+        lambda: opened[0].add_many([next(additions) for _ in range(9)]),
+        config,
+        items=9,
+        setup=_load,
+        size=size,
+    )
+
+
+def run(config: Config) -> Iterator[Result]:
+    """Measure opening, reading, and adding faces to the registries."""
+    generator = torch.Generator().manual_seed(0)
+    directory = Path(tempfile.mkdtemp(prefix="faces-benchmark-"))
+    try:
+        for size in [100] if config.quick else config.registry_sizes:
+            faces = _faces(size, generator)
+            pickle_path = directory / f"faces-{size}.pkl"
+            registry = PickleRegistry.open(pickle_path, config.device)
+            registry.add_many(faces)
+            yield from _measure_registry("pickle", pickle_path, config, size, generator)
+            columnar_path = directory / f"faces-{size}"
+            ColumnarRegistry.write(columnar_path, faces)
+            yield from _measure_registry(
+                "columnar", columnar_path, config, size, generator
+            )
+    finally:
+        shutil.rmtree(directory)
@@ -2,25 +2,52 @@ from __future__ import annotations
 
 import argparse
 from abc import ABC, abstractmethod
-from collections.abc import Iterable, Iterator
+from collections import Counter
+from collections.abc import Iterable, Iterator, Sequence
 from functools import cached_property
 from pathlib import Path
-from typing import Any, Tuple
-
-import torch
-from PIL import Image as PILImage
-
-from faces.types import (
-    BoundingBox,
-    FaceEncoding,
-    FacePatch,
-    FaceProbability,
-    Identity,
-    Image,
-    VideoFrame,
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple, Union
+
+if TYPE_CHECKING:
+    import torch
+    from PIL import Image as PILImage
+
+    from faces.metrics import Metrics
+    from faces.types import (
+        BoundingBox,
+        FaceEncoding,
+        FacePatch,
+        FaceProbability,
+        Frame,
+        Identity,
+        Image,
+        VideoFrame,
+    )
+
+# names that are re-exported from faces.types. They are loaded on first
+# access, so that importing faces does not import torch.
+_TYPES = frozenset(
+    {
+        "BoundingBox",
+        "FaceEncoding",
+        "FacePatch",
+        "FaceProbability",
+        "Frame",
+        "Identity",
+        "Image",
+        "VideoFrame",
+    }
 )
 
 
+def __getattr__(name: str) -> Any:
+    if name in _TYPES:
+        from faces import types  # pylint: disable=import-outside-toplevel
+
+        return getattr(types, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 class Identifier(ABC):
     """Identify faces."""
 
@@ -28,18 +55,44 @@ class Identifier(ABC):
     def __call__(self, face_patch: FacePatch) -> Identity:
         """Return the identity of the person in *face_patch*."""
 
+    def many(self, patches: torch.Tensor) -> List[Identity]:
+        """Return the identities of N face *patches* given as an (N, ...) tensor."""
+        return [self(face_patch) for face_patch in patches]
+
+    @abstractmethod
+    def identify_encodings(self, encodings: torch.Tensor) -> List[Identity]:
+        """Return the identities of N *encodings* given as an (N, D) tensor."""
+
 
 class Detector(ABC):
     """Detect faces."""
 
     @abstractmethod
-    def detect(self, image: Image) -> Iterable[Tuple[BoundingBox, FaceProbability]]:
+    def detect(
+        self, image: Union[Image, Frame]
+    ) -> Iterable[Tuple[BoundingBox, FaceProbability]]:
         """Return the bounding boxes and likelihoods of there being a face."""
 
+    def many(
+        self, images: Sequence[Union[Image, Frame]]
+    ) -> List[List[Tuple[BoundingBox, FaceProbability]]]:
+        """Return the bounding boxes and likelihoods of the faces in each of
+        *images*, detecting faces in several images at once if possible.
+        """
+        return [list(self.detect(image)) for image in images]
+
     @abstractmethod
-    def extract(self, image: Image) -> Iterable[Tuple[BoundingBox, FacePatch]]:
+    def extract(
+        self, image: Union[Image, Frame]
+    ) -> Iterable[Tuple[BoundingBox, FacePatch]]:
         """Return the bounding boxes and faces detected in an image."""
 
+    @abstractmethod
+    def crop(
+        self, image: Union[Image, Frame], boxes: Sequence[BoundingBox]
+    ) -> torch.Tensor:
+        """Return the (N, ...) face patches enclosed by N bounding *boxes*."""
+
 
 class Encoder(ABC):
     """Encode a face patch."""
@@ -49,8 +102,12 @@ class Encoder(ABC):
         """Return the encoding of a *face_path*."""
 
     @abstractmethod
-    def many(self, patches: torch.Tensor) -> torch.Tensor:
-        """Return N encodings of face *patches* given as an (N, ...) tensor."""
+    def many(
+        self, patches: torch.Tensor, batch_size: Optional[int] = None
+    ) -> torch.Tensor:
+        """Return N encodings of face *patches* given as an (N, ...) tensor.
+        Encodes at most *batch_size* patches at once, if given.
+        """
 
 
 class Registry(ABC):
@@ -60,10 +117,47 @@ class Registry(ABC):
     def add(self, face_patch: FacePatch, identity: Identity) -> None:
         """Store a face and its identity. Auto-commits."""
 
+    def add_many(self, items: Iterable[Tuple[FacePatch, Identity]]) -> List[str]:
+        """Store many faces and their identities. Commits once.
+        Return the reasons of faces that were skipped.
+        """
+        skipped = []
+        for face_patch, identity in items:
+            try:
+                self.add(face_patch, identity)
+            except ValueError as error:
+                skipped.append(str(error))
+        return skipped
+
     @abstractmethod
     def remove(self, identity: Identity) -> None:
         """Remove an identity and all its faces. Auto-commits."""
 
+    def counts(self) -> Dict[Identity, int]:
+        """Return the number of faces per identity."""
+        return dict(Counter(identity for _, identity in self))
+
+    @abstractmethod
+    def discard(self, items: Iterable[Tuple[FacePatch, Identity]]) -> None:
+        """Remove individual faces, as obtained by iteration. Auto-commits."""
+
+    @property
+    def generation(self) -> int:
+        """Return a number that changes whenever the stored registry changes."""
+        return 0
+
+    def refresh(self) -> bool:
+        """Reload the registry if another process has changed it.
+        Return True if it was reloaded.
+        """
+        return False
+
+    def stored_encodings(self) -> Optional[Tuple[List[Identity], torch.Tensor]]:
+        """Return the identities and (N, D) encodings of all faces, in the
+        order of iteration, if they are stored alongside the faces.
+        """
+        return None
+
     @abstractmethod
     def __iter__(self) -> Iterator[Tuple[FacePatch, Identity]]:
         """Iterate over face patches and their identities."""
@@ -75,27 +169,29 @@ class Annotate(ABC):
     @abstractmethod
     def with_probability(
         self,
-        image: Image,
+        image: Union[Image, Frame],
         boxes_and_probability: Iterable[Tuple[BoundingBox, FaceProbability]],
-    ) -> PILImage.Image:
+    ) -> Union[PILImage.Image, Frame]:
         """Draw bounding boxes and their likelihood of enclosing a face."""
 
     @abstractmethod
     def with_identity(
         self,
-        image: Image,
+        image: Union[Image, Frame],
         boxes_and_identity: Iterable[Tuple[BoundingBox, Identity]],
-    ) -> PILImage.Image:
+    ) -> Union[PILImage.Image, Frame]:
         """Draw bounding boxes and their identity."""
 
     @abstractmethod
     def with_enumeration(
-        self, image: Image, boxes: Iterable[BoundingBox], start: int = 0
-    ) -> PILImage.Image:
+        self, image: Union[Image, Frame], boxes: Iterable[BoundingBox], start: int = 0
+    ) -> Union[PILImage.Image, Frame]:
         """Draw bounding boxes and their index in the sequence."""
 
     @abstractmethod
-    def __call__(self, image: Image, boxes: Iterable[BoundingBox]) -> PILImage.Image:
+    def __call__(
+        self, image: Union[Image, Frame], boxes: Iterable[BoundingBox]
+    ) -> Union[PILImage.Image, Frame]:
         """Draw bounding boxes."""
 
 
@@ -117,6 +213,22 @@ class Builder(ABC):
         del self.identifier
         return self
 
+    def refresh(self) -> bool:
+        """Reload the builder's persistent parts if they changed on disc.
+        Return True if they were reloaded.
+        """
+        return False
+
+    @property
+    def metrics(self) -> Optional[Metrics]:
+        """Return the latency of each pipeline stage, if it is collected."""
+        return None
+
+    @property
+    def batch_size(self) -> int:
+        """Return the number of faces that are encoded at once."""
+        return 256
+
     @cached_property
     @abstractmethod
     def encoder(self) -> Encoder:
@@ -132,6 +244,12 @@ class Builder(ABC):
     def detector(self) -> Detector:
         """Return a Detector instance."""
 
+    def open_image(self, path: Path) -> Image:
+        """Open the image at *path*."""
+        from faces.types import Image  # pylint: disable=import-outside-toplevel
+
+        return Image.open(path)
+
     @classmethod
     @abstractmethod
     def from_args(cls, args: argparse.Namespace) -> Builder:
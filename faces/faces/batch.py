@@ -0,0 +1,241 @@
+import json
+import time
+from collections import deque
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    TextIO,
+    Tuple,
+    TypeVar,
+)
+
+import torch
+
+from faces import BoundingBox, Builder, FaceProbability, Identity, Image
+from faces.drawing import as_pil
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+def prefetch(
+    executor: Executor, function: Callable[[T], R], items: Iterable[T], depth: int
+) -> Iterator[Tuple[T, "Future[R]"]]:
+    """Apply *function* to *items* in *executor*, with at most *depth* items in flight.
+    Yield each item and the future of its result, in the order of *items*.
+    """
+    pending: Deque[Tuple[T, Future]] = deque()
+    for item in items:
+        pending.append((item, executor.submit(function, item)))
+        if len(pending) >= depth:
+            yield pending.popleft()
+    while pending:
+        yield pending.popleft()
+
+
+@dataclass
+class Statistics:
+    """Counters of a batch run."""
+
+    images: int = 0
+    faces: int = 0
+    errors: int = 0
+    seconds: float = 0.0
+
+    @property
+    def throughput(self) -> float:
+        """Return the number of processed images per second."""
+        return self.images / self.seconds if self.seconds > 0 else 0.0
+
+    def __str__(self) -> str:
+        return (
+            f"processed {self.images} images ({self.faces} faces, {self.errors} errors)"
+            f" in {self.seconds:0.2f}s: {self.throughput:0.2f} images/s"
+        )
+
+
+@dataclass
+class _Detections:
+    """Faces detected in an image."""
+
+    path: Path
+    image: Optional[Image]
+    boxes_and_probability: List[Tuple[BoundingBox, FaceProbability]]
+    identities: Optional[List[Identity]] = None
+    error: Optional[str] = None
+
+
+@dataclass
+class BatchProcessor:
+    """Detect and optionally identify faces in many images.
+
+    Images are decoded in a thread pool, while faces are detected in the
+    calling thread, in several images at once. Faces of several images are
+    identified in one batch.
+    Annotated images are drawn and saved in the thread pool. Results are
+    written as one JSON object per image and line, in the order of the images.
+    """
+
+    builder: Builder
+
+    # identify faces rather than only detecting them.
+    identify: bool = False
+
+    # directory in which to store annotated images, if any.
+    output_dir: Optional[Path] = None
+
+    # stream to which to write the results, if any.
+    results: Optional[TextIO] = None
+
+    # annotate images with the face probability. Ignored if *identify* is set.
+    show_probability: bool = False
+
+    # number of threads that decode and save images.
+    workers: int = 4
+
+    # minimal number of faces that are identified at once.
+    batch_size: int = 64
+
+    # number of images in which faces are detected at once.
+    detection_batch_size: int = 8
+
+    _output_names: Set[str] = field(default_factory=set, init=False, repr=False)
+
+    def run(self, paths: Iterable[Path]) -> Statistics:
+        """Process the images at *paths*."""
+        statistics = Statistics()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(self.workers) as executor:
+            saving: Deque[Future] = deque()
+            batch: List[_Detections] = []
+            # decoded images in which faces have not been detected yet
+            undetected: List[_Detections] = []
+            for path, image_future in prefetch(
+                executor, self.builder.open_image, paths, 2 * self.workers
+            ):
+                try:
+                    image = image_future.result()
+                except (OSError, ValueError) as error:
+                    # keep failed images in the batch to preserve the output order
+                    batch.append(_Detections(path, None, [], error=str(error)))
+                    continue
+                item = _Detections(path, image, [])
+                batch.append(item)
+                undetected.append(item)
+                if len(undetected) < self.detection_batch_size:
+                    continue
+                self._detect(undetected)
+                undetected = []
+                if (
+                    sum(len(item.boxes_and_probability) for item in batch)
+                    >= self.batch_size
+                ):
+                    self._flush(batch, executor, saving, statistics)
+                    batch = []
+            self._detect(undetected)
+            self._flush(batch, executor, saving, statistics)
+            while saving:
+                saving.popleft().result()
+        statistics.seconds = time.perf_counter() - start
+        return statistics
+
+    def _detect(self, items: List[_Detections]) -> None:
+        """Detect the faces in the images of *items*."""
+        if not items:
+            return
+        detections = self.builder.detector.many([item.image for item in items])
+        for item, boxes_and_probability in zip(items, detections):
+            item.boxes_and_probability = boxes_and_probability
+
+    def _flush(
+        self,
+        batch: List[_Detections],
+        executor: Executor,
+        saving: Deque[Future],
+        statistics: Statistics,
+    ) -> None:
+        """Identify the faces in *batch*, write the results, and schedule the annotated images."""
+        detections = [item for item in batch if item.image is not None]
+        if self.identify and detections:
+            patches = torch.cat(
+                [
+                    self.builder.detector.crop(
+                        item.image, [box for box, _ in item.boxes_and_probability]
+                    )
+                    for item in detections
+                ]
+            )
+            identities = self.builder.identifier.many(patches) if len(patches) else []
+            offset = 0
+            for item in detections:
+                num_faces = len(item.boxes_and_probability)
+                item.identities = identities[offset : offset + num_faces]
+                offset += num_faces
+
+        for item in batch:
+            if item.image is None:
+                self._write({"path": str(item.path), "error": item.error})
+                statistics.errors += 1
+                continue
+            record: Dict[str, Any] = {
+                "path": str(item.path),
+                "size": list(item.image.image.size),
+                "faces": [
+                    {"box": list(map(float, box.as_tuple)), "probability": float(prob)}
+                    for box, prob in item.boxes_and_probability
+                ],
+            }
+            if item.identities is not None:
+                for face, identity in zip(record["faces"], item.identities):
+                    face["identity"] = identity
+            if self.output_dir is not None:
+                output = self._output_path(item.path)
+                record["output"] = str(output)
+                # limit the number of annotated images held in memory
+                while len(saving) >= 2 * self.workers:
+                    saving.popleft().result()
+                saving.append(executor.submit(self._save, item, output))
+            self._write(record)
+            statistics.images += 1
+            statistics.faces += len(item.boxes_and_probability)
+
+    def _output_path(self, path: Path) -> Path:
+        """Return a path in the output directory that has not been used yet."""
+        assert self.output_dir is not None
+        name, index = f"{path.stem}.jpg", 1
+        while name in self._output_names:
+            name, index = f"{path.stem}-{index}.jpg", index + 1
+        self._output_names.add(name)
+        return self.output_dir / name
+
+    def _save(self, item: _Detections, output: Path) -> None:
+        """Annotate the image of *item* and save it at *output*."""
+        if item.identities is not None:
+            annotated = self.builder.annotate.with_identity(
+                item.image,
+                zip((box for box, _ in item.boxes_and_probability), item.identities),
+            )
+        elif self.show_probability:
+            annotated = self.builder.annotate.with_probability(
+                item.image, item.boxes_and_probability
+            )
+        else:
+            annotated = self.builder.annotate(
+                item.image, [box for box, _ in item.boxes_and_probability]
+            )
+        as_pil(annotated).convert("RGB").save(output, "JPEG")
+
+    def _write(self, record: Dict[str, Any]) -> None:
+        """Write *record* to the results stream."""
+        if self.results is not None:
+            self.results.write(json.dumps(record) + "\n")
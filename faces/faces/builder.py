@@ -1,16 +1,28 @@
-from dataclasses import dataclass
+from __future__ import annotations
+
+import contextlib
+import json
+import logging
+import threading
+from dataclasses import asdict, dataclass, field
 from functools import cached_property
 from pathlib import Path
-from typing import Tuple
+from typing import TYPE_CHECKING, Any, ContextManager, Dict, Optional, Tuple, Union
+
+from faces import Annotate, Builder, Detector, Encoder, Identifier, Registry
+
+if TYPE_CHECKING:
+    import torch
+
+    from faces.detector import DetectionProfile
+    from faces.metrics import Metrics
+    from faces.types import Identity, Image
 
-import torch
+logger = logging.getLogger(__name__)
 
-from faces import Annotate, Builder, Detector, Encoder, Identifier, Identity, Registry
-from faces.detector import MTCNNDetector
-from faces.drawing import PILAnnotate
-from faces.encoder import ResnetEncoder
-from faces.identifier import ConstrainedNearestNeighbourClassifier
-from faces.registry import PickleRegistry
+# NOTE: components and torch are imported when they are first needed, to
+# keep the command line interface responsive.
+# pylint: disable=import-outside-toplevel
 
 
 # pylint: disable=too-many-instance-attributes
@@ -18,7 +30,8 @@ from faces.registry import PickleRegistry
 class DefaultBuilder(Builder):
     """Build classes from default arguments."""
 
-    device: torch.device
+    # device to run on. The first GPU if available, or the CPU if None.
+    device: Optional[Union[torch.device, str]]
 
     registry_path: Path
 
@@ -34,55 +47,345 @@ class DefaultBuilder(Builder):
 
     factor: float = 0.709
 
+    # detect faces in tiles of this size. Tiles are cut from the full resolution
+    # image with crop_from_source, else from the image downsized to target_size.
+    tile_size: Optional[int] = None
+
+    tile_overlap: int = 200
+
+    precision: Optional[str] = None
+
+    pca_dims: Optional[int] = None
+
+    shortlist: int = 100
+
+    vote_k: Optional[int] = None
+
+    batch_size: int = 256
+
+    # how to draw annotations, either with "pil" or "cv" (OpenCV).
+    annotator: str = "pil"
+
+    # size of the larger image side on which faces are detected.
+    target_size: int = 1000
+
+    # crop faces from the full resolution image rather than the downsized one.
+    crop_from_source: bool = False
+
+    # skip added faces within this distance of a known face of the same identity.
+    dedupe_threshold: Optional[float] = None
+
+    # size of torch's intra-op thread pool. Torch's default if None.
+    threads: Optional[int] = None
+
+    # size of torch's inter-op thread pool. Torch's default if None.
+    interop_threads: Optional[int] = None
+
+    # refit the identifier on a background thread when the registry changes,
+    # and keep using the previous one until then.
+    background_refresh: bool = False
+
+    # collect the latency of each pipeline stage, if given.
+    metrics: Optional[Metrics] = None
+
+    # append the work of MTCNN's stages per detection to this JSON lines file, if given.
+    detection_profile_path: Optional[Path] = None
+
+    # registry generation the identifier has been fitted to.
+    _identifier_generation: int = field(default=0, init=False, repr=False)
+
+    # thread that refits the identifier, if any.
+    _refit: Optional[threading.Thread] = field(default=None, init=False, repr=False)
+
+    # guards starting a refit.
+    _refit_lock: threading.Lock = field(
+        default_factory=threading.Lock, init=False, repr=False, compare=False
+    )
+
+    # guards writing to the detection profile file.
+    _profile_lock: threading.Lock = field(
+        default_factory=threading.Lock, init=False, repr=False, compare=False
+    )
+
+    def __post_init__(self) -> None:
+        # NOTE: thread pools are process-wide; the inter-op pool can only be
+        # configured before any parallel work has started.
+        if self.threads is None and self.interop_threads is None:
+            return
+        import torch
+
+        if self.threads is not None:
+            torch.set_num_threads(self.threads)
+        if (
+            self.interop_threads is not None
+            and self.interop_threads != torch.get_num_interop_threads()
+        ):
+            try:
+                torch.set_num_interop_threads(self.interop_threads)
+            except RuntimeError:
+                logger.warning(
+                    "cannot set %d inter-op threads once parallel work has started",
+                    self.interop_threads,
+                )
+
+    @cached_property
+    def torch_device(self) -> torch.device:
+        """Return the device to run on."""
+        import torch
+
+        if self.device:
+            return torch.device(self.device)
+        return torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+
+    def _timer(self, stage: str) -> ContextManager:
+        """Return a context that records its duration as *stage*, if metrics are on."""
+        if self.metrics is None:
+            return contextlib.nullcontext()
+        return self.metrics.timer(stage)
+
     @cached_property
     def annotate(self) -> Annotate:
-        return PILAnnotate()
+        from faces.drawing import CVAnnotate, PILAnnotate
+        from faces.metrics import TimedAnnotate
+
+        annotate: Annotate
+        if self.annotator == "cv":
+            annotate = CVAnnotate()
+        elif self.annotator == "pil":
+            annotate = PILAnnotate()
+        else:
+            raise ValueError(f"unknown annotator: {self.annotator}")
+        if self.metrics is not None:
+            return TimedAnnotate(annotate, self.metrics)
+        return annotate
 
     @cached_property
     def identifier(self) -> Identifier:
-        return ConstrainedNearestNeighbourClassifier.fit(
-            samples=self.registry,
+        identifier, self._identifier_generation = self._fit_identifier()
+        return self._timed_identifier(identifier)
+
+    def _timed_identifier(self, identifier: Identifier) -> Identifier:
+        """Return *identifier*, timed if metrics are on."""
+        from faces.metrics import TimedIdentifier
+
+        if self.metrics is None:
+            return identifier
+        return TimedIdentifier(identifier, self.encoder, self.metrics)
+
+    def _fit_identifier(self) -> Tuple[Identifier, int]:
+        """Return an identifier fitted to the registry, and the registry's generation."""
+        from faces.identifier import (
+            ConstrainedNearestNeighbourClassifier,
+            Projection,
+            VotingNearestNeighbourClassifier,
+        )
+        from faces.registry import open_registry
+
+        projection = None
+        if self.pca_dims is not None and self.projection_path.exists():
+            projection = Projection.load(self.projection_path, self.torch_device)
+        classifier = ConstrainedNearestNeighbourClassifier
+        options: Dict[str, Any] = {}
+        if self.vote_k is not None:
+            classifier = VotingNearestNeighbourClassifier
+            options["k"] = self.vote_k
+        from faces.metrics import TimedEncoder
+
+        encoder = self.encoder
+        if isinstance(encoder, TimedEncoder):
+            # encoding the references is part of the fit
+            encoder = encoder.encoder
+        # NOTE: a registry of its own, as the shared deduplicating registry
+        # may be refreshed by another thread while a background refit reads it
+        registry = open_registry(self.registry_path, self._registry_device)
+        options.update(
             distance_threshold=self.distance_threshold,
             restklasse=self.restklasse,
-            encoder=self.encoder,
+            encoder=encoder,
+            precision=self.precision,
+            pca_dims=self.pca_dims,
+            shortlist=self.shortlist,
+            projection=projection,
         )
+        with self._timer("fit"):
+            if (stored := registry.stored_encodings()) is not None:
+                # encoded when the registry was exported
+                identifier = classifier.fit_encodings(*stored, **options)
+            else:
+                identifier = classifier.fit(
+                    registry, batch_size=self.batch_size, **options
+                )
+        if (
+            identifier.projection is not None
+            and identifier.projection is not projection
+        ):
+            identifier.projection.save(self.projection_path)
+        # NOTE: the generation is taken after the faces have been read
+        return identifier, registry.generation
+
+    def reload(self) -> Builder:
+        # the deduplicating registry holds the faces it read when it was opened
+        self.__dict__.pop("_deduplicating_registry", None)
+        return super().reload()
+
+    def refresh(self) -> bool:
+        """Refit the identifier if the registry changed on disc. With
+        *background_refresh*, the identifier is refitted on a background
+        thread and replaces the current one once it is ready.
+        Return True if the identifier was dropped or a refit started.
+        """
+        from faces.registry import stored_generation
+
+        if (
+            "identifier" not in self.__dict__
+            or stored_generation(self.registry_path) == self._identifier_generation
+        ):
+            return False
+        if not self.background_refresh:
+            self.reload()
+            return True
+        with self._refit_lock:
+            if self._refit is not None and self._refit.is_alive():
+                # a later refresh picks up changes made during the refit
+                return False
+            self._refit = threading.Thread(
+                target=self._swap_identifier, name="faces-refit", daemon=True
+            )
+            self._refit.start()
+        return True
+
+    def _swap_identifier(self) -> None:
+        """Fit a new identifier and replace the current one."""
+        try:
+            identifier, generation = self._fit_identifier()
+        except Exception:  # pylint: disable=broad-exception-caught
+            logger.exception("cannot refit the identifier")
+            return
+        # NOTE: replacing the attribute is atomic; callers that already hold
+        # the previous identifier finish with it.
+        self.identifier = self._timed_identifier(identifier)
+        self._identifier_generation = generation
+
+    @property
+    def projection_path(self) -> Path:
+        """Return the path at which the coarse search projection is stored."""
+        return self.registry_path.with_name(self.registry_path.name + ".pca")
 
     @cached_property
     def encoder(self) -> Encoder:
-        return ResnetEncoder(
-            device=self.device,
+        from faces.encoder import ResnetEncoder
+        from faces.metrics import TimedEncoder
+
+        encoder = ResnetEncoder(
+            device=self.torch_device,
         )
+        if self.metrics is not None:
+            return TimedEncoder(encoder, self.metrics)
+        return encoder
 
     @cached_property
     def detector(self) -> Detector:
-        return MTCNNDetector(
-            device=self.device,
+        from faces.detector import MTCNNDetector
+        from faces.metrics import TimedDetector
+
+        detector = MTCNNDetector(
+            device=self.torch_device,
             probability_threshold=self.probability_threshold,
             min_face_size=self.min_face_size,
             thresholds=self.thresholds,
             factor=self.factor,
+            tile_size=self.tile_size,
+            tile_overlap=self.tile_overlap,
+            profile=(
+                self._on_detection
+                if self.metrics is not None or self.detection_profile_path is not None
+                else None
+            ),
         )
+        if self.metrics is not None:
+            return TimedDetector(detector, self.metrics)
+        return detector
+
+    def _on_detection(self, profile: DetectionProfile) -> None:
+        """Record the work of MTCNN's stages in a detection."""
+        if self.metrics is not None:
+            # sub-stages of "detect"
+            self.metrics.observe("detect.pnet", profile.pnet_seconds)
+            self.metrics.observe("detect.rnet", profile.rnet_seconds)
+            self.metrics.observe("detect.onet", profile.onet_seconds)
+        if self.detection_profile_path is not None:
+            with self._profile_lock, open(
+                self.detection_profile_path, "a", encoding="utf-8"
+            ) as stream:
+                stream.write(json.dumps(asdict(profile)) + "\n")
+
+    def open_image(self, path: Path) -> Image:
+        from faces.types import Image
+
+        with self._timer("preprocess"):
+            return Image.open(
+                path, target_size=self.target_size, keep_source=self.crop_from_source
+            )
 
     @property
     def registry(self) -> Registry:
-        return PickleRegistry.open(self.registry_path, self.device)
+        from faces.registry import open_registry
+
+        if self.dedupe_threshold is not None:
+            registry = self._deduplicating_registry
+            registry.refresh()
+            return registry
+        return open_registry(self.registry_path, self._registry_device)
+
+    @cached_property
+    def _deduplicating_registry(self) -> Registry:
+        # cached to keep the encodings of known faces across accesses
+        from faces.dedupe import DeduplicatingRegistry
+        from faces.registry import open_registry
+
+        assert self.dedupe_threshold is not None
+        return DeduplicatingRegistry(
+            open_registry(self.registry_path, self._registry_device),
+            encoder=self.encoder,
+            distance_threshold=self.dedupe_threshold,
+            batch_size=self.batch_size,
+        )
+
+    def _registry_device(self) -> torch.device:
+        # NOTE: passed to registries uncalled, so that torch is only imported
+        # when their faces are loaded (e.g. not to list the identities)
+        return self.torch_device
 
     @classmethod
     def from_args(cls, args) -> Builder:
-        device = args.device
-        if not device:
-            device = "cuda:0" if torch.cuda.is_available() else "cpu"
+        from faces.metrics import Metrics
 
         return cls(
-            device=torch.device(device),
+            device=args.device,
             registry_path=args.registry_path,
             probability_threshold=args.probability_threshold,
             distance_threshold=args.distance_threshold,
+            precision=args.precision,
+            pca_dims=args.pca_dims,
+            shortlist=args.shortlist,
+            vote_k=args.vote_k,
+            batch_size=args.batch_size,
+            dedupe_threshold=args.dedupe_threshold,
+            annotator=args.annotator,
+            target_size=args.target_size,
+            crop_from_source=args.crop_from_source,
+            tile_size=args.tile_size,
+            tile_overlap=args.tile_overlap,
+            threads=args.threads,
+            interop_threads=args.interop_threads,
+            background_refresh=args.background_refresh,
+            metrics=Metrics() if args.profile else None,
+            detection_profile_path=args.profile_detector,
         )
 
     @classmethod
     def from_defaults(cls) -> Builder:
         return cls(
-            device=torch.device("cuda:0" if torch.cuda.is_available() else "cpu"),
+            device=None,
             registry_path=Path("~/.faces.pkl").expanduser(),
         )
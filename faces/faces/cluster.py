@@ -0,0 +1,245 @@
+from __future__ import annotations
+
+import json
+import math
+from collections import defaultdict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, TextIO, Tuple
+
+import numpy as np
+import torch
+
+from faces import BoundingBox, Builder, FacePatch, Identity
+from faces.library import LibraryFace
+
+
+class _UnionFind:
+    """Disjoint sets over the integers 0, ..., N-1."""
+
+    parent: np.ndarray
+
+    def __init__(self, size: int):
+        self.parent = np.arange(size)
+
+    def find(self, item: int) -> int:
+        """Return the representative of *item*'s set."""
+        root = item
+        while self.parent[root] != root:
+            root = self.parent[root]
+        # path compression
+        while self.parent[item] != root:
+            self.parent[item], item = root, self.parent[item]
+        return root
+
+    def union(self, first: int, second: int) -> None:
+        """Merge the sets of *first* and *second*."""
+        first, second = self.find(first), self.find(second)
+        if first != second:
+            self.parent[max(first, second)] = min(first, second)
+
+
+@dataclass(frozen=True)
+class InvertedIndex:
+    """Approximate nearest neighbour index over an inverted file.
+
+    The references are partitioned into cells around k-means centroids. A
+    query is only compared to the references in the cells of its *probes*
+    nearest centroids. With about sqrt(N) cells of about sqrt(N) references
+    each, searching all N references for their neighbours takes O(N^1.5)
+    distances rather than O(N^2). Neighbours in cells that are not probed
+    are missed.
+    """
+
+    # (N, D) references.
+    encodings: torch.Tensor
+
+    # (C, D) centroids of the cells.
+    centroids: torch.Tensor
+
+    # (N,) row indices of the references, ordered by cell.
+    order: torch.Tensor
+
+    # (C + 1,) start of each cell in *order*, followed by N.
+    offsets: torch.Tensor
+
+    @classmethod
+    def fit(
+        cls,
+        encodings: torch.Tensor,
+        cells: Optional[int] = None,
+        iterations: int = 10,
+        chunk_size: int = 1024,
+    ) -> InvertedIndex:
+        """Partition (N, D) *encodings* into *cells* (sqrt(N) by default)
+        by *iterations* rounds of k-means.
+        """
+        cells = min(cells or max(1, math.isqrt(len(encodings))), len(encodings))
+        generator = torch.Generator().manual_seed(0)
+        initial = torch.randperm(len(encodings), generator=generator)[:cells]
+        centroids = encodings[initial.to(encodings.device)].float()
+        for _ in range(iterations):
+            assignment = _assign(encodings, centroids, chunk_size)
+            sums = torch.zeros_like(centroids).index_add_(
+                0, assignment, encodings.float()
+            )
+            sizes = torch.bincount(assignment, minlength=cells)
+            # empty cells keep their centroid
+            filled = sizes > 0
+            centroids[filled] = sums[filled] / sizes[filled].unsqueeze(1)
+        assignment = _assign(encodings, centroids, chunk_size)
+        order = torch.argsort(assignment, stable=True)
+        offsets = torch.zeros(cells + 1, dtype=torch.long, device=encodings.device)
+        offsets[1:] = torch.cumsum(torch.bincount(assignment, minlength=cells), 0)
+        return cls(
+            encodings=encodings, centroids=centroids, order=order, offsets=offsets
+        )
+
+    def search(
+        self, queries: torch.Tensor, k: int, probes: int = 8, chunk_size: int = 1024
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Return the (M, k) distances and row indices of the k nearest
+        references of M *queries* among the references in their *probes*
+        nearest cells, sorted by ascending distance. Missing neighbours
+        have an infinite distance and index -1. The queries of a cell are
+        compared to its references *chunk_size* queries at a time.
+        """
+        k = min(k, len(self.encodings))
+        best_distances = torch.full(
+            (len(queries), k), float("inf"), device=queries.device
+        )
+        best_indices = torch.full(
+            (len(queries), k), -1, dtype=torch.long, device=queries.device
+        )
+        probed = torch.topk(
+            torch.cdist(queries.float(), self.centroids),
+            min(probes, len(self.centroids)),
+            dim=1,
+            largest=False,
+        ).indices
+        for cell in range(len(self.centroids)):
+            members = self.order[self.offsets[cell] : self.offsets[cell + 1]]
+            if not len(members):
+                continue
+            (probing,) = torch.nonzero((probed == cell).any(dim=1), as_tuple=True)
+            for start in range(0, len(probing), chunk_size):
+                rows = probing[start : start + chunk_size]
+                distances, columns = torch.topk(
+                    torch.cdist(queries[rows].float(), self.encodings[members].float()),
+                    min(k, len(members)),
+                    dim=1,
+                    largest=False,
+                )
+                # merge with the neighbours found in other cells
+                distances, merged = torch.topk(
+                    torch.cat([best_distances[rows], distances], dim=1),
+                    k,
+                    dim=1,
+                    largest=False,
+                )
+                indices = torch.gather(
+                    torch.cat([best_indices[rows], members[columns]], dim=1),
+                    1,
+                    merged,
+                )
+                best_distances[rows], best_indices[rows] = distances, indices
+        return best_distances, best_indices
+
+
+def _assign(
+    encodings: torch.Tensor, centroids: torch.Tensor, chunk_size: int
+) -> torch.Tensor:
+    """Return the index of the nearest of *centroids* of each of *encodings*."""
+    return torch.cat(
+        [
+            torch.cdist(
+                encodings[start : start + chunk_size].float(), centroids
+            ).argmin(dim=1)
+            for start in range(0, len(encodings), chunk_size)
+        ]
+    )
+
+
+def cluster(
+    encodings: torch.Tensor,
+    distance_threshold: float,
+    neighbours: int = 16,
+    probes: int = 8,
+    chunk_size: int = 1024,
+) -> List[List[int]]:
+    """Group N *encodings* given as an (N, D) tensor by their distance.
+
+    Encodings are linked if one is among the *neighbours* nearest neighbours
+    of the other, and their distance is at most *distance_threshold*. Return
+    the connected components of the linked encodings as lists of row indices,
+    largest first. Neighbours are searched in an `InvertedIndex` that probes
+    *probes* cells, and *chunk_size* encodings are compared at once.
+    """
+    if not len(encodings):
+        return []
+    index = InvertedIndex.fit(encodings, chunk_size=chunk_size)
+    components = _UnionFind(len(encodings))
+    # the nearest neighbour of each encoding is itself
+    distances, targets = index.search(
+        encodings, neighbours + 1, probes=probes, chunk_size=chunk_size
+    )
+    rows, columns = torch.nonzero(distances <= distance_threshold, as_tuple=True)
+    for row, target in zip(rows.tolist(), targets[rows, columns].tolist()):
+        components.union(row, target)
+
+    groups: Dict[int, List[int]] = {}
+    for item in range(len(encodings)):
+        groups.setdefault(components.find(item), []).append(item)
+    return sorted(groups.values(), key=len, reverse=True)
+
+
+def write_clusters(stream: TextIO, clusters: Sequence[Sequence[LibraryFace]]) -> None:
+    """Write *clusters* as JSON lines, with a blank identity to be filled in."""
+    for faces in clusters:
+        record = {
+            "identity": None,
+            "faces": [
+                {"path": str(face.path), "box": list(face.box.as_tuple)}
+                for face in faces
+            ],
+        }
+        stream.write(json.dumps(record) + "\n")
+
+
+def read_clusters(
+    stream: TextIO,
+) -> List[Tuple[Optional[Identity], List[Tuple[Path, BoundingBox]]]]:
+    """Read clusters written by `write_clusters`."""
+    return [
+        (
+            record["identity"] or None,
+            [
+                (Path(face["path"]), BoundingBox(*face["box"]))
+                for face in record["faces"]
+            ],
+        )
+        for record in map(json.loads, stream)
+    ]
+
+
+def enrol_clusters(
+    builder: Builder,
+    clusters: Sequence[Tuple[Optional[Identity], Sequence[Tuple[Path, BoundingBox]]]],
+) -> List[str]:
+    """Add the faces of all *clusters* that have an identity to the registry.
+    Crops the faces again from their images, and commits once.
+    Return the reasons of faces that were skipped.
+    """
+    boxes: Dict[Path, List[Tuple[BoundingBox, Identity]]] = defaultdict(list)
+    for identity, faces in clusters:
+        if identity is not None:
+            for path, box in faces:
+                boxes[path].append((box, identity))
+
+    items: List[Tuple[FacePatch, Identity]] = []
+    for path, boxes_and_identity in boxes.items():
+        patches = builder.detector.crop(
+            builder.open_image(path), [box for box, _ in boxes_and_identity]
+        )
+        items.extend(zip(patches, (identity for _, identity in boxes_and_identity)))
+    return builder.registry.add_many(items)
@@ -0,0 +1,176 @@
+from collections import defaultdict
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import torch
+
+from faces import Encoder, FacePatch, Identity, Registry
+from faces.identifier import encode_samples
+
+
+def duplicates(
+    encodings: torch.Tensor, distance_threshold: float, chunk_size: int = 1024
+) -> torch.Tensor:
+    """Return a boolean mask of the N *encodings* given as an (N, D) tensor
+    that are within *distance_threshold* of an earlier encoding that is kept.
+    Distances to *chunk_size* encodings are computed at once.
+    """
+    duplicate = torch.zeros(len(encodings), dtype=torch.bool)
+    for start in range(0, len(encodings), chunk_size):
+        chunk = encodings[start : start + chunk_size]
+        close = (
+            torch.cdist(chunk, encodings[: start + len(chunk)]) <= distance_threshold
+        ).cpu()
+        for offset in range(len(chunk)):
+            row = start + offset
+            duplicate[row] = bool((close[offset, :row] & ~duplicate[:row]).any())
+    return duplicate
+
+
+def find_near_duplicates(
+    samples: Iterable[Tuple[FacePatch, Identity]],
+    *,
+    encoder: Encoder,
+    distance_threshold: float,
+    batch_size: int = 256,
+) -> List[Tuple[FacePatch, Identity]]:
+    """Return the *samples* that are near duplicates of another sample
+    of the same identity, keeping the first of each group of near duplicates.
+    """
+    samples = list(samples)
+    identities, encodings = encode_samples(
+        samples, encoder=encoder, batch_size=batch_size, capacity=len(samples)
+    )
+    if encodings is None:
+        return []
+    rows: Dict[Identity, List[int]] = defaultdict(list)
+    for row, identity in enumerate(identities):
+        rows[identity].append(row)
+    return [
+        samples[row]
+        for group in rows.values()
+        for row, duplicate in zip(
+            group, duplicates(encodings[group], distance_threshold)
+        )
+        if duplicate
+    ]
+
+
+class DeduplicatingRegistry(Registry):
+    """Skip faces that are near duplicates of a known face of the same identity.
+    Wraps another registry, whose faces are encoded on first use.
+    """
+
+    registry: Registry
+
+    encoder: Encoder
+
+    # faces within this distance of a known face are skipped.
+    distance_threshold: float
+
+    batch_size: int
+
+    def __init__(
+        self,
+        registry: Registry,
+        encoder: Encoder,
+        distance_threshold: float,
+        batch_size: int = 256,
+    ):
+        self.registry = registry
+        self.encoder = encoder
+        self.distance_threshold = distance_threshold
+        self.batch_size = batch_size
+        self._encodings: Dict[Identity, torch.Tensor] = {}
+        self._loaded = False
+
+    def _known(self, identity: Identity) -> torch.Tensor:
+        """Return the encodings of the known faces of *identity*."""
+        if not self._loaded:
+            identities, encodings = encode_samples(
+                self.registry, encoder=self.encoder, batch_size=self.batch_size
+            )
+            if encodings is not None:
+                rows: Dict[Identity, List[int]] = defaultdict(list)
+                for row, id_ in enumerate(identities):
+                    rows[id_].append(row)
+                self._encodings = {id_: encodings[group] for id_, group in rows.items()}
+            self._loaded = True
+        return self._encodings.get(identity, torch.empty((0,)))
+
+    def _check(self, encoding: torch.Tensor, identity: Identity) -> None:
+        """Raise a ValueError if *encoding* is a near duplicate of a known face."""
+        known = self._known(identity)
+        if len(known):
+            distance = float(torch.cdist(encoding.unsqueeze(0), known).min())
+            if distance <= self.distance_threshold:
+                raise ValueError(
+                    f"near duplicate of a face of {identity} (distance {distance:.3f})"
+                )
+
+    def _remember(self, encoding: torch.Tensor, identity: Identity) -> None:
+        """Add *encoding* to the known faces of *identity*."""
+        known = self._known(identity)
+        self._encodings[identity] = (
+            torch.cat([known, encoding.unsqueeze(0)])
+            if len(known)
+            else encoding.unsqueeze(0)
+        )
+
+    def add(self, face_patch: FacePatch, identity: Identity) -> None:
+        encoding = self.encoder(face_patch)
+        self._check(encoding, identity)
+        self.registry.add(face_patch, identity)
+        self._remember(encoding, identity)
+
+    def add_many(self, items: Iterable[Tuple[FacePatch, Identity]]) -> List[str]:
+        items = list(items)
+        if not items:
+            return []
+        encodings = self.encoder.many(
+            torch.stack([patch for patch, _ in items]), batch_size=self.batch_size
+        )
+        accepted, skipped = [], []
+        for (patch, identity), encoding in zip(items, encodings):
+            try:
+                self._check(encoding, identity)
+            except ValueError as error:
+                skipped.append(str(error))
+            else:
+                # also catch near duplicates within *items*
+                self._remember(encoding, identity)
+                accepted.append((patch, identity))
+        return skipped + self.registry.add_many(accepted)
+
+    def remove(self, identity: Identity) -> None:
+        self._encodings.pop(identity, None)
+        self.registry.remove(identity)
+
+    def discard(self, items: Iterable[Tuple[FacePatch, Identity]]) -> None:
+        # encodings of the remaining faces are recomputed on demand
+        self._loaded = False
+        self._encodings = {}
+        self.registry.discard(items)
+
+    def counts(self) -> Dict[Identity, int]:
+        return self.registry.counts()
+
+    @property
+    def generation(self) -> int:
+        return self.registry.generation
+
+    def refresh(self) -> bool:
+        if not self.registry.refresh():
+            return False
+        # encodings of the changed faces are recomputed on demand
+        self._loaded = False
+        self._encodings = {}
+        return True
+
+    def stored_encodings(self) -> Optional[Tuple[List[Identity], torch.Tensor]]:
+        return self.registry.stored_encodings()
+
+    def __iter__(self) -> Iterator[Tuple[FacePatch, Identity]]:
+        return iter(self.registry)
+
+    def __len__(self) -> int:
+        return len(self.registry)
@@ -1,10 +1,59 @@
-from typing import Iterable, Iterator, Tuple
+import threading
+import time
+from dataclasses import dataclass
+from functools import partial
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
 
 import numpy as np
 import torch
 from facenet_pytorch import MTCNN
+from PIL import Image as PILImage
+from torchvision.ops import nms
 
-from faces import BoundingBox, Detector, FacePatch, FaceProbability, Image
+from faces import BoundingBox, Detector, FacePatch, FaceProbability, Frame, Image
+
+# boxes and probabilities of the faces detected by MTCNN, or None if there are none.
+_Detections = Tuple[Optional[np.ndarray], Optional[np.ndarray]]
+
+
+@dataclass
+class DetectionProfile:
+    """Work done by the stages of MTCNN to detect the faces in an image.
+
+    P-Net proposes candidate boxes on each scale of an image pyramid, R-Net
+    refines them, and O-Net decides on the final faces. The time of a stage
+    includes resampling the candidates and suppressing their overlaps.
+    """
+
+    # size of the image the faces were detected in.
+    width: int = 0
+    height: int = 0
+
+    # number of P-Net passes, one per pyramid scale (and batch of tiles).
+    scales: int = 0
+
+    # number of candidates that P-Net passed on to R-Net.
+    rnet_candidates: int = 0
+
+    # number of candidates that R-Net passed on to O-Net.
+    onet_candidates: int = 0
+
+    # number of faces found by O-Net, before the probability threshold.
+    faces: int = 0
+
+    pnet_seconds: float = 0.0
+    rnet_seconds: float = 0.0
+    onet_seconds: float = 0.0
 
 
 class MTCNNDetector(Detector):
@@ -16,6 +65,15 @@ class MTCNNDetector(Detector):
 
     device: torch.device
 
+    tile_size: Optional[int]
+
+    tile_overlap: int
+
+    tile_batch_size: int
+
+    # called with the work of MTCNN's stages after each detection, if given.
+    profile: Optional[Callable[[DetectionProfile], None]]
+
     def __init__(
         self,
         # torch device.
@@ -30,9 +88,22 @@ class MTCNNDetector(Detector):
         factor: float = 0.709,
         # size of the extracted patch.
         patch_size: int = 160,
+        # split images whose larger side exceeds this size into tiles. Tiles are
+        # cut from the source image if it is kept, else from the downsized one.
+        tile_size: Optional[int] = None,
+        # overlap between neighbouring tiles. Should exceed the largest face size.
+        tile_overlap: int = 200,
+        # number of tiles that are processed at once.
+        tile_batch_size: int = 8,
+        # called with the work of MTCNN's stages after each detection, if given.
+        profile: Optional[Callable[[DetectionProfile], None]] = None,
     ):
+        assert tile_size is None or tile_overlap < tile_size
         self.device = device
         self.probability_threshold = probability_threshold
+        self.tile_size = tile_size
+        self.tile_overlap = tile_overlap
+        self.tile_batch_size = tile_batch_size
         # initialize the face detection network
         self.model = MTCNN(
             min_face_size=min_face_size,
@@ -42,17 +113,206 @@ class MTCNNDetector(Detector):
             keep_all=True,
             image_size=patch_size,
         )
+        self.profile = profile
+        # the detection that is profiled in the current thread
+        self._local = threading.local()
+        if profile is not None:
+            for stage in ("pnet", "rnet", "onet"):
+                getattr(self.model, stage).register_forward_pre_hook(
+                    partial(self._on_stage, stage)
+                )
 
-    def detect(self, image: Image) -> Iterable[Tuple[BoundingBox, FaceProbability]]:
-        boxes, probs = self.model.detect(image.image)
+    @torch.inference_mode()
+    def detect(
+        self, image: Union[Image, Frame]
+    ) -> Iterable[Tuple[BoundingBox, FaceProbability]]:
+        if self.profile is None:
+            boxes, probs = self._detect(image)
+        else:
+            boxes, probs = self._detect_profiled(image)
         if boxes is None:  # no boxes to return
             return
         for box, prob in zip(boxes, probs):
             if prob >= self.probability_threshold:
                 yield BoundingBox(*box), prob
 
-    def extract(self, image: Image) -> Iterator[Tuple[BoundingBox, FacePatch]]:
-        for box, _ in self.detect(image):
-            yield box, self.model.extract(
-                image.image, np.array(box.as_tuple).reshape(1, -1), None
-            ).squeeze(0).to(self.device)
+    @torch.inference_mode()
+    def many(
+        self, images: Sequence[Union[Image, Frame]]
+    ) -> List[List[Tuple[BoundingBox, FaceProbability]]]:
+        """Detect faces in images of the same size in one pass of MTCNN.
+        Frames, and images that are tiled or profiled, are processed one by one.
+        """
+        if self.profile is not None or self.tile_size is not None:
+            return super().many(images)
+        results: List[List[Tuple[BoundingBox, FaceProbability]]] = [[] for _ in images]
+        groups: Dict[Tuple[Tuple[int, int], str], List[int]] = {}
+        for index, image in enumerate(images):
+            if isinstance(image, Frame):
+                results[index] = list(self.detect(image))
+            else:
+                groups.setdefault((image.image.size, image.image.mode), []).append(
+                    index
+                )
+        for indices in groups.values():
+            batch_boxes, batch_probs = self.model.detect(
+                [images[index].image for index in indices]
+            )
+            for index, boxes, probs in zip(indices, batch_boxes, batch_probs):
+                if boxes is None:
+                    continue
+                results[index] = [
+                    (BoundingBox(*box), prob)
+                    for box, prob in zip(boxes, probs)
+                    if prob >= self.probability_threshold
+                ]
+        return results
+
+    def _detect(self, image: Union[Image, Frame]) -> _Detections:
+        """Return the boxes and probabilities of the faces in *image*."""
+        if isinstance(image, Frame):
+            # NOTE: MTCNN takes (strided) RGB arrays as they are
+            return self.model.detect(image.rgb)
+        if self.tile_size is None:
+            return self.model.detect(image.image)
+        # NOTE: tiles are cut from the full resolution image, if it was kept
+        pixels = image.image if image.source is None else image.source
+        if max(pixels.size) <= self.tile_size:
+            return self.model.detect(image.image)
+        boxes, probs = self._detect_tiled(pixels, self.tile_size)
+        if boxes is None:
+            return None, None
+        # boxes refer to the preprocessed image
+        return boxes / image.source_scale, probs
+
+    def _detect_profiled(self, image: Union[Image, Frame]) -> _Detections:
+        """Detect the faces in *image*, and report the work of MTCNN's stages."""
+        assert self.profile is not None
+        if isinstance(image, Frame):
+            height, width = image.buffer.shape[:2]
+        else:
+            width, height = image.image.size
+        profile = DetectionProfile(width=width, height=height)
+        self._local.profile = profile
+        self._enter("pnet")
+        try:
+            boxes, probs = self._detect(image)
+        finally:
+            self._enter(None)
+            self._local.profile = None
+        profile.faces = 0 if boxes is None else len(boxes)
+        self.profile(profile)
+        return boxes, probs
+
+    def _enter(self, stage: Optional[str]) -> None:
+        """Add the time since the current stage started to its profile,
+        and start *stage*.
+        """
+        now = time.perf_counter()
+        current = getattr(self._local, "stage", None)
+        if current is not None:
+            seconds = f"{current}_seconds"
+            profile = self._local.profile
+            setattr(
+                profile, seconds, getattr(profile, seconds) + now - self._local.since
+            )
+        self._local.stage, self._local.since = stage, now
+
+    def _on_stage(self, stage: str, _: torch.nn.Module, inputs: Tuple) -> None:
+        """Count the candidates that are passed to the *stage* network."""
+        profile = getattr(self._local, "profile", None)
+        if profile is None:
+            # not called from detect
+            return
+        if self._local.stage != stage:
+            self._enter(stage)
+        if stage == "pnet":
+            profile.scales += 1
+        else:
+            # NOTE: large numbers of candidates are passed in several batches
+            setattr(
+                profile,
+                f"{stage}_candidates",
+                getattr(profile, f"{stage}_candidates") + len(inputs[0]),
+            )
+
+    def _detect_tiled(self, pixels: PILImage.Image, tile_size: int) -> _Detections:
+        """Detect faces in overlapping tiles of *pixels*.
+        Boxes that touch a tile border inside the image are discarded, since
+        the face is fully contained in a neighbouring tile if it is smaller
+        than the tile overlap. Duplicates from overlapping tiles are
+        removed via non-maximum suppression.
+        """
+        width, height = pixels.size
+        stride = tile_size - self.tile_overlap
+        origins = [
+            (left, top)
+            for top in range(0, max(height - self.tile_overlap, 1), stride)
+            for left in range(0, max(width - self.tile_overlap, 1), stride)
+        ]
+
+        all_boxes: List[np.ndarray] = []
+        all_probs: List[np.ndarray] = []
+        for start in range(0, len(origins), self.tile_batch_size):
+            batch = origins[start : start + self.tile_batch_size]
+            # NOTE: tiles beyond the image border are padded to the same size
+            batch_boxes, batch_probs = self.model.detect(
+                [
+                    pixels.crop((left, top, left + tile_size, top + tile_size))
+                    for left, top in batch
+                ]
+            )
+            for (left, top), boxes, probs in zip(batch, batch_boxes, batch_probs):
+                if boxes is None:
+                    continue
+                boxes = boxes + np.array([left, top, left, top])
+                inner = (
+                    ((boxes[:, 0] > left + 1) | (left == 0))
+                    & ((boxes[:, 1] > top + 1) | (top == 0))
+                    & (
+                        (boxes[:, 2] < left + tile_size - 1)
+                        | (left + tile_size >= width)
+                    )
+                    & (
+                        (boxes[:, 3] < top + tile_size - 1)
+                        | (top + tile_size >= height)
+                    )
+                )
+                all_boxes.append(boxes[inner])
+                all_probs.append(probs[inner].astype(np.float32))
+
+        if not all_boxes or not sum(len(boxes) for boxes in all_boxes):
+            return None, None
+        boxes = np.concatenate(all_boxes)
+        probs = np.concatenate(all_probs)
+        keep = nms(torch.from_numpy(boxes).float(), torch.from_numpy(probs), 0.5)
+        return boxes[keep.numpy()], probs[keep.numpy()]
+
+    @torch.inference_mode()
+    def extract(
+        self, image: Union[Image, Frame]
+    ) -> Iterator[Tuple[BoundingBox, FacePatch]]:
+        boxes = [box for box, _ in self.detect(image)]
+        if boxes:
+            yield from zip(boxes, self.crop(image, boxes))
+
+    @torch.inference_mode()
+    def crop(
+        self, image: Union[Image, Frame], boxes: Sequence[BoundingBox]
+    ) -> torch.Tensor:
+        """Return the (N, ...) face patches enclosed by N bounding *boxes*.
+        Crops from the source image if the image has one, in which case
+        the *boxes* are scaled accordingly.
+        """
+        if not boxes:
+            return torch.empty(
+                (0, 3, self.model.image_size, self.model.image_size),
+                device=self.device,
+            )
+        boxes_array = np.array([box.as_tuple for box in boxes]).reshape(-1, 4)
+        if isinstance(image, Frame):
+            return self.model.extract(image.rgb, boxes_array, None).to(self.device)
+        pixels = image.image if image.source is None else image.source
+        return self.model.extract(pixels, boxes_array * image.source_scale, None).to(
+            self.device
+        )
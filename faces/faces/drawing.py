@@ -1,10 +1,14 @@
+from abc import abstractmethod
 from dataclasses import dataclass
-from typing import Iterable, Tuple
+from typing import Iterable, Tuple, Union
 
+import cv2
+import numpy as np
+from numpy.typing import NDArray
 from PIL import Image as PILImage
 from PIL import ImageDraw, ImageFont
 
-from faces import Annotate, BoundingBox, FaceProbability, Identity, Image
+from faces import Annotate, BoundingBox, FaceProbability, Frame, Identity, Image
 
 FONT = ImageFont.truetype("Pillow/Tests/fonts/FreeMono.ttf", 30)
 
@@ -31,45 +35,78 @@ class Color:
         """Return the color as (red, green, blue, alpha)-tuple."""
         return self.red, self.green, self.blue, self.alpha
 
+    @property
+    def as_bgr(self) -> Tuple[int, int, int]:
+        """Return the color as (blue, green, red)-tuple, as used by OpenCV."""
+        return self.blue, self.green, self.red
 
-@dataclass(frozen=True)
-class PILAnnotate(Annotate):
-    """Draw on images with PIL."""
 
-    line_width: int = 6
-    box_color: Color = Color(255, 0, 0)
-    font_color: Color = Color(255, 255, 255, 0)
+def as_pil(annotated: Union[PILImage.Image, Frame]) -> PILImage.Image:
+    """Return an annotated image or frame as PIL image."""
+    if isinstance(annotated, Frame):
+        return annotated.to_image().image
+    return annotated
+
+
+def as_bgr(annotated: Union[PILImage.Image, Frame]) -> NDArray:
+    """Return an annotated image or frame as BGR array, as used by OpenCV."""
+    if isinstance(annotated, Frame):
+        return annotated.buffer
+    return cv2.cvtColor(np.asarray(annotated), cv2.COLOR_RGB2BGR)
+
+
+class _LabelAnnotate(Annotate):
+    """Annotate images by drawing labelled bounding boxes."""
 
     def with_probability(
         self,
-        image: Image,
+        image: Union[Image, Frame],
         boxes_and_probability: Iterable[Tuple[BoundingBox, FaceProbability]],
-    ) -> PILImage.Image:
+    ) -> Union[PILImage.Image, Frame]:
         return self._annotate(
             image, ((box, f"{prob:0.5f}") for box, prob in boxes_and_probability)
         )
 
     def with_identity(
         self,
-        image: Image,
+        image: Union[Image, Frame],
         boxes_and_identity: Iterable[Tuple[BoundingBox, Identity]],
-    ) -> PILImage.Image:
+    ) -> Union[PILImage.Image, Frame]:
         return self._annotate(image, boxes_and_identity)
 
     def with_enumeration(
-        self, image: Image, boxes: Iterable[BoundingBox], start: int = 0
-    ) -> PILImage.Image:
+        self, image: Union[Image, Frame], boxes: Iterable[BoundingBox], start: int = 0
+    ) -> Union[PILImage.Image, Frame]:
         return self._annotate(
             image,
             ((box, str(index)) for index, box in enumerate(boxes, start)),
         )
 
-    def __call__(self, image: Image, boxes: Iterable[BoundingBox]) -> PILImage.Image:
+    def __call__(
+        self, image: Union[Image, Frame], boxes: Iterable[BoundingBox]
+    ) -> Union[PILImage.Image, Frame]:
         return self._annotate(image, ((box, "") for box in boxes))
 
+    @abstractmethod
     def _annotate(
         self,
-        image: Image,
+        image: Union[Image, Frame],
+        boxes_and_labels: Iterable[Tuple[BoundingBox, str]],
+    ) -> Union[PILImage.Image, Frame]:
+        """Draw bounding boxes and their labels into *image*. Return the annotated image."""
+
+
+@dataclass(frozen=True)
+class PILAnnotate(_LabelAnnotate):
+    """Draw on images with PIL."""
+
+    line_width: int = 6
+    box_color: Color = Color(255, 0, 0)
+    font_color: Color = Color(255, 255, 255, 0)
+
+    def _annotate(
+        self,
+        image: Union[Image, Frame],
         boxes_and_labels: Iterable[Tuple[BoundingBox, str]],
     ) -> PILImage.Image:
         """Draw bounding boxes and their labels into a copy of *img*. Return the new image.
@@ -84,6 +121,8 @@ class PILAnnotate(Annotate):
         * label_format: Format string for box labels of float or int type.
 
         """
+        if isinstance(image, Frame):
+            image = image.to_image()
         image = image.image.copy()
         draw = ImageDraw.Draw(image)
         for box, label in boxes_and_labels:
@@ -102,3 +141,56 @@ class PILAnnotate(Annotate):
                 )
 
         return image
+
+
+@dataclass(frozen=True)
+class CVAnnotate(_LabelAnnotate):
+    """Draw on frames with OpenCV.
+    Draws directly into the frame's buffer unless *copy* is set.
+    Images are converted to frames (and thus copied) before drawing.
+    """
+
+    line_width: int = 2
+    box_color: Color = Color(255, 0, 0)
+    font_color: Color = Color(255, 255, 255)
+    font_scale: float = 0.8
+    copy: bool = False
+
+    def _annotate(
+        self,
+        image: Union[Image, Frame],
+        boxes_and_labels: Iterable[Tuple[BoundingBox, str]],
+    ) -> Frame:
+        """Draw bounding boxes and their labels into the buffer of *image*. Return the frame."""
+        if isinstance(image, Image):
+            frame = Frame(cv2.cvtColor(np.asarray(image.image), cv2.COLOR_RGB2BGR))
+        elif self.copy:
+            frame = Frame(image.buffer.copy())
+        else:
+            frame = image
+
+        for box, label in boxes_and_labels:
+            left, top, right, bottom = (int(value) for value in box.as_tuple)
+            cv2.rectangle(
+                frame.buffer,
+                (left, top),
+                (right, bottom),
+                self.box_color.as_bgr,
+                self.line_width,
+            )
+            if label:
+                (_, text_height), _ = cv2.getTextSize(
+                    label, cv2.FONT_HERSHEY_SIMPLEX, self.font_scale, 1
+                )
+                cv2.putText(
+                    frame.buffer,
+                    label,
+                    (left + self.line_width, top + self.line_width + text_height),
+                    cv2.FONT_HERSHEY_SIMPLEX,
+                    self.font_scale,
+                    self.font_color.as_bgr,
+                    1,
+                    cv2.LINE_AA,
+                )
+
+        return frame
@@ -0,0 +1,225 @@
+import json
+import logging
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import partial
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Set, Tuple
+
+from faces import BoundingBox, Builder, Detector, FacePatch, Identity, Registry
+from faces.batch import prefetch
+from faces.registry import patch_digest
+
+logger = logging.getLogger(__name__)
+
+# file suffixes that are considered images when walking a directory.
+IMAGE_SUFFIXES = frozenset({".jpg", ".jpeg", ".png", ".bmp", ".gif", ".tif", ".tiff"})
+
+
+def identity_from_path(path: Path) -> Identity:
+    """Derive an identity from a file or directory name."""
+    return Identity(path.stem.lower().replace("-", "_").replace("_", " "))
+
+
+def _digests(registry: Registry) -> Dict[bytes, Set[Identity]]:
+    """Return the identities of each patch in *registry*, by digest."""
+    known_as: Dict[bytes, Set[Identity]] = defaultdict(set)
+    for face_patch, identity in registry:
+        known_as[patch_digest(face_patch)].add(identity)
+    return known_as
+
+
+def walk(paths: Sequence[Path]) -> Iterator[Tuple[Path, Path]]:
+    """Yield image files and the path that names their identity.
+    A file is named by itself. Images directly within a directory are named
+    by that directory, as in `register`, and images in its subdirectories (at
+    any depth) by the subdirectory at its top level.
+    """
+    for path in paths:
+        if path.is_file():
+            yield path, path
+        elif path.is_dir():
+            for child in sorted(path.rglob("*")):
+                if child.is_file() and child.suffix.lower() in IMAGE_SUFFIXES:
+                    if child.parent == path:
+                        yield child, path
+                    else:
+                        yield child, path / child.relative_to(path).parts[0]
+
+
+@dataclass
+class EnrolmentStatistics:
+    """Counters of a bulk enrolment."""
+
+    images: int = 0
+    resumed: int = 0
+    added: int = 0
+    # faces that were already known under the same identity.
+    known: int = 0
+    skipped: int = 0
+    no_face: int = 0
+    review: int = 0
+    errors: int = 0
+    seconds: float = 0.0
+
+    def __str__(self) -> str:
+        return (
+            f"enrolled {self.added} faces from {self.images} images"
+            f" in {self.seconds:0.2f}s ({self.resumed} resumed,"
+            f" {self.known} known faces, {self.skipped} skipped faces, {self.no_face} without faces,"
+            f" {self.review} to review, {self.errors} errors)"
+        )
+
+
+@dataclass
+class BulkEnrolment:
+    """Add faces of many images to the registry without user interaction.
+
+    Images are decoded and their faces detected in a thread pool. Images
+    with exactly one face are added to the registry in batches, images with
+    several faces are written to the review file, if any. Processed images
+    are appended to the checkpoint file after each batch has been committed,
+    so that an interrupted enrolment resumes where it stopped.
+
+    The registry is opened once per run. Since committing a batch rewrites
+    the registry, batches grow with the registry (see *commit_fraction*), so
+    that the total work stays linear in the number of images.
+    """
+
+    builder: Builder
+
+    # use this identity for all faces rather than deriving it from the path.
+    identity: Optional[Identity] = None
+
+    # JSON lines file listing images with several faces, if any.
+    review_path: Optional[Path] = None
+
+    # file listing the images that have been processed, if any.
+    checkpoint_path: Optional[Path] = None
+
+    # number of threads that decode images and detect faces.
+    workers: int = 4
+
+    # minimal number of images whose faces are committed at once.
+    batch_size: int = 256
+
+    # commit the faces of at least this fraction of the registry's size at once.
+    commit_fraction: float = 0.1
+
+    def run(self, paths: Sequence[Path]) -> EnrolmentStatistics:
+        """Enrol the images at *paths*."""
+        statistics = EnrolmentStatistics()
+        start = time.perf_counter()
+        done = self._load_checkpoint()
+
+        def _todo() -> Iterator[Tuple[Path, Path]]:
+            for image_path, label in walk(paths):
+                if str(image_path) in done:
+                    statistics.resumed += 1
+                else:
+                    yield image_path, label
+
+        registry = self.builder.registry
+        known_as = _digests(registry)
+
+        batch: List[Tuple[FacePatch, Identity]] = []
+        processed: List[Path] = []
+        with ThreadPoolExecutor(self.workers) as executor:
+            # the detector is created before the worker threads share it
+            for (image_path, label), future in prefetch(
+                executor,
+                partial(self._extract, self.builder.detector),
+                _todo(),
+                2 * self.workers,
+            ):
+                statistics.images += 1
+                processed.append(image_path)
+                try:
+                    faces = future.result()
+                except (OSError, ValueError) as error:
+                    logger.warning(f"cannot read {image_path}: {error}")
+                    statistics.errors += 1
+                else:
+                    if not faces:
+                        statistics.no_face += 1
+                    elif len(faces) == 1:
+                        batch.append(
+                            (faces[0][1], self.identity or identity_from_path(label))
+                        )
+                    else:
+                        statistics.review += 1
+                        self._review(image_path, label, [box for box, _ in faces])
+
+                if len(processed) >= max(
+                    self.batch_size, self.commit_fraction * len(registry)
+                ):
+                    self._commit(registry, known_as, batch, processed, statistics)
+                    batch, processed = [], []
+
+            self._commit(registry, known_as, batch, processed, statistics)
+        statistics.seconds = time.perf_counter() - start
+        return statistics
+
+    def _extract(
+        self, detector: Detector, item: Tuple[Path, Path]
+    ) -> List[Tuple[BoundingBox, FacePatch]]:
+        """Return the faces of the image at *item*."""
+        image_path, _ = item
+        return list(detector.extract(self.builder.open_image(image_path)))
+
+    def _commit(
+        self,
+        registry: Registry,
+        known_as: Dict[bytes, Set[Identity]],
+        batch: List[Tuple[FacePatch, Identity]],
+        processed: List[Path],
+        statistics: EnrolmentStatistics,
+    ) -> None:
+        """Add the faces in *batch* that are not *known_as* their identity to
+        *registry*, and mark *processed* as done.
+        """
+        if batch:
+            new, skipped = [], []
+            for face_patch, identity in batch:
+                digest = patch_digest(face_patch)
+                if digest not in known_as:
+                    known_as[digest] = {identity}
+                    new.append((face_patch, identity))
+                elif known_as[digest] == {identity}:
+                    statistics.known += 1
+                else:
+                    skipped.append(f"already known as {known_as[digest]}")
+            rejected = registry.add_many(new)
+            statistics.added += len(new) - len(rejected)
+            skipped += rejected
+            for reason in skipped:
+                logger.info(f"skipping face: {reason}")
+            statistics.skipped += len(skipped)
+        if self.checkpoint_path is not None and processed:
+            with open(self.checkpoint_path, "a") as checkpoint_file:
+                checkpoint_file.writelines(f"{path}\n" for path in processed)
+
+    def _review(self, image_path: Path, label: Path, boxes: List[BoundingBox]) -> None:
+        """Note an image with several faces for a later review."""
+        if self.review_path is None:
+            return
+        with open(self.review_path, "a") as review_file:
+            review_file.write(
+                json.dumps(
+                    {
+                        "path": str(image_path),
+                        "identity": self.identity or identity_from_path(label),
+                        "boxes": [list(map(float, box.as_tuple)) for box in boxes],
+                    }
+                )
+                + "\n"
+            )
+
+    def _load_checkpoint(self) -> Set[str]:
+        """Return the images that have been processed in a previous run."""
+        if self.checkpoint_path is None or not self.checkpoint_path.exists():
+            return set()
+        with open(self.checkpoint_path) as checkpoint_file:
+            return {line.rstrip("\n") for line in checkpoint_file if line.strip()}
@@ -1,16 +1,19 @@
 from __future__ import annotations
 
-from collections.abc import Iterable, Mapping
-from dataclasses import dataclass
-from typing import Tuple
+from collections import Counter
+from collections.abc import Iterable, Mapping, Sequence, Sized
+from dataclasses import dataclass, replace
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
 
 import torch
+from torch.nn import functional as F
 
 from faces import Encoder, FaceEncoding, FacePatch, Identifier, Identity
 
 
 @dataclass(frozen=True)
-class _NearestNeighbour:
+class NearestNeighbour:
     """Nearest neighbour classifier."""
 
     encodings: torch.Tensor
@@ -20,17 +23,49 @@ class _NearestNeighbour:
     def __post_init__(self) -> None:
         assert len(self.encodings) == len(self.targets)
 
+    def distances(self, queries: torch.Tensor) -> torch.Tensor:
+        """Return the (M, N) distances between M *queries* and the N references."""
+        return torch.cdist(queries, self.encodings)
+
+    def gathered_distances(
+        self, queries: torch.Tensor, index: torch.Tensor
+    ) -> torch.Tensor:
+        """Return the (M, S) distances between M *queries* and the S references
+        at the corresponding row of the (M, S) *index*.
+        """
+        candidates = self.encodings[index.to(self.encodings.device)]
+        return torch.cdist(queries.unsqueeze(1), candidates).squeeze(1)
+
+    def select(self, index: torch.Tensor) -> NearestNeighbour:
+        """Return a classifier restricted to the references at *index*."""
+        return replace(
+            self,
+            encodings=self.encodings[index.to(self.encodings.device)],
+            targets=self.targets[index.to(self.targets.device)],
+        )
+
+    def search(
+        self, queries: torch.Tensor, k: int
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Return the (M, k) distances and targets of the k nearest neighbours
+        of M *queries*, sorted by ascending distance.
+        """
+        # pairwise distances
+        dist = self.distances(queries)
+        # indices of the lowest distances
+        distances, indices = torch.topk(
+            dist, min(k, len(self.encodings)), dim=1, largest=False
+        )
+        return distances, self.targets[indices.to(self.targets.device)]
+
     def __call__(self, encoding: FaceEncoding) -> Tuple[int, float]:
         """Return the nearest neighbour and its distance to *encoding*."""
-        # pairwise distances
-        dist = torch.cdist(encoding.unsqueeze(0), self.encodings).squeeze(0)
-        # index of lowest distance
-        min_distance, min_index = torch.min(dist, 0)
+        distances, targets = self.search(encoding.unsqueeze(0), 1)
         # return identity and distance
-        return int(self.targets[min_index].item()), min_distance.item()
+        return int(targets[0, 0].item()), distances[0, 0].item()
 
     @classmethod
-    def empty(cls) -> _NearestNeighbour:
+    def empty(cls) -> NearestNeighbour:
         """Return a nearest neighbour classifier without references."""
         return cls(
             encodings=torch.empty((0,)),
@@ -43,6 +78,255 @@ class _NearestNeighbour:
         return len(self.encodings) == 0
 
 
+@dataclass(frozen=True)
+class CosineNearestNeighbour(NearestNeighbour):
+    """Nearest neighbour classifier on compactly stored, L2-normalized references.
+
+    The references are stored as float32, float16, or as int8 codes with a
+    per-reference *scales* factor. Distances are computed from the cosine
+    similarity (a single matmul) and mapped to the euclidean distance between
+    unit vectors, i.e. sqrt(2 - 2 * cos), so that distance thresholds retain
+    their meaning.
+    """
+
+    # per-reference scale of int8 codes.
+    scales: Optional[torch.Tensor] = None
+
+    # number of references that are decompressed at once.
+    chunk_size: int = 65536
+
+    @classmethod
+    def from_encodings(
+        cls, encodings: torch.Tensor, targets: torch.Tensor, precision: str
+    ) -> CosineNearestNeighbour:
+        """Return a classifier that stores *encodings* with the given *precision*."""
+        encodings = F.normalize(encodings.float(), dim=1)
+        if precision == "float32":
+            return cls(encodings=encodings, targets=targets)
+        if precision == "float16":
+            return cls(encodings=encodings.half(), targets=targets)
+        if precision == "int8":
+            # symmetric scalar quantization, one scale per reference
+            scales = encodings.abs().amax(dim=1).clamp_min(1e-12) / 127.0
+            codes = torch.round(encodings / scales.unsqueeze(1)).to(torch.int8)
+            return cls(encodings=codes, targets=targets, scales=scales)
+        raise ValueError(f"unknown precision: {precision}")
+
+    def select(self, index: torch.Tensor) -> NearestNeighbour:
+        if self.scales is None:
+            return super().select(index)
+        return replace(
+            super().select(index), scales=self.scales[index.to(self.scales.device)]
+        )
+
+    def distances(self, queries: torch.Tensor) -> torch.Tensor:
+        queries = F.normalize(queries.float(), dim=1)
+        similarity = torch.empty(
+            (len(queries), len(self.encodings)), device=queries.device
+        )
+        for start in range(0, len(self.encodings), self.chunk_size):
+            chunk = self.encodings[start : start + self.chunk_size]
+            similarity[:, start : start + len(chunk)] = queries @ chunk.float().T
+        if self.scales is not None:
+            similarity *= self.scales
+        return torch.sqrt((2.0 - 2.0 * similarity).clamp_min(0.0))
+
+    def gathered_distances(
+        self, queries: torch.Tensor, index: torch.Tensor
+    ) -> torch.Tensor:
+        queries = F.normalize(queries.float(), dim=1)
+        index = index.to(self.encodings.device)
+        similarity = torch.empty(index.shape, device=queries.device)
+        # at most chunk_size references are decompressed at once
+        step = max(1, self.chunk_size // max(index.shape[1], 1))
+        for start in range(0, len(queries), step):
+            candidates = self.encodings[index[start : start + step]].float()
+            similarity[start : start + step] = torch.bmm(
+                candidates, queries[start : start + step].unsqueeze(2)
+            ).squeeze(2)
+        if self.scales is not None:
+            similarity *= self.scales[index]
+        return torch.sqrt((2.0 - 2.0 * similarity).clamp_min(0.0))
+
+
+@dataclass(frozen=True)
+class Projection:
+    """Projection of encodings onto their principal components."""
+
+    # (D,) mean of the encodings the projection was fitted on.
+    mean: torch.Tensor
+
+    # (D, K) principal axes.
+    components: torch.Tensor
+
+    # number of encodings the projection was fitted on.
+    num_samples: int
+
+    @classmethod
+    def fit(cls, encodings: torch.Tensor, dims: int) -> Projection:
+        """Return the projection of *encodings* onto their *dims* principal components."""
+        encodings = encodings.float()
+        mean = encodings.mean(dim=0)
+        _, _, axes = torch.linalg.svd(encodings - mean, full_matrices=False)
+        return cls(
+            mean=mean, components=axes[:dims].T.contiguous(), num_samples=len(encodings)
+        )
+
+    @property
+    def dims(self) -> int:
+        """Return the dimensionality of the projected encodings."""
+        return self.components.shape[1]
+
+    def __call__(self, encodings: torch.Tensor) -> torch.Tensor:
+        """Project (N, D) *encodings* to (N, K)."""
+        return (encodings.float() - self.mean) @ self.components
+
+    @classmethod
+    def load(cls, path: Path, device: Union[torch.device, str]) -> Projection:
+        """Load a projection from *path*."""
+        state = torch.load(path, map_location=device)
+        return cls(
+            mean=state["mean"],
+            components=state["components"],
+            num_samples=state["num_samples"],
+        )
+
+    def save(self, path: Path) -> None:
+        """Store the projection at *path*."""
+        torch.save(
+            {
+                "mean": self.mean.cpu(),
+                "components": self.components.cpu(),
+                "num_samples": self.num_samples,
+            },
+            path,
+        )
+
+
+@dataclass(frozen=True)
+class ShortlistNearestNeighbour:
+    """Two-stage nearest neighbour classifier.
+    Compares the projected encodings to find a shortlist of candidates,
+    then re-ranks the candidates on their full encodings.
+    """
+
+    exact: NearestNeighbour
+
+    projection: Projection
+
+    # (N, K) projected references.
+    projected: torch.Tensor
+
+    # number of candidates to re-rank.
+    shortlist: int
+
+    @classmethod
+    def from_classifier(
+        cls,
+        exact: NearestNeighbour,
+        encodings: torch.Tensor,
+        projection: Projection,
+        shortlist: int,
+    ) -> ShortlistNearestNeighbour:
+        """Return a two-stage classifier on top of *exact*.
+        *encodings* are the uncompressed references of *exact*.
+        """
+        return cls(
+            exact=exact,
+            projection=projection,
+            projected=projection(encodings),
+            shortlist=shortlist,
+        )
+
+    @property
+    def encodings(self) -> torch.Tensor:
+        """Return the references."""
+        return self.exact.encodings
+
+    @property
+    def targets(self) -> torch.Tensor:
+        """Return the reference targets."""
+        return self.exact.targets
+
+    @property
+    def is_empty(self) -> bool:
+        """Return True if the classifier has no references."""
+        return self.exact.is_empty
+
+    def search(
+        self, queries: torch.Tensor, k: int
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Return the (M, k) distances and targets of the k nearest neighbours
+        of M *queries*, sorted by ascending distance.
+        """
+        coarse = torch.cdist(self.projection(queries), self.projected)
+        _, candidates = torch.topk(
+            coarse,
+            min(max(k, self.shortlist), len(self.projected)),
+            dim=1,
+            largest=False,
+        )
+        # re-rank the candidates of all queries at once
+        distances, order = torch.topk(
+            self.exact.gathered_distances(queries, candidates),
+            min(k, candidates.shape[1]),
+            dim=1,
+            largest=False,
+        )
+        indices = torch.gather(candidates, 1, order)
+        return distances, self.targets[indices.to(self.targets.device)]
+
+    def __call__(self, encoding: FaceEncoding) -> Tuple[int, float]:
+        """Return the nearest neighbour and its distance to *encoding*."""
+        distances, targets = self.search(encoding.unsqueeze(0), 1)
+        return int(targets[0, 0].item()), distances[0, 0].item()
+
+
+@torch.inference_mode()
+def encode_samples(
+    samples: Iterable[Tuple[FacePatch, Identity]],
+    *,
+    encoder: Encoder,
+    batch_size: int,
+    capacity: Optional[int] = None,
+) -> Tuple[List[Identity], Optional[torch.Tensor]]:
+    """Encode *samples* in batches of *batch_size* patches.
+    Return the labels and their (N, D) encodings, or None if there were no samples.
+    The encodings are written into a tensor of *capacity* rows if the
+    number of samples is known upfront.
+    """
+    labels: List[Identity] = []
+    chunks: List[torch.Tensor] = []
+    encodings: Optional[torch.Tensor] = None
+    patches: List[FacePatch] = []
+
+    def _flush() -> None:
+        nonlocal encodings
+        chunk = encoder.many(torch.stack(patches))
+        if capacity is None:
+            chunks.append(chunk)
+            return
+        if encodings is None:
+            encodings = chunk.new_empty((capacity, chunk.shape[1]))
+        encodings[len(labels) - len(patches) : len(labels)] = chunk
+
+    for patch, label in samples:
+        patches.append(patch)
+        labels.append(label)
+        if len(patches) == batch_size:
+            _flush()
+            patches.clear()
+    if patches:
+        _flush()
+
+    if not labels:
+        return labels, None
+    if capacity is None:
+        return labels, torch.cat(chunks)
+    assert encodings is not None
+    return labels, encodings[: len(labels)]
+
+
 @dataclass(frozen=True)
 class ConstrainedNearestNeighbourClassifier(Identifier):
     """Open-world nearest neighbour classifier.
@@ -60,7 +344,7 @@ class ConstrainedNearestNeighbourClassifier(Identifier):
 
     index2identity: Mapping[int, Identity]
 
-    classifier: _NearestNeighbour
+    classifier: Union[NearestNeighbour, ShortlistNearestNeighbour]
 
     @classmethod
     def fit(
@@ -70,36 +354,107 @@ class ConstrainedNearestNeighbourClassifier(Identifier):
         encoder: Encoder,
         distance_threshold: float = 1.0,
         restklasse: Identity = Identity("Anonymous"),
+        precision: Optional[str] = None,
+        pca_dims: Optional[int] = None,
+        shortlist: int = 100,
+        projection: Optional[Projection] = None,
+        batch_size: int = 256,
     ) -> Identifier:
-        """Return an identifier that is fitted to *samples*."""
+        """Return an identifier that is fitted to *samples*.
+
+        By default, the reference encodings are kept as they are and compared
+        by their euclidean distance. Set *precision* to "float32", "float16",
+        or "int8" to L2-normalize the references, store them in the given
+        format, and compare them through their cosine similarity instead.
+
+        Set *pca_dims* to first compare queries and references on their
+        *pca_dims* principal components, and only compare the *shortlist*
+        closest candidates on their full encodings. A previously fitted
+        *projection* is re-used unless its dimensionality differs or the
+        number of references has more than doubled since it was fitted.
+
+        The *samples* are streamed and encoded *batch_size* patches at a time.
+
+        """
         # filter
         valid_samples = (
             (patch, label) for patch, label in samples if label != restklasse
         )
-        try:
-            # unpack
-            patches, labels = zip(*valid_samples)
-        except ValueError:
-            # valid_samples was empty
+        labels, encodings = encode_samples(
+            valid_samples,
+            encoder=encoder,
+            batch_size=batch_size,
+            capacity=len(samples) if isinstance(samples, Sized) else None,
+        )
+        return cls.fit_encodings(
+            labels,
+            encodings,
+            encoder=encoder,
+            distance_threshold=distance_threshold,
+            restklasse=restklasse,
+            precision=precision,
+            pca_dims=pca_dims,
+            shortlist=shortlist,
+            projection=projection,
+        )
+
+    @classmethod
+    def fit_encodings(
+        cls,
+        labels: Sequence[Identity],
+        encodings: Optional[torch.Tensor],
+        *,
+        encoder: Encoder,
+        distance_threshold: float = 1.0,
+        restklasse: Identity = Identity("Anonymous"),
+        precision: Optional[str] = None,
+        pca_dims: Optional[int] = None,
+        shortlist: int = 100,
+        projection: Optional[Projection] = None,
+    ) -> Identifier:
+        """Return an identifier that is fitted to the (N, D) *encodings* of
+        faces with the given *labels*, as computed by *encoder*. Faces of the
+        *restklasse* are ignored. See `fit` for the other parameters.
+        """
+        if encodings is not None and restklasse in labels:
+            valid = [index for index, label in enumerate(labels) if label != restklasse]
+            labels = [labels[index] for index in valid]
+            encodings = encodings[valid] if valid else None
+        if encodings is None or not len(encodings):
+            # no valid samples
             return cls(
                 encoder=encoder,
                 distance_threshold=distance_threshold,
                 restklasse=restklasse,
                 index2identity={},
-                classifier=_NearestNeighbour.empty(),
+                classifier=NearestNeighbour.empty(),
             )
 
         # index/identity mappings
         index2identity = dict(enumerate(set(labels)))
         identity2index = {identity: index for index, identity in index2identity.items()}
-        # classifier
-        classifier = _NearestNeighbour(
-            encodings=encoder.many(torch.stack(patches)),
-            # NOTE: targets can be on the cpu no matter the encodings
-            targets=torch.tensor(
-                [identity2index[label] for label in labels], device=torch.device("cpu")
-            ),
+        # NOTE: targets can be on the cpu no matter the encodings
+        targets = torch.tensor(
+            [identity2index[label] for label in labels], device=torch.device("cpu")
         )
+        # classifier
+        classifier: Union[NearestNeighbour, ShortlistNearestNeighbour]
+        if precision is None:
+            classifier = NearestNeighbour(encodings=encodings, targets=targets)
+        else:
+            classifier = CosineNearestNeighbour.from_encodings(
+                encodings, targets, precision
+            )
+        if pca_dims is not None and len(encodings) > shortlist:
+            if (
+                projection is None
+                or projection.dims != pca_dims
+                or len(encodings) > 2 * projection.num_samples
+            ):
+                projection = Projection.fit(encodings, pca_dims)
+            classifier = ShortlistNearestNeighbour.from_classifier(
+                classifier, encodings, projection, shortlist
+            )
         return cls(
             encoder=encoder,
             distance_threshold=distance_threshold,
@@ -108,6 +463,13 @@ class ConstrainedNearestNeighbourClassifier(Identifier):
             classifier=classifier,
         )
 
+    @property
+    def projection(self) -> Optional[Projection]:
+        """Return the projection of the coarse search, if any."""
+        if isinstance(self.classifier, ShortlistNearestNeighbour):
+            return self.classifier.projection
+        return None
+
     def nearest_neighbour(self, face_patch: FacePatch) -> Tuple[Identity, float]:
         """Return the nearest neighbour and its distance."""
         if self.classifier.is_empty:
@@ -115,9 +477,125 @@ class ConstrainedNearestNeighbourClassifier(Identifier):
         identity_index, distance = self.classifier(self.encoder(face_patch))
         return self.index2identity[identity_index], distance
 
+    def top_k(self, face_patch: FacePatch, k: int) -> List[Tuple[Identity, float]]:
+        """Return the k nearest neighbours and their distances."""
+        return self.many_top_k(face_patch.unsqueeze(0), k)[0]
+
+    def many_top_k(
+        self, patches: torch.Tensor, k: int
+    ) -> List[List[Tuple[Identity, float]]]:
+        """Return the k nearest neighbours and their distances for each of N
+        face *patches* given as an (N, ...) tensor.
+        """
+        if self.classifier.is_empty:
+            return [[] for _ in patches]
+        return self.top_k_encodings(self.encoder.many(patches), k)
+
+    def top_k_encodings(
+        self, encodings: torch.Tensor, k: int
+    ) -> List[List[Tuple[Identity, float]]]:
+        """Return the k nearest neighbours and their distances for each of N
+        *encodings* given as an (N, D) tensor.
+        """
+        if self.classifier.is_empty:
+            return [[] for _ in encodings]
+        distances, targets = self.classifier.search(
+            encodings.to(self.classifier.encodings.device), k
+        )
+        return [
+            [
+                (self.index2identity[int(target)], float(distance))
+                for distance, target in zip(distances_i, targets_i)
+            ]
+            for distances_i, targets_i in zip(distances.tolist(), targets.tolist())
+        ]
+
     def __call__(self, face_patch: FacePatch) -> Identity:
         """Return the nearest neighbour's identity."""
         identity, dist = self.nearest_neighbour(face_patch)
         if dist > self.distance_threshold:
             return self.restklasse
         return identity
+
+    def many(self, patches: torch.Tensor) -> List[Identity]:
+        """Return the nearest neighbours' identities of N face *patches*
+        given as an (N, ...) tensor. Encodes all patches at once.
+        """
+        if self.classifier.is_empty:
+            return [self.restklasse for _ in patches]
+        return self.identify_encodings(self.encoder.many(patches))
+
+    def identify_encodings(self, encodings: torch.Tensor) -> List[Identity]:
+        """Return the nearest neighbours' identities of N *encodings*
+        given as an (N, D) tensor.
+        """
+        if self.classifier.is_empty:
+            return [self.restklasse for _ in encodings]
+        return [
+            identity if dist <= self.distance_threshold else self.restklasse
+            for ((identity, dist),) in self.top_k_encodings(encodings, 1)
+        ]
+
+
+@dataclass(frozen=True)
+class VotingNearestNeighbourClassifier(ConstrainedNearestNeighbourClassifier):
+    """Open-world k-nearest neighbour classifier.
+    Identifies a face by majority vote among its k nearest neighbours
+    that are within the distance threshold. Ties are broken in favour
+    of the identity with the closest reference.
+    """
+
+    k: int = 5
+
+    @classmethod
+    def fit(  # type: ignore[override]
+        cls,
+        samples: Iterable[Tuple[FacePatch, Identity]],
+        *,
+        k: int = 5,
+        **kwargs,
+    ) -> Identifier:
+        """Return an identifier that is fitted to *samples*.
+        See `ConstrainedNearestNeighbourClassifier.fit` for the other parameters.
+        """
+        return replace(super().fit(samples, **kwargs), k=k)
+
+    @classmethod
+    def fit_encodings(  # type: ignore[override]
+        cls,
+        labels: Sequence[Identity],
+        encodings: Optional[torch.Tensor],
+        *,
+        k: int = 5,
+        **kwargs,
+    ) -> Identifier:
+        """Return an identifier that is fitted to *encodings* of *labels*.
+        See `ConstrainedNearestNeighbourClassifier.fit_encodings` for the
+        other parameters.
+        """
+        return replace(super().fit_encodings(labels, encodings, **kwargs), k=k)
+
+    def __call__(self, face_patch: FacePatch) -> Identity:
+        """Return the identity most common among the nearest neighbours."""
+        return self._vote(self.top_k(face_patch, self.k))
+
+    def identify_encodings(self, encodings: torch.Tensor) -> List[Identity]:
+        """Return the identities most common among the nearest neighbours of
+        N *encodings* given as an (N, D) tensor.
+        """
+        return [
+            self._vote(neighbours)
+            for neighbours in self.top_k_encodings(encodings, self.k)
+        ]
+
+    def _vote(self, neighbours: Iterable[Tuple[Identity, float]]) -> Identity:
+        """Return the identity most common among *neighbours*."""
+        votes: Counter[Identity] = Counter()
+        closest: Dict[Identity, float] = {}
+        for identity, dist in neighbours:
+            if dist <= self.distance_threshold:
+                votes[identity] += 1
+                closest.setdefault(identity, dist)
+        if not votes:
+            return self.restklasse
+        return max(votes, key=lambda identity: (votes[identity], -closest[identity]))
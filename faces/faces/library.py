@@ -0,0 +1,360 @@
+from __future__ import annotations
+
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import partial
+from pathlib import Path
+from typing import Iterator, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+import torch
+
+from faces import BoundingBox, Builder, Detector, FaceProbability
+from faces.batch import prefetch
+from faces.enrol import IMAGE_SUFFIXES
+from faces.identifier import NearestNeighbour
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    width INTEGER NOT NULL,
+    height INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS faces (
+    id INTEGER PRIMARY KEY,
+    file_id INTEGER NOT NULL REFERENCES files (id) ON DELETE CASCADE,
+    left REAL NOT NULL,
+    top REAL NOT NULL,
+    right REAL NOT NULL,
+    bottom REAL NOT NULL,
+    probability REAL NOT NULL,
+    encoding BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS faces_file_id ON faces (file_id);
+"""
+
+
+@dataclass(frozen=True)
+class LibraryFace:
+    """A face detected in a library file."""
+
+    path: Path
+    box: BoundingBox
+    probability: FaceProbability
+
+
+class Library:
+    """Store the faces and encodings of a photo library in a sqlite database.
+    Files are keyed by their path, and are considered unchanged as long as
+    their size and modification time remain the same.
+    """
+
+    connection: sqlite3.Connection
+
+    def __init__(self, path: Path):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        self.connection.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        """Close the database."""
+        self.connection.close()
+
+    def __enter__(self) -> Library:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        """Return the number of indexed files."""
+        return self.connection.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    def is_current(self, path: Path, stat: os.stat_result) -> bool:
+        """Return True if the file at *path* has been indexed in its current state."""
+        return (
+            self.connection.execute(
+                "SELECT 1 FROM files WHERE path = ? AND size = ? AND mtime_ns = ?",
+                (str(path), stat.st_size, stat.st_mtime_ns),
+            ).fetchone()
+            is not None
+        )
+
+    def paths(self) -> Set[Path]:
+        """Return the paths of all indexed files."""
+        return {
+            Path(path) for (path,) in self.connection.execute("SELECT path FROM files")
+        }
+
+    def update(
+        self,
+        path: Path,
+        stat: os.stat_result,
+        size: Tuple[int, int],
+        faces: Sequence[Tuple[BoundingBox, FaceProbability]],
+        encodings: torch.Tensor,
+    ) -> None:
+        """Replace the faces of the file at *path*. Does not commit."""
+        self.connection.execute("DELETE FROM files WHERE path = ?", (str(path),))
+        file_id = self.connection.execute(
+            "INSERT INTO files (path, size, mtime_ns, width, height)"
+            " VALUES (?, ?, ?, ?, ?)",
+            (str(path), stat.st_size, stat.st_mtime_ns, *size),
+        ).lastrowid
+        self.connection.executemany(
+            "INSERT INTO faces"
+            " (file_id, left, top, right, bottom, probability, encoding)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    file_id,
+                    *map(float, box.as_tuple),
+                    float(probability),
+                    encoding.tobytes(),
+                )
+                for (box, probability), encoding in zip(
+                    faces,
+                    encodings.detach().cpu().numpy().astype(np.float32, copy=False),
+                )
+            ],
+        )
+
+    def remove(self, paths: Sequence[Path]) -> None:
+        """Remove the files at *paths*. Does not commit."""
+        self.connection.executemany(
+            "DELETE FROM files WHERE path = ?", [(str(path),) for path in paths]
+        )
+
+    def commit(self) -> None:
+        """Write pending changes to disk."""
+        self.connection.commit()
+
+    def encodings(
+        self, under: Optional[Sequence[Path]] = None
+    ) -> Tuple[List[LibraryFace], Optional[torch.Tensor]]:
+        """Return all faces and their (N, D) encodings, or None if there are no faces.
+        Only return faces of files in the directories or files *under*, if given.
+        """
+        faces: List[LibraryFace] = []
+        rows: List[bytes] = []
+        for path, *box, probability, encoding in self.connection.execute(
+            "SELECT files.path, left, top, right, bottom, probability, encoding"
+            " FROM faces JOIN files ON faces.file_id = files.id"
+            " ORDER BY files.path, faces.id"
+        ):
+            if under is not None and not any(
+                _is_under(Path(path), root) for root in under
+            ):
+                continue
+            faces.append(
+                LibraryFace(Path(path), BoundingBox(*box), FaceProbability(probability))
+            )
+            rows.append(encoding)
+        if not rows:
+            return faces, None
+        matrix = np.frombuffer(b"".join(rows), dtype=np.float32).reshape(len(rows), -1)
+        return faces, torch.from_numpy(matrix.copy())
+
+
+@dataclass(frozen=True)
+class LibrarySearch:
+    """Find the library faces that are most similar to query encodings.
+    Holds all library encodings in one matrix, so that a query is a single
+    vectorized nearest neighbour search.
+    """
+
+    faces: List[LibraryFace]
+
+    index: NearestNeighbour
+
+    @classmethod
+    def from_library(cls, library: Library, device: torch.device) -> LibrarySearch:
+        """Load all faces of *library* into a search index on *device*."""
+        faces, encodings = library.encodings()
+        if encodings is None:
+            return cls(faces=faces, index=NearestNeighbour.empty())
+        return cls(
+            faces=faces,
+            index=NearestNeighbour(
+                encodings=encodings.to(device),
+                targets=torch.arange(len(faces), device=device),
+            ),
+        )
+
+    def __call__(
+        self, encodings: torch.Tensor, k: int
+    ) -> List[List[Tuple[LibraryFace, float]]]:
+        """Return the k most similar library faces and their distances for each
+        of N *encodings* given as an (N, D) tensor, sorted by ascending distance.
+        """
+        if self.index.is_empty:
+            return [[] for _ in encodings]
+        distances, targets = self.index.search(
+            encodings.to(self.index.encodings.device), k
+        )
+        return [
+            [
+                (self.faces[target], distance)
+                for distance, target in zip(distances_i, targets_i)
+            ]
+            for distances_i, targets_i in zip(distances.tolist(), targets.tolist())
+        ]
+
+
+def _is_under(path: Path, root: Path) -> bool:
+    """Return True if *path* is *root* or lies within it."""
+    return path == root or root in path.parents
+
+
+def walk(paths: Sequence[Path]) -> Iterator[Path]:
+    """Yield the image files at or within *paths*, recursively."""
+    for path in paths:
+        if path.is_file():
+            yield path
+        elif path.is_dir():
+            for child in sorted(path.rglob("*")):
+                if child.is_file() and child.suffix.lower() in IMAGE_SUFFIXES:
+                    yield child
+
+
+@dataclass
+class IndexStatistics:
+    """Counters of a library scan."""
+
+    files: int = 0
+    indexed: int = 0
+    unchanged: int = 0
+    removed: int = 0
+    faces: int = 0
+    errors: int = 0
+    seconds: float = 0.0
+
+    def __str__(self) -> str:
+        return (
+            f"indexed {self.indexed} of {self.files} files ({self.faces} faces)"
+            f" in {self.seconds:0.2f}s ({self.unchanged} unchanged,"
+            f" {self.removed} removed, {self.errors} errors)"
+        )
+
+
+@dataclass
+class _Scan:
+    """Faces detected in a file."""
+
+    path: Path
+    stat: os.stat_result
+    size: Tuple[int, int]
+    faces: List[Tuple[BoundingBox, FaceProbability]]
+    patches: torch.Tensor
+
+
+@dataclass
+class LibraryIndexer:
+    """Detect and encode the faces of new or changed files into a library.
+
+    Files are decoded and their faces detected and cropped in a thread pool.
+    Patches of several files are encoded at once. The library is committed
+    after each batch, so that an interrupted scan loses little work.
+    Indexed files that no longer exist are removed from the library.
+    """
+
+    builder: Builder
+
+    library: Library
+
+    # number of threads that decode images and detect faces.
+    workers: int = 4
+
+    # minimal number of faces that are encoded at once.
+    batch_size: int = 64
+
+    def run(self, paths: Sequence[Path]) -> IndexStatistics:
+        """Index the image files at or within *paths*."""
+        statistics = IndexStatistics()
+        start = time.perf_counter()
+        roots = [path.resolve() for path in paths]
+        seen: Set[Path] = set()
+
+        def _todo() -> Iterator[Tuple[Path, os.stat_result]]:
+            for path in walk(roots):
+                statistics.files += 1
+                seen.add(path)
+                try:
+                    stat = path.stat()
+                except OSError as error:
+                    logger.warning(f"cannot read {path}: {error}")
+                    statistics.errors += 1
+                    continue
+                if self.library.is_current(path, stat):
+                    statistics.unchanged += 1
+                else:
+                    yield path, stat
+
+        batch: List[_Scan] = []
+        with ThreadPoolExecutor(self.workers) as executor:
+            # the detector is created before the worker threads share it
+            for (path, _), future in prefetch(
+                executor,
+                partial(self._scan, self.builder.detector),
+                _todo(),
+                2 * self.workers,
+            ):
+                try:
+                    batch.append(future.result())
+                except (OSError, ValueError) as error:
+                    logger.warning(f"cannot read {path}: {error}")
+                    statistics.errors += 1
+                    continue
+                if sum(len(scan.faces) for scan in batch) >= self.batch_size:
+                    self._flush(batch, statistics)
+                    batch = []
+            self._flush(batch, statistics)
+
+        stale = [
+            path
+            for path in self.library.paths()
+            if path not in seen and any(_is_under(path, root) for root in roots)
+        ]
+        self.library.remove(stale)
+        self.library.commit()
+        statistics.removed = len(stale)
+        statistics.seconds = time.perf_counter() - start
+        return statistics
+
+    def _scan(self, detector: Detector, item: Tuple[Path, os.stat_result]) -> _Scan:
+        """Detect and crop the faces of the file at *item*."""
+        path, stat = item
+        image = self.builder.open_image(path)
+        faces = list(detector.detect(image))
+        patches = detector.crop(image, [box for box, _ in faces])
+        return _Scan(path, stat, image.image.size, faces, patches)
+
+    def _flush(self, batch: List[_Scan], statistics: IndexStatistics) -> None:
+        """Encode the faces in *batch* and store them in the library."""
+        if not batch:
+            return
+        patches = torch.cat([scan.patches for scan in batch])
+        encodings = self.builder.encoder.many(patches) if len(patches) else patches
+        offset = 0
+        for scan in batch:
+            num_faces = len(scan.faces)
+            self.library.update(
+                scan.path,
+                scan.stat,
+                scan.size,
+                scan.faces,
+                encodings[offset : offset + num_faces],
+            )
+            offset += num_faces
+            statistics.indexed += 1
+            statistics.faces += num_faces
+        self.library.commit()
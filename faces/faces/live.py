@@ -1,12 +1,13 @@
 import logging
+import time
 from datetime import datetime
 from tempfile import mkstemp
 from typing import Any
 
 import cv2
-import numpy as np
 
-from faces import Builder, FacePatch, Identity, Image, VideoFrame
+from faces import Builder, FacePatch, Frame, Identity, VideoFrame
+from faces.drawing import as_bgr
 
 WINDOW_NAME = "continuous face identification"
 
@@ -22,11 +23,19 @@ class Live:
 
     identified_in_session: Set[Identity]
 
+    # seconds between checks whether other processes changed the registry.
+    refresh_interval: float
+
     def __init__(
-        self, builder: Builder, window_name: str = WINDOW_NAME, video_device: int = 0
+        self,
+        builder: Builder,
+        window_name: str = WINDOW_NAME,
+        video_device: int = 0,
+        refresh_interval: float = 1.0,
     ):
         self.builder = builder
         self.window_name = window_name
+        self.refresh_interval = refresh_interval
         # initialize output window
         cv2.namedWindow(self.window_name)
         # initialize video capture
@@ -40,18 +49,24 @@ class Live:
         cv2.destroyWindow(self.window_name)
 
     def run(self):
+        last_refresh = time.monotonic()
         while True:
             # grab frame
             if not (video_frame := VideoFrame(*self.capture.read())).rval:
                 break
 
-            # load the image
-            image = Image.from_array(video_frame.frame)
+            # load the frame
+            frame = Frame.from_array(video_frame.frame)
+
+            # pick up faces that other processes added to the registry
+            if time.monotonic() - last_refresh >= self.refresh_interval:
+                self.builder.refresh()
+                last_refresh = time.monotonic()
 
-            # identify faces in the image
+            # identify faces in the frame
             extracts = [
                 (bounding_box, face_patch, self.builder.identifier(face_patch))
-                for bounding_box, face_patch in self.builder.detector.extract(image)
+                for bounding_box, face_patch in self.builder.detector.extract(frame)
             ]
 
             # track identified people
@@ -63,12 +78,12 @@ class Live:
                 }
             )
 
-            # annotate the image show it
+            # annotate the frame show it
             cv2.imshow(
                 self.window_name,
-                np.array(
+                as_bgr(
                     self.builder.annotate.with_identity(
-                        image, ((bbox, identity) for bbox, _, identity in extracts)
+                        frame, ((bbox, identity) for bbox, _, identity in extracts)
                     )
                 ),
             )
@@ -76,7 +91,7 @@ class Live:
             if (key := cv2.waitKey(20)) == 27:  # ESC pressed
                 return
             elif key == 32:  # SPACE pressed
-                self.save_frame(image)
+                self.save_frame(frame)
             elif key == 13:  # ENTER pressed
                 try:
                     self.register_face(
@@ -95,11 +110,11 @@ class Live:
             logging.info(f"found {name}")
         self.identified_in_session |= identified
 
-    def save_frame(self, image: Image) -> None:
+    def save_frame(self, frame: Frame) -> None:
         """Save a frame to a file at an auto-generated path."""
         timestamp = datetime.now().isoformat()
         filename = mkstemp(prefix=f"faces-capture-{timestamp}-", suffix=".jpg")[1]
-        image.image.save(filename)
+        cv2.imwrite(filename, frame.buffer)
         logging.info(f"captured image at {filename}")
 
     def register_face(self, unidentified: Set[FacePatch]):
@@ -116,7 +131,8 @@ class Live:
         try:
             (face_patch,) = unidentified
             self.builder.registry.add(face_patch, Identity(user_input))
-            self.builder.reload()
+            if not self.builder.refresh():
+                self.builder.reload()
         except ValueError as error:
             raise ValueError(f"skipping face: {error}") from error
 
@@ -1,18 +1,25 @@
 #!/usr/bin/env python3
 
+from __future__ import annotations
+
 import argparse
+import contextlib
+import itertools
+import json
 import logging
 import sys
-from collections import Counter
 from pathlib import Path
-from typing import Optional
+from typing import TYPE_CHECKING, List, Optional
+
+if TYPE_CHECKING:
+    from PIL import Image as PILImage
 
-import matplotlib.pylab as plt
-from PIL import Image as PILImage
+    from faces import Builder, Identity, Image
+    from faces.library import Library
 
-from faces import Builder, Identity, Image
-from faces.builder import DefaultBuilder
-from faces.live import Live
+# NOTE: the pipeline is imported when an action needs it, so that parsing the
+# arguments (and e.g. printing the help) does not wait for torch to load.
+# pylint: disable=import-outside-toplevel
 
 
 class Main:
@@ -28,13 +35,63 @@ class Main:
         parser.add_argument(
             "--device", type=str, default=None, help="cuda device number."
         )
+        parser.add_argument(
+            "--threads",
+            type=int,
+            default=None,
+            help="number of threads used within an operation.",
+        )
+        parser.add_argument(
+            "--interop-threads",
+            type=int,
+            default=None,
+            help="number of threads used to run operations in parallel.",
+        )
         parser.add_argument(
             "--registry-path",
             type=Path,
             default=Path("~/.faces.pkl").expanduser(),
             help="path to the faces database.",
         )
+        parser.add_argument(
+            "--library-path",
+            type=Path,
+            default=Path("~/.faces.sqlite").expanduser(),
+            help="path to the index of a photo library.",
+        )
         # pipeline args
+        parser.add_argument(
+            "--annotator",
+            choices=("pil", "cv"),
+            default="pil",
+            help="draw annotations with PIL or OpenCV.",
+        )
+        parser.add_argument(
+            "--target-size",
+            type=int,
+            default=1000,
+            help="downsize images to this size before detecting faces.",
+        )
+        parser.add_argument(
+            "--crop-from-source",
+            action="store_true",
+            default=False,
+            help="crop faces from the original rather than the downsized image.",
+        )
+        parser.add_argument(
+            "--tile-size",
+            type=int,
+            default=None,
+            help="detect faces in tiles of this size to process large images. "
+            "Tiles are cut from the original image with --crop-from-source, "
+            "else raise --target-size along with it.",
+        )
+        parser.add_argument(
+            "--tile-overlap",
+            type=int,
+            default=200,
+            help="overlap between tiles. Should exceed the largest face size.",
+        )
         parser.add_argument(
             "--probability-threshold",
             type=float,
@@ -47,6 +104,62 @@ class Main:
             default=0.9,
             help="only identify faces whose similarity is below the given threshold.",
         )
+        parser.add_argument(
+            "--precision",
+            choices=("float32", "float16", "int8"),
+            default=None,
+            help="store normalized reference encodings in the given format.",
+        )
+        parser.add_argument(
+            "--pca-dims",
+            type=int,
+            default=None,
+            help="shortlist candidates on this many principal components first.",
+        )
+        parser.add_argument(
+            "--shortlist",
+            type=int,
+            default=100,
+            help="number of candidates to compare on their full encoding.",
+        )
+        parser.add_argument(
+            "--vote-k",
+            type=int,
+            default=None,
+            help="identify faces by majority vote among this many nearest neighbours.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=256,
+            help="number of faces to encode at once.",
+        )
+        parser.add_argument(
+            "--dedupe-threshold",
+            type=float,
+            default=None,
+            help="skip added faces this close to a known face of their identity.",
+        )
+        parser.add_argument(
+            "--background-refresh",
+            action="store_true",
+            default=False,
+            help="refit the identifier in the background when the registry changes.",
+        )
+        parser.add_argument(
+            "--profile",
+            action="store_true",
+            default=False,
+            help="print the time spent in each stage of the pipeline when done.",
+        )
+        parser.add_argument(
+            "--profile-detector",
+            type=Path,
+            default=None,
+            metavar="FILE",
+            help="append the pyramid scales, candidates, and time of MTCNN's stages"
+            " per detection to FILE as JSON lines.",
+        )
         # actions
         subparsers = parser.add_subparsers(
             dest="action", required=True, help="choose what to do"
@@ -82,6 +195,96 @@ class Main:
             type=Path,
             help="images on which to apply face detection.",
         )
+        for batch_parser in (detect_parser, identify_parser):
+            batch_parser.add_argument(
+                "--output-dir",
+                type=Path,
+                default=None,
+                help="save annotated images to this directory instead of showing them.",
+            )
+            batch_parser.add_argument(
+                "--json",
+                type=str,
+                default=None,
+                help="write results as JSON lines to this file, or '-' for stdout.",
+            )
+            batch_parser.add_argument(
+                "--workers",
+                type=int,
+                default=4,
+                help="number of threads that decode and save images in batch mode.",
+            )
+        # index
+        index_parser = subparsers.add_parser(
+            "index", help="store the faces of a photo library for later searches"
+        )
+        index_parser.add_argument(
+            "--workers",
+            type=int,
+            default=4,
+            help="number of threads that decode images and detect faces.",
+        )
+        index_parser.add_argument(
+            "--identify",
+            action="store_true",
+            default=False,
+            help="print the identities of all indexed faces as JSON lines.",
+        )
+        index_parser.add_argument(
+            "paths",
+            nargs="+",
+            type=Path,
+            help="images or directories to index, recursively.",
+        )
+        # search
+        search_parser = subparsers.add_parser(
+            "search", help="find photos of a person in the indexed library"
+        )
+        search_parser.add_argument(
+            "--top-k",
+            type=int,
+            default=10,
+            help="number of matching faces to show.",
+        )
+        search_parser.add_argument(
+            "--max-distance",
+            type=float,
+            default=None,
+            help="only show faces whose distance is below the given threshold.",
+        )
+        search_parser.add_argument(
+            "query",
+            type=Path,
+            help="image of the person to search for. Uses its largest face.",
+        )
+        # cluster
+        cluster_parser = subparsers.add_parser(
+            "cluster", help="group unidentified faces by their similarity"
+        )
+        cluster_parser.add_argument(
+            "--output",
+            type=Path,
+            required=True,
+            help="JSON lines file to which to write the clusters.",
+        )
+        cluster_parser.add_argument(
+            "--min-size",
+            type=int,
+            default=2,
+            help="only report clusters with at least this many faces.",
+        )
+        cluster_parser.add_argument(
+            "--workers",
+            type=int,
+            default=4,
+            help="number of threads that decode images and detect faces.",
+        )
+        cluster_parser.add_argument(
+            "paths",
+            nargs="+",
+            type=Path,
+            help="images or directories whose faces to cluster, recursively.",
+        )
         # database commands
         database_parser = subparsers.add_parser(
             "db", help="query or manipulate the faces database"
@@ -96,15 +299,82 @@ class Main:
         register_parser.add_argument(
             "--identity",
             help="set the name manually.",
-            type=Identity,
+            type=str,
             default=None,
         )
+        register_parser.add_argument(
+            "--bulk",
+            action="store_true",
+            default=False,
+            help="walk directories recursively and never ask for identities.",
+        )
+        register_parser.add_argument(
+            "--review-file",
+            type=Path,
+            default=None,
+            help="in bulk mode, list images with several faces in this file.",
+        )
+        register_parser.add_argument(
+            "--checkpoint",
+            type=Path,
+            default=None,
+            help="in bulk mode, resume from and record progress in this file.",
+        )
+        register_parser.add_argument(
+            "--workers",
+            type=int,
+            default=4,
+            help="in bulk mode, number of threads that decode images and detect faces.",
+        )
         register_parser.add_argument(
             "images",
             nargs="+",
             type=Path,
             help="images on which to apply face detection.",
         )
+        # add clusters
+        clusters_parser = database_subparsers.add_parser(
+            "add-clusters", help="add the faces of named clusters to the registry"
+        )
+        clusters_parser.add_argument(
+            "clusters",
+            type=Path,
+            help="clusters file written by the cluster command.",
+        )
+        # dedupe
+        dedupe_parser = database_subparsers.add_parser(
+            "dedupe", help="remove near duplicate faces from the registry"
+        )
+        dedupe_parser.add_argument(
+            "--threshold",
+            type=float,
+            default=0.3,
+            help="remove faces this close to another face of the same identity.",
+        )
+        # export
+        export_parser = database_subparsers.add_parser(
+            "export", help="export the registry as numpy arrays"
+        )
+        export_parser.add_argument(
+            "--encodings",
+            action="store_true",
+            default=False,
+            help="also export the encodings of the faces.",
+        )
+        export_parser.add_argument(
+            "path",
+            type=Path,
+            help="an .npz archive, or a directory of .npy files.",
+        )
+        # import
+        import_parser = database_subparsers.add_parser(
+            "import", help="add the faces of exported numpy arrays to the registry"
+        )
+        import_parser.add_argument(
+            "path",
+            type=Path,
+            help="an .npz archive, or a directory of .npy files.",
+        )
         # list
         database_subparsers.add_parser("list", help="list face database")
         # remove
@@ -114,7 +384,7 @@ class Main:
         register_parser.add_argument(
             "identities",
             nargs="+",
-            type=Identity,
+            type=str,
             help="identities to remove from the database.",
         )
 
@@ -125,24 +395,79 @@ class Main:
         if args.verbose:
             logging.basicConfig(level=logging.INFO)
 
+        from faces.builder import DefaultBuilder
+
         builder = DefaultBuilder.from_args(args)
+        try:
+            self.act(builder, args)
+        finally:
+            if builder.metrics is not None:
+                print(builder.metrics.summary(), file=sys.stderr)
 
+    def act(self, builder: Builder, args: argparse.Namespace) -> None:
+        """Take the action chosen by the command line arguments *args*."""
         # take action
         if args.action == "live":
             self.live(builder, args.video_device)
+        elif args.action in ("detect", "identify") and (
+            args.output_dir is not None or args.json is not None
+        ):
+            self.batch(builder, args)
         elif args.action == "detect":
             detect = (
                 self.detect_with_probability if args.show_probability else self.detect
             )
             for path in args.images:
-                detect(builder, Image.open(path)).show()
+                detect(builder, builder.open_image(path)).show()
         elif args.action == "identify":
             for path in args.images:
-                self.identify(builder, Image.open(path)).show()
+                self.identify(builder, builder.open_image(path)).show()
+        elif args.action == "index":
+            from faces.library import Library
+
+            with Library(args.library_path) as library:
+                self.index(builder, library, args.paths, workers=args.workers)
+                if args.identify:
+                    self.identify_library(builder, library, args.paths)
+        elif args.action == "search":
+            from faces.library import Library
+
+            with Library(args.library_path) as library:
+                self.search(builder, library, args.query, args.top_k, args.max_distance)
+        elif args.action == "cluster":
+            from faces.library import Library
+
+            with Library(args.library_path) as library:
+                self.index(builder, library, args.paths, workers=args.workers)
+                self.cluster(
+                    builder,
+                    library,
+                    args.paths,
+                    args.output,
+                    args.distance_threshold,
+                    min_size=args.min_size,
+                )
         elif args.action == "db":
-            if args.dbaction == "add":
+            if args.dbaction == "add" and args.bulk:
+                self.register_many(
+                    builder,
+                    args.images,
+                    args.identity,
+                    review_path=args.review_file,
+                    checkpoint_path=args.checkpoint,
+                    workers=args.workers,
+                )
+            elif args.dbaction == "add":
                 for path in args.images:
                     self.register(builder, path, args.identity)
+            elif args.dbaction == "add-clusters":
+                self.register_clusters(builder, args.clusters)
+            elif args.dbaction == "dedupe":
+                self.dedupe(builder, args.threshold)
+            elif args.dbaction == "export":
+                self.export_db(builder, args.path, args.encodings)
+            elif args.dbaction == "import":
+                self.import_db(builder, args.path)
             elif args.dbaction == "list":
                 self.list_db(builder)
             elif args.dbaction == "remove":
@@ -155,35 +480,232 @@ class Main:
 
     def live(self, builder: Builder, video_device: int) -> None:
         """Perform live detection and identification via a webcam."""
+        from faces.live import Live
+
         Live(builder, video_device=video_device).run()
 
+    def batch(self, builder: Builder, args: argparse.Namespace) -> None:
+        """Process all images without showing them, and report the throughput."""
+        from faces.batch import BatchProcessor
+
+        if args.output_dir is not None:
+            args.output_dir.mkdir(parents=True, exist_ok=True)
+        with contextlib.ExitStack() as stack:
+            if args.json is None:
+                results = None
+            elif args.json == "-":
+                results = sys.stdout
+            else:
+                results = stack.enter_context(open(args.json, "w"))
+            statistics = BatchProcessor(
+                builder,
+                identify=args.action == "identify",
+                output_dir=args.output_dir,
+                results=results,
+                show_probability=getattr(args, "show_probability", False),
+                workers=args.workers,
+            ).run(args.images)
+        print(statistics, file=sys.stderr)
+
     def detect(self, builder: Builder, image: Image) -> PILImage.Image:
         """Return an image where detected faces are highlighted."""
-        return builder.annotate(
-            image, (box for box, _ in builder.detector.detect(image))
+        from faces.drawing import as_pil
+
+        return as_pil(
+            builder.annotate(image, (box for box, _ in builder.detector.detect(image)))
         )
 
     def detect_with_probability(self, builder: Builder, image: Image) -> PILImage.Image:
         """Return an image where detected faces and their likelihood are highlighted."""
-        return builder.annotate.with_probability(image, builder.detector.detect(image))
+        from faces.drawing import as_pil
+
+        return as_pil(
+            builder.annotate.with_probability(image, builder.detector.detect(image))
+        )
 
     def identify(self, builder: Builder, image: Image) -> PILImage.Image:
         """Return an image where detected faces and their identity are highlighted."""
-        return builder.annotate.with_identity(
-            image,
-            (
-                (bounding_box, builder.identifier(face_patch))
-                for bounding_box, face_patch in builder.detector.extract(image)
-            ),
+        from faces.drawing import as_pil
+
+        return as_pil(
+            builder.annotate.with_identity(
+                image,
+                (
+                    (bounding_box, builder.identifier(face_patch))
+                    for bounding_box, face_patch in builder.detector.extract(image)
+                ),
+            )
         )
 
+    def index(
+        self, builder: Builder, library: Library, paths: List[Path], workers: int = 4
+    ) -> None:
+        """Store faces and encodings of new or changed images in the library."""
+        from faces.library import LibraryIndexer
+
+        statistics = LibraryIndexer(builder, library, workers=workers).run(paths)
+        print(statistics, file=sys.stderr)
+
+    def identify_library(
+        self, builder: Builder, library: Library, paths: List[Path]
+    ) -> None:
+        """Print the identities of indexed faces in *paths* as JSON lines.
+        Compares the stored encodings, rather than processing the images again.
+        """
+        faces, encodings = library.encodings(under=[path.resolve() for path in paths])
+        if encodings is None:
+            return
+        identities = builder.identifier.identify_encodings(encodings)
+        for path, group in itertools.groupby(
+            zip(faces, identities), key=lambda item: item[0].path
+        ):
+            record = {
+                "path": str(path),
+                "faces": [
+                    {
+                        "box": list(face.box.as_tuple),
+                        "probability": face.probability,
+                        "identity": identity,
+                    }
+                    for face, identity in group
+                ],
+            }
+            print(json.dumps(record))
+
+    def search(
+        self,
+        builder: Builder,
+        library: Library,
+        query: Path,
+        top_k: int = 10,
+        max_distance: Optional[float] = None,
+    ) -> None:
+        """Print the library faces most similar to the largest face in *query*
+        as JSON lines, sorted by ascending distance.
+        """
+        from faces.library import LibrarySearch
+
+        faces = list(builder.detector.extract(builder.open_image(query)))
+        if not faces:
+            print(f"no face found in {query}", file=sys.stderr)
+            return
+        _, patch = max(
+            faces,
+            key=lambda face: (face[0].upper_left - face[0].lower_left)
+            * (face[0].upper_top - face[0].lower_top),
+        )
+        encoding = builder.encoder(patch)
+        (matches,) = LibrarySearch.from_library(library, encoding.device)(
+            encoding.unsqueeze(0), top_k
+        )
+        for face, distance in matches:
+            if max_distance is not None and distance > max_distance:
+                break
+            record = {
+                "path": str(face.path),
+                "box": list(face.box.as_tuple),
+                "probability": face.probability,
+                "distance": distance,
+            }
+            print(json.dumps(record))
+
+    def cluster(
+        self,
+        builder: Builder,
+        library: Library,
+        paths: List[Path],
+        output: Path,
+        distance_threshold: float,
+        min_size: int = 2,
+    ) -> None:
+        """Group the indexed faces in *paths* that cannot be identified, and
+        write the groups to *output*. Name the groups in *output*, then add
+        them to the registry via `register_clusters`.
+        """
+        from faces.cluster import cluster, write_clusters
+
+        faces, encodings = library.encodings(under=[path.resolve() for path in paths])
+        if encodings is None:
+            return
+        identifier = builder.identifier
+        unknown = [
+            index
+            for index, identity in enumerate(identifier.identify_encodings(encodings))
+            if identity == identifier.restklasse
+        ]
+        clusters = [
+            [faces[unknown[index]] for index in group]
+            for group in cluster(encodings[unknown], distance_threshold)
+            if len(group) >= min_size
+        ]
+        with open(output, "w") as output_file:
+            write_clusters(output_file, clusters)
+        print(
+            f"found {len(clusters)} clusters among {len(unknown)} unidentified faces",
+            file=sys.stderr,
+        )
+
+    def register_clusters(self, builder: Builder, path: Path) -> None:
+        """Add the faces of all clusters in *path* that have been named to the registry."""
+        from faces.cluster import enrol_clusters, read_clusters
+
+        with open(path) as clusters_file:
+            clusters = read_clusters(clusters_file)
+        for reason in enrol_clusters(builder, clusters):
+            print("Skipping face:", reason)
+
+    def export_db(self, builder: Builder, path: Path, encodings: bool) -> None:
+        """Write the registry to *path* as columnar numpy arrays."""
+        from faces.identifier import encode_samples
+        from faces.registry import ColumnarRegistry
+
+        samples = list(builder.registry)
+        encoded = None
+        if encodings:
+            _, encoded = encode_samples(
+                samples,
+                encoder=builder.encoder,
+                batch_size=builder.batch_size,
+                capacity=len(samples),
+            )
+        ColumnarRegistry.write(path, samples, encoded)
+        print(f"exported {len(samples)} faces to {path}")
+
+    def import_db(self, builder: Builder, path: Path) -> None:
+        """Add the faces exported to *path* to the registry."""
+        import torch
+
+        from faces.registry import ColumnarRegistry
+
+        if not path.exists():
+            raise FileNotFoundError(path)
+        imported = ColumnarRegistry.open(path, torch.device("cpu"))
+        skipped = builder.registry.add_many(imported)
+        for reason in skipped:
+            print("Skipping face:", reason)
+        print(f"imported {len(imported)} faces from {path} ({len(skipped)} skipped)")
+
     def list_db(self, builder: Builder) -> None:
         """Print a summary of the registry's content."""
-        for identity, count in Counter(
-            [identity for patch, identity in builder.registry]
-        ).items():
+        for identity, count in builder.registry.counts().items():
             print(f"{count: 4d}: {identity}")
 
+    def dedupe(self, builder: Builder, distance_threshold: float) -> None:
+        """Remove faces that are near duplicates of another face of the same identity."""
+        from faces.dedupe import find_near_duplicates
+
+        registry = builder.registry
+        before = sum(registry.counts().values())
+        duplicates = find_near_duplicates(
+            registry, encoder=builder.encoder, distance_threshold=distance_threshold
+        )
+        registry.discard(duplicates)
+        shrinkage = 100.0 * len(duplicates) / before if before else 0.0
+        print(
+            f"removed {len(duplicates)} of {before} faces"
+            f" (the registry shrank by {shrinkage:0.1f}%)"
+        )
+
     def remove(self, builder: Builder, identity: Identity) -> None:
         """Remove an identity (and all of its faces) from the registry."""
         builder.registry.remove(identity)
@@ -204,15 +726,19 @@ class Main:
 
         """
 
+        import matplotlib.pylab as plt
+
+        from faces.enrol import identity_from_path
+
         def _path_to_identity(path: Path) -> Identity:
             if identity:
                 return identity
-            return Identity(path.stem.lower().replace("-", "_").replace("_", " "))
+            return identity_from_path(path)
 
         def _add_face(path: Path, label: Path):
             patches = [
                 face_patch
-                for _, face_patch in builder.detector.extract(Image.open(path))
+                for _, face_patch in builder.detector.extract(builder.open_image(path))
             ]
             if len(patches) == 1:
                 try:
@@ -225,7 +751,6 @@ class Main:
                     while not user_input:
                         plt.imshow(
                             ((face_patch.permute(1, 2, 0) * 128 + 128) / 256.0)
-                            .detach()
                             .cpu()
                             .numpy()
                         )
@@ -248,7 +773,7 @@ class Main:
                             sys.exit(1)
                     if user_input:
                         try:
-                            builder.registry.add(face_patch, Identity(user_input))
+                            builder.registry.add(face_patch, user_input)
                         except ValueError as error:
                             print("Skipping face:", error)
 
@@ -259,6 +784,32 @@ class Main:
                 if child.is_file():
                     _add_face(child, path)
 
+    def register_many(
+        self,
+        builder: Builder,
+        paths: List[Path],
+        identity: Optional[Identity] = None,
+        review_path: Optional[Path] = None,
+        checkpoint_path: Optional[Path] = None,
+        workers: int = 4,
+    ) -> None:
+        """Add faces of many images to a face registry without user interaction.
+        Identities are derived as in `register`, except that images in nested
+        directories are named by the top-level directory that contains them.
+        Images with several faces are skipped and listed in *review_path*.
+        Progress is recorded in *checkpoint_path* to resume an interrupted run.
+        """
+        from faces.enrol import BulkEnrolment
+
+        statistics = BulkEnrolment(
+            builder,
+            identity=identity,
+            review_path=review_path,
+            checkpoint_path=checkpoint_path,
+            workers=workers,
+        ).run(paths)
+        print(statistics, file=sys.stderr)
+
 
 def main(argv=None):
     """Perform face detection, identification, or registration action."""
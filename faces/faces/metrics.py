@@ -0,0 +1,312 @@
+"""Per-stage latency of the pipeline.
+
+`Metrics` collects a latency histogram per pipeline stage. The `Timed*`
+wrappers time the calls to a component, and are put around the components
+by the builder if it was given a `Metrics` instance.
+"""
+
+from __future__ import annotations
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+from faces import Annotate, Detector, Encoder, Identifier
+
+if TYPE_CHECKING:
+    import torch
+    from PIL import Image as PILImage
+
+    from faces.types import (
+        BoundingBox,
+        FaceEncoding,
+        FacePatch,
+        FaceProbability,
+        Frame,
+        Identity,
+        Image,
+    )
+
+# upper bounds, in seconds, of the histogram buckets.
+BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    float("inf"),
+)
+
+
+class Histogram:
+    """Count observed durations in buckets, and their total."""
+
+    # upper bounds of the buckets, the last one is infinite.
+    buckets: Sequence[float]
+
+    # number of observations per bucket (not cumulative).
+    counts: List[int]
+
+    count: int
+
+    total: float
+
+    maximum: float
+
+    def __init__(self, buckets: Sequence[float] = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+
+    def observe(self, seconds: float) -> None:
+        """Add a duration of *seconds*."""
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.maximum = max(self.maximum, seconds)
+
+    def quantile(self, fraction: float) -> float:
+        """Return the upper bound of the bucket that holds the *fraction* quantile."""
+        rank = fraction * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return min(bound, self.maximum)
+        return self.maximum
+
+
+class Metrics:
+    """Latency histograms per pipeline stage. Safe to share between threads."""
+
+    histograms: Dict[str, Histogram]
+
+    def __init__(self):
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, seconds: float) -> None:
+        """Record that *stage* took *seconds*."""
+        with self._lock:
+            if stage not in self.histograms:
+                self.histograms[stage] = Histogram()
+            self.histograms[stage].observe(seconds)
+
+    @contextmanager
+    def timer(self, stage: str) -> Iterator[None]:
+        """Record the time spent in the context as *stage*."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def summary(self) -> str:
+        """Return a table of the count and latency of each stage."""
+        lines = [
+            f"{'stage':<12} {'count':>7} {'total':>9} {'mean':>9} {'p90':>9} {'max':>9}"
+        ]
+        with self._lock:
+            for stage, histogram in sorted(self.histograms.items()):
+                lines.append(
+                    f"{stage:<12} {histogram.count:>7d}"
+                    f" {histogram.total:>8.3f}s"
+                    f" {1000 * histogram.total / histogram.count:>7.1f}ms"
+                    f" {1000 * histogram.quantile(0.9):>7.1f}ms"
+                    f" {1000 * histogram.maximum:>7.1f}ms"
+                )
+        return "\n".join(lines)
+
+    def prometheus(self, name: str = "faces_stage_seconds") -> str:
+        """Return the histograms in the Prometheus text exposition format."""
+        lines = [
+            f"# HELP {name} Time spent in each stage of the face pipeline.",
+            f"# TYPE {name} histogram",
+        ]
+        with self._lock:
+            for stage, histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    upper = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(
+                        f'{name}_bucket{{stage="{stage}",le="{upper}"}} {cumulative}'
+                    )
+                lines.append(f'{name}_sum{{stage="{stage}"}} {histogram.total!r}')
+                lines.append(f'{name}_count{{stage="{stage}"}} {histogram.count}')
+        return "\n".join(lines) + "\n"
+
+
+class TimedDetector(Detector):
+    """Time the detection ("detect") and cropping ("crop") of faces."""
+
+    detector: Detector
+
+    metrics: Metrics
+
+    def __init__(self, detector: Detector, metrics: Metrics):
+        self.detector = detector
+        self.metrics = metrics
+
+    def detect(
+        self, image: Union[Image, Frame]
+    ) -> Iterable[Tuple[BoundingBox, FaceProbability]]:
+        with self.metrics.timer("detect"):
+            return list(self.detector.detect(image))
+
+    def many(
+        self, images: Sequence[Union[Image, Frame]]
+    ) -> List[List[Tuple[BoundingBox, FaceProbability]]]:
+        start = time.perf_counter()
+        detections = self.detector.many(images)
+        # each image is attributed its share of the batch
+        seconds = (time.perf_counter() - start) / max(len(images), 1)
+        for _ in images:
+            self.metrics.observe("detect", seconds)
+        return detections
+
+    def extract(
+        self, image: Union[Image, Frame]
+    ) -> Iterator[Tuple[BoundingBox, FacePatch]]:
+        boxes = [box for box, _ in self.detect(image)]
+        if boxes:
+            yield from zip(boxes, self.crop(image, boxes))
+
+    def crop(
+        self, image: Union[Image, Frame], boxes: Sequence[BoundingBox]
+    ) -> torch.Tensor:
+        with self.metrics.timer("crop"):
+            return self.detector.crop(image, boxes)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.detector, name)
+
+
+class TimedEncoder(Encoder):
+    """Time the encoding ("encode") of faces."""
+
+    encoder: Encoder
+
+    metrics: Metrics
+
+    def __init__(self, encoder: Encoder, metrics: Metrics):
+        self.encoder = encoder
+        self.metrics = metrics
+
+    def __call__(self, face_patch: FacePatch) -> FaceEncoding:
+        with self.metrics.timer("encode"):
+            return self.encoder(face_patch)
+
+    def many(
+        self, patches: torch.Tensor, batch_size: Optional[int] = None
+    ) -> torch.Tensor:
+        with self.metrics.timer("encode"):
+            return self.encoder.many(patches, batch_size=batch_size)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.encoder, name)
+
+
+class TimedIdentifier(Identifier):
+    """Time the search ("search") for the nearest references of faces.
+    Faces are encoded by *encoder*, which should be timed itself.
+    """
+
+    identifier: Identifier
+
+    encoder: Encoder
+
+    metrics: Metrics
+
+    def __init__(self, identifier: Identifier, encoder: Encoder, metrics: Metrics):
+        self.identifier = identifier
+        self.encoder = encoder
+        self.metrics = metrics
+
+    def __call__(self, face_patch: FacePatch) -> Identity:
+        (identity,) = self.identify_encodings(self.encoder(face_patch).unsqueeze(0))
+        return identity
+
+    def many(self, patches: torch.Tensor) -> List[Identity]:
+        return self.identify_encodings(self.encoder.many(patches))
+
+    def identify_encodings(self, encodings: torch.Tensor) -> List[Identity]:
+        with self.metrics.timer("search"):
+            return self.identifier.identify_encodings(encodings)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.identifier, name)
+
+
+class TimedAnnotate(Annotate):
+    """Time the drawing of annotations ("annotate").
+
+    Boxes are often produced lazily by the upstream stages, hence they are
+    collected before the drawing is timed.
+    """
+
+    annotate: Annotate
+
+    metrics: Metrics
+
+    def __init__(self, annotate: Annotate, metrics: Metrics):
+        self.annotate = annotate
+        self.metrics = metrics
+
+    def with_probability(
+        self,
+        image: Union[Image, Frame],
+        boxes_and_probability: Iterable[Tuple[BoundingBox, FaceProbability]],
+    ) -> Union[PILImage.Image, Frame]:
+        boxes_and_probability = list(boxes_and_probability)
+        with self.metrics.timer("annotate"):
+            return self.annotate.with_probability(image, boxes_and_probability)
+
+    def with_identity(
+        self,
+        image: Union[Image, Frame],
+        boxes_and_identity: Iterable[Tuple[BoundingBox, Identity]],
+    ) -> Union[PILImage.Image, Frame]:
+        boxes_and_identity = list(boxes_and_identity)
+        with self.metrics.timer("annotate"):
+            return self.annotate.with_identity(image, boxes_and_identity)
+
+    def with_enumeration(
+        self, image: Union[Image, Frame], boxes: Iterable[BoundingBox], start: int = 0
+    ) -> Union[PILImage.Image, Frame]:
+        boxes = list(boxes)
+        with self.metrics.timer("annotate"):
+            return self.annotate.with_enumeration(image, boxes, start)
+
+    def __call__(
+        self, image: Union[Image, Frame], boxes: Iterable[BoundingBox]
+    ) -> Union[PILImage.Image, Frame]:
+        boxes = list(boxes)
+        with self.metrics.timer("annotate"):
+            return self.annotate(image, boxes)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.annotate, name)
@@ -1,11 +1,84 @@
+from __future__ import annotations
+
+import hashlib
+import os
 import pickle
+import shutil
+import tempfile
+from collections import Counter, defaultdict
+from contextlib import contextmanager
 from dataclasses import dataclass
+from functools import cached_property, partial
 from pathlib import Path
-from typing import Iterator, Set, Tuple
+from typing import (
+    TYPE_CHECKING,
+    BinaryIO,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+
+from faces import Registry
+
+if TYPE_CHECKING:
+    import numpy as np
+    import torch
+
+    from faces.types import FacePatch, Identity
+
+    # a device, or a function that returns it when the faces are first loaded.
+    Device = Union[torch.device, Callable[[], torch.device]]
+
+# NOTE: numpy and torch are imported when they are first needed, so that the
+# identities of a registry can be listed without importing them.
+# pylint: disable=import-outside-toplevel
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    # not available on Windows, where the registry is not locked
+    fcntl = None  # type: ignore[assignment]
+
+
+def _resolve(device: Device) -> torch.device:
+    """Return *device*, calling it first if it is a function."""
+    return device() if callable(device) else device
+
+
+def patch_digest(face_patch: FacePatch) -> bytes:
+    """Return a digest of the values of *face_patch*."""
+    return hashlib.sha1(face_patch.detach().cpu().numpy().tobytes()).digest()
+
+
+def pack_patch(face_patch: FacePatch) -> torch.Tensor:
+    """Return *face_patch* as uint8 pixel values if that is lossless.
+    Face patches are standardized as (x - 127.5) / 128 from 8-bit pixels x,
+    so they can usually be stored in a quarter of the space.
+    """
+    import torch
+
+    pixels = torch.round(face_patch * 128.0 + 127.5)
+    if pixels.min() < 0 or pixels.max() > 255:
+        return face_patch
+    packed = pixels.to(torch.uint8)
+    if not torch.equal(unpack_patch(packed), face_patch):
+        return face_patch
+    return packed
 
-import torch
 
-from faces import FacePatch, Identity, Registry
+def unpack_patch(packed: torch.Tensor) -> FacePatch:
+    """Return the face patch stored by `pack_patch`."""
+    import torch
+
+    if packed.dtype != torch.uint8:
+        return packed
+    return (packed.float() - 127.5) / 128.0
 
 
 class InMemoryRegistry(Registry):
@@ -24,6 +97,9 @@ class InMemoryRegistry(Registry):
             (face_patch, id_) for face_patch, id_ in self.data if id_ != identity
         }
 
+    def discard(self, items: Iterable[Tuple[FacePatch, Identity]]) -> None:
+        self.data.difference_update(items)
+
     def __iter__(self) -> Iterator[Tuple[FacePatch, Identity]]:
         return iter(self.data)
 
@@ -31,57 +107,487 @@ class InMemoryRegistry(Registry):
         return len(self.data)
 
 
+@contextmanager
+def locked(path: Path, exclusive: bool = True) -> Iterator[None]:
+    """Lock *path* across processes while in the context.
+    An exclusive lock is held by one process at a time, a shared lock by any
+    number of processes as long as no exclusive lock is held. The lock is
+    taken on a sidecar file, which outlives the (replaced) file at *path*.
+    """
+    if fcntl is None:
+        yield
+        return
+    with open(path.with_name(path.name + ".lock"), "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def replace_atomically(path: Path, write: Callable[[BinaryIO], None]) -> None:
+    """Replace the file at *path* with the content written by *write*.
+    The content is written to a temporary file that is renamed to *path*, so
+    that readers see either the previous or the new file, never a partial one.
+    """
+    handle, staging = tempfile.mkstemp(
+        prefix=f".{path.name}.", suffix=".tmp", dir=path.parent
+    )
+    try:
+        with os.fdopen(handle, "wb") as staging_file:
+            write(staging_file)
+            staging_file.flush()
+            os.fsync(staging_file.fileno())
+        if path.exists():
+            shutil.copymode(path, staging)
+        else:
+            os.chmod(staging, 0o644)
+        os.replace(staging, path)
+    except BaseException:
+        Path(staging).unlink(missing_ok=True)
+        raise
+
+
 @dataclass
 class PickleRegistry(Registry):
-    """Store faces and identities via pickle."""
+    """Store faces and identities via pickle.
+
+    The file holds two pickled objects: a header with the number of faces per
+    identity, followed by the faces. The faces are only loaded when needed,
+    so that the identities can be listed quickly even for a large registry.
+    Faces are stored as uint8 pixels where possible (see `pack_patch`).
+    Files without a header, as written by earlier versions, are read as well.
+
+    Several processes can share the file. Changes are made under a lock, on
+    the latest content, and written to a new file that replaces the previous
+    one. The header holds a generation counter, so that readers can detect
+    changes of other processes (see `refresh`).
+    """
 
     path: Path
 
-    data: Set[Tuple[FacePatch, Identity]]
+    device: Device
+
+    # number of faces per identity.
+    identities: Dict[Identity, int]
+
+    # number of times the file has been written.
+    generation: int = 0
 
     @classmethod
-    def open(cls, path: Path, device: torch.device) -> Registry:
+    def open(cls, path: Path, device: Device) -> Registry:
         """Open the registry at *path*."""
+        registry = cls(path=path, device=device, identities={})
+        if (data := registry._read(faces=False)) is not None:
+            registry.data = data
+        return registry
+
+    def _read(self, faces: bool) -> Optional[Set[Tuple[FacePatch, Identity]]]:
+        """Read the identities and generation from disc. Also read and return
+        the faces if *faces* is True, or if the file has no header.
+        """
+        self.identities, self.generation = {}, 0
+        if not self.path.exists():
+            return set()
+        with open(self.path, "rb") as registry_file:
+            content = pickle.load(registry_file)
+            if "data" not in content:
+                self.identities = dict(content["identities"])
+                self.generation = content.get("generation", 0)
+                if not faces:
+                    return None
+                # read the faces from the same file as the header
+                content = pickle.load(registry_file)
+        device = _resolve(self.device)
+        data = {
+            (unpack_patch(patch.to(device)), identity)
+            for patch, identity in content["data"]
+        }
+        # count the identities of files without a header
+        self.identities = dict(Counter(id_ for _, id_ in data))
+        return data
+
+    @cached_property
+    def data(self) -> Set[Tuple[FacePatch, Identity]]:
+        """Return the faces and their identities."""
+        data = self._read(faces=True)
+        assert data is not None
+        return data
+
+    @cached_property
+    def _digests(self) -> Dict[bytes, Set[Identity]]:
+        """Return the identities of each known patch digest."""
+        known_as: Dict[bytes, Set[Identity]] = defaultdict(set)
+        for patch, identity in self.data:
+            known_as[patch_digest(patch)].add(identity)
+        return known_as
+
+    @staticmethod
+    def _stored_generation(path: Path) -> int:
+        """Return the generation of the registry at *path* from its header."""
         if not path.exists():
-            return cls(path=path, data=set())
+            return 0
         with open(path, "rb") as registry_file:
-            return cls(
-                path=path,
-                data={
-                    (patch.to(device), identity)
-                    for patch, identity in pickle.load(registry_file)["data"]
-                },
-            )
+            header = pickle.load(registry_file)
+        # files without a header have no generation
+        return header.get("generation", 0) if "data" not in header else 0
+
+    def refresh(self) -> bool:
+        if not self.path.exists():
+            return False
+        if self._stored_generation(self.path) == self.generation:
+            return False
+        self.__dict__.pop("data", None)
+        self.__dict__.pop("_digests", None)
+        if (data := self._read(faces=False)) is not None:
+            self.data = data
+        return True
 
     def _save(self) -> None:
-        with open(self.path, "wb") as registry_file:
+        self.identities = dict(Counter(identity for _, identity in self.data))
+        self.generation += 1
+
+        def _write(registry_file: BinaryIO) -> None:
             pickle.dump(
                 {
-                    "data": self.data,
+                    "identities": self.identities,
+                    "generation": self.generation,
                 },
                 registry_file,
             )
+            pickle.dump(
+                {
+                    "data": [
+                        (pack_patch(patch).cpu(), identity)
+                        for patch, identity in self.data
+                    ],
+                },
+                registry_file,
+            )
+
+        replace_atomically(self.path, _write)
+
+    def counts(self) -> Dict[Identity, int]:
+        return dict(self.identities)
 
     def remove(self, identity: Identity) -> None:
-        self.data = {
-            (face_patch, id_) for face_patch, id_ in self.data if id_ != identity
-        }
-        self._save()
+        with locked(self.path):
+            self.refresh()
+            self.data = {
+                (face_patch, id_) for face_patch, id_ in self.data if id_ != identity
+            }
+            self.__dict__.pop("_digests", None)
+            self._save()
 
     def add(self, face_patch: FacePatch, identity: Identity) -> None:
-        # NOTE: tensor hashes differ even if they are have identical values
-        if knows_patch_as := {
-            identity for patch, identity in self.data if torch.equal(face_patch, patch)
-        }:
-            if knows_patch_as != {identity}:
-                raise ValueError(f"already known as {knows_patch_as}")
-            return
+        import torch
 
-        self.data.add((face_patch, identity))
-        self._save()
+        with locked(self.path):
+            self.refresh()
+            # NOTE: tensor hashes differ even if they are have identical values
+            if knows_patch_as := {
+                identity
+                for patch, identity in self.data
+                if torch.equal(face_patch, patch)
+            }:
+                if knows_patch_as != {identity}:
+                    raise ValueError(f"already known as {knows_patch_as}")
+                return
+
+            self.data.add((face_patch, identity))
+            self.__dict__.pop("_digests", None)
+            self._save()
+
+    def add_many(self, items: Iterable[Tuple[FacePatch, Identity]]) -> List[str]:
+        with locked(self.path):
+            self.refresh()
+            # compare digests rather than tensors to avoid a scan per face
+            known_as = self._digests
+            skipped = []
+            for face_patch, identity in items:
+                digest = patch_digest(face_patch)
+                if digest in known_as:
+                    if known_as[digest] != {identity}:
+                        skipped.append(f"already known as {known_as[digest]}")
+                    continue
+                known_as[digest].add(identity)
+                self.data.add((face_patch, identity))
+
+            self._save()
+        return skipped
+
+    def discard(self, items: Iterable[Tuple[FacePatch, Identity]]) -> None:
+        with locked(self.path):
+            # NOTE: faces of another generation are different objects
+            discarded = {(patch_digest(patch), identity) for patch, identity in items}
+            self.refresh()
+            self.data = {
+                (patch, identity)
+                for patch, identity in self.data
+                if (patch_digest(patch), identity) not in discarded
+            }
+            self.__dict__.pop("_digests", None)
+            self._save()
 
     def __iter__(self) -> Iterator[Tuple[FacePatch, Identity]]:
         return iter(self.data)
 
     def __len__(self) -> int:
-        return len(self.data)
+        return sum(self.identities.values())
+
+
+class ColumnarRegistry(Registry):
+    """Store faces and identities as numpy arrays.
+
+    The registry consists of one (N, C, H, W) array of face patches (uint8
+    pixels where lossless, see `pack_patch`), one (N,) array of identities,
+    and optionally one (N, D) array of encodings. The arrays are stored as
+    .npy files in a directory, which are memory-mapped when opened, or in a
+    single .npz archive, which is read at once.
+
+    As with the `PickleRegistry`, changes are made under a lock and counted
+    by a generation, so that several processes can share the registry.
+    """
+
+    path: Path
+
+    device: Device
+
+    patches: np.ndarray
+
+    identities: np.ndarray
+
+    # encodings of the patches as exported, if any. Dropped on modification.
+    encodings: Optional[np.ndarray]
+
+    # number of times the registry has been written.
+    generation: int = 0
+
+    def __init__(self, path: Path, device: Device):
+        self.path = path
+        self.device = device
+        self._load()
+
+    @classmethod
+    def open(cls, path: Path, device: Device) -> Registry:
+        """Open the registry at *path*, a directory or an .npz archive."""
+        # the files of a directory are replaced one by one
+        with locked(path, exclusive=False):
+            return cls(path, device)
+
+    def _load(self) -> None:
+        """Read the arrays from disc."""
+        import numpy as np
+
+        self.patches = np.empty((0, 3, 160, 160), dtype=np.uint8)
+        self.identities = np.empty((0,), dtype=str)
+        self.encodings = None
+        self.generation = 0
+        if self.path.suffix == ".npz":
+            if not self.path.exists():
+                return
+            with np.load(self.path, allow_pickle=False) as archive:
+                self.patches = archive["patches"]
+                self.identities = archive["identities"]
+                if "encodings" in archive.files:
+                    self.encodings = archive["encodings"]
+                if "generation" in archive.files:
+                    self.generation = int(archive["generation"])
+            return
+        if not (self.path / "patches.npy").exists():
+            return
+        self.patches = np.load(
+            self.path / "patches.npy", mmap_mode="r", allow_pickle=False
+        )
+        self.identities = np.load(self.path / "identities.npy", allow_pickle=False)
+        if (self.path / "encodings.npy").exists():
+            self.encodings = np.load(
+                self.path / "encodings.npy", mmap_mode="r", allow_pickle=False
+            )
+        self.generation = self._stored_generation(self.path)
+
+    @staticmethod
+    def _stored_generation(path: Path) -> int:
+        """Return the generation of the registry at *path*."""
+        import numpy as np
+
+        if path.suffix == ".npz":
+            if not path.exists():
+                return 0
+            with np.load(path, allow_pickle=False) as archive:
+                if "generation" not in archive.files:
+                    return 0
+                return int(archive["generation"])
+        if not (path / "generation.npy").exists():
+            return 0
+        return int(np.load(path / "generation.npy", allow_pickle=False))
+
+    @classmethod
+    def write(
+        cls,
+        path: Path,
+        samples: Iterable[Tuple[FacePatch, Identity]],
+        encodings: Optional[torch.Tensor] = None,
+    ) -> None:
+        """Store *samples*, and their (N, D) *encodings* if given, at *path*,
+        a directory or an .npz archive.
+        """
+        with locked(path):
+            cls._write(path, samples, encodings, cls._stored_generation(path) + 1)
+
+    @staticmethod
+    def _write(
+        path: Path,
+        samples: Iterable[Tuple[FacePatch, Identity]],
+        encodings: Optional[torch.Tensor],
+        generation: int,
+    ) -> None:
+        """Store *samples* and *encodings* as *generation* at *path*."""
+        import numpy as np
+        import torch
+
+        packed, identities = [], []
+        for patch, identity in samples:
+            packed.append(pack_patch(patch).cpu())
+            identities.append(identity)
+        if any(patch.dtype != torch.uint8 for patch in packed):
+            packed = [unpack_patch(patch) for patch in packed]
+        arrays = {
+            "patches": (
+                torch.stack(packed).numpy()
+                if packed
+                else np.empty((0, 3, 160, 160), dtype=np.uint8)
+            ),
+            "identities": np.array(identities, dtype=str),
+        }
+        if encodings is not None:
+            arrays["encodings"] = encodings.detach().cpu().numpy()
+        # written last, readers of a directory compare it to detect changes
+        arrays["generation"] = np.array(generation)
+
+        if path.suffix == ".npz":
+            replace_atomically(path, lambda archive: np.savez(archive, **arrays))
+            return
+        path.mkdir(parents=True, exist_ok=True)
+        if encodings is None:
+            (path / "encodings.npy").unlink(missing_ok=True)
+        for name, array in arrays.items():
+            replace_atomically(
+                path / f"{name}.npy",
+                partial(np.save, arr=array, allow_pickle=False),
+            )
+
+    def refresh(self) -> bool:
+        with locked(self.path, exclusive=False):
+            return self._refresh()
+
+    def _refresh(self) -> bool:
+        """Reload the arrays if they changed. The caller holds the lock."""
+        if self._stored_generation(self.path) == self.generation:
+            return False
+        self._load()
+        return True
+
+    def _save(self, samples: List[Tuple[FacePatch, Identity]]) -> None:
+        """Replace the arrays by *samples*. The caller holds the lock."""
+        self._write(self.path, samples, None, self.generation + 1)
+        self._load()
+
+    def _digests(self) -> Dict[bytes, Set[Identity]]:
+        """Return the identities of each known patch digest."""
+        known_as: Dict[bytes, Set[Identity]] = defaultdict(set)
+        for patch, identity in self:
+            known_as[patch_digest(patch)].add(identity)
+        return known_as
+
+    def add(self, face_patch: FacePatch, identity: Identity) -> None:
+        if skipped := self.add_many([(face_patch, identity)]):
+            raise ValueError(skipped[0])
+
+    def add_many(self, items: Iterable[Tuple[FacePatch, Identity]]) -> List[str]:
+        with locked(self.path):
+            self._refresh()
+            known_as = self._digests()
+            added, skipped = [], []
+            for face_patch, identity in items:
+                digest = patch_digest(face_patch)
+                if digest in known_as:
+                    if known_as[digest] != {identity}:
+                        skipped.append(f"already known as {known_as[digest]}")
+                    continue
+                known_as[digest].add(identity)
+                added.append((face_patch, identity))
+            if added:
+                self._save(list(self) + added)
+        return skipped
+
+    def remove(self, identity: Identity) -> None:
+        with locked(self.path):
+            self._refresh()
+            if identity in self.identities:
+                self._save([item for item in self if item[1] != identity])
+
+    def discard(self, items: Iterable[Tuple[FacePatch, Identity]]) -> None:
+        # patches are re-created on iteration, hence compare their values
+        discarded = {(patch_digest(patch), identity) for patch, identity in items}
+        with locked(self.path):
+            self._refresh()
+            self._save(
+                [
+                    (patch, identity)
+                    for patch, identity in self
+                    if (patch_digest(patch), identity) not in discarded
+                ]
+            )
+
+    def stored_encodings(self) -> Optional[Tuple[List[Identity], torch.Tensor]]:
+        import numpy as np
+        import torch
+
+        if self.encodings is None:
+            return None
+        return [str(identity) for identity in self.identities], torch.from_numpy(
+            np.array(self.encodings)
+        ).to(_resolve(self.device))
+
+    def counts(self) -> Dict[Identity, int]:
+        import numpy as np
+
+        identities, counts = np.unique(self.identities, return_counts=True)
+        return {
+            str(identity): int(count) for identity, count in zip(identities, counts)
+        }
+
+    def __iter__(self) -> Iterator[Tuple[FacePatch, Identity]]:
+        import numpy as np
+        import torch
+
+        device = _resolve(self.device)
+        for patch, identity in zip(self.patches, self.identities):
+            yield (
+                unpack_patch(torch.from_numpy(np.array(patch)).to(device)),
+                str(identity),
+            )
+
+    def __len__(self) -> int:
+        return len(self.identities)
+
+
+def stored_generation(path: Path) -> int:
+    """Return the generation of the registry at *path*, without loading it.
+    Compare it to `Registry.generation` to find out whether it changed.
+    """
+    if path.suffix == ".npz" or path.is_dir():
+        return ColumnarRegistry._stored_generation(path)
+    return PickleRegistry._stored_generation(path)
+
+
+def open_registry(path: Path, device: Device) -> Registry:
+    """Open the registry at *path*. An .npz archive or an existing directory
+    is opened as a `ColumnarRegistry`, any other file as a `PickleRegistry`.
+    The faces are loaded to *device*, which may be given as a function that
+    is only called when the faces are first loaded.
+    """
+    if path.suffix == ".npz" or path.is_dir():
+        return ColumnarRegistry.open(path, device)
+    return PickleRegistry.open(path, device)
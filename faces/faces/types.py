@@ -1,15 +1,17 @@
 from __future__ import annotations
 
 from collections import namedtuple
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from pathlib import Path
 from typing import Optional, Tuple
 
+import cv2
+import numpy as np
 import torch
 from numpy.typing import NDArray
 from PIL import Image as PILImage
 
-from faces.utils import preprocess
+from faces.utils import exif_rotation, preprocess, target_dimensions
 
 ## simple types
 FaceEncoding = torch.Tensor
@@ -19,6 +21,13 @@ Identity = str
 
 VideoFrame = namedtuple("VideoFrame", ["rval", "frame"])
 
+# OpenCV rotation codes by counter-clockwise rotation angle
+CV2_ROTATIONS = {
+    90: cv2.ROTATE_90_COUNTERCLOCKWISE,
+    180: cv2.ROTATE_180,
+    270: cv2.ROTATE_90_CLOCKWISE,
+}
+
 
 ## complex types
 @dataclass(frozen=True)
@@ -52,24 +61,48 @@ class Image:
 
     image: PILImage.Image
 
+    # the image at its original resolution, if kept.
+    source: Optional[PILImage.Image] = field(default=None, repr=False)
+
     @classmethod
     def open(
         cls,
         path: Path,
         target_size: int = 1000,
         rotate: Optional[int] = None,
+        keep_source: bool = False,
     ) -> Image:
         """Open and preprocess an image at *path*.
         See `faces.utils.preprocess` for the *target_size* and *rotate* parameters.
+
+        JPEG images are decoded at the smallest scale that is still larger
+        than *target_size*, rather than at their full resolution.
+        Set *keep_source* to decode the image at its full resolution,
+        and to keep it alongside the preprocessed image.
         """
+        img = PILImage.open(path)
+        if rotate is None:
+            # EXIF information is read from the header, without decoding
+            rotate = exif_rotation(img)
+        if keep_source:
+            source = img.rotate(rotate, expand=True) if rotate else img
+            return cls(preprocess(source, target_size=target_size, rotate=0), source)
+        img.draft(img.mode, target_dimensions(img.size, target_size))
         return cls(
             preprocess(
-                PILImage.open(path),
+                img,
                 target_size=target_size,
                 rotate=rotate,
             )
         )
 
+    @property
+    def source_scale(self) -> float:
+        """Return the size of the source image relative to the preprocessed image."""
+        if self.source is None:
+            return 1.0
+        return max(self.source.size) / max(self.image.size)
+
     @classmethod
     def from_array(
         cls,
@@ -87,3 +120,47 @@ class Image:
                 rotate=rotate,
             )
         )
+
+
+@dataclass(frozen=True)
+class Frame:
+    """A video frame, kept as a numpy array."""
+
+    # (height, width, 3) pixels in BGR channel order, as delivered by OpenCV.
+    buffer: NDArray
+
+    @classmethod
+    def from_array(
+        cls,
+        buffer: NDArray,
+        target_size: int = 1000,
+        rotate: int = 0,
+    ) -> Frame:
+        """Scale the larger side of a BGR *buffer* to *target_size* and
+        rotate it (counter-clockwise) by *rotate*, a multiple of 90 degrees.
+        The *buffer* is used as-is if it already has the target size.
+        """
+        height, width = buffer.shape[:2]
+        if max(width, height) != target_size:
+            buffer = cv2.resize(
+                buffer,
+                target_dimensions((width, height), target_size),
+                interpolation=cv2.INTER_AREA,
+            )
+        if rotate % 360:
+            buffer = cv2.rotate(buffer, CV2_ROTATIONS[rotate % 360])
+        return cls(buffer)
+
+    @property
+    def rgb(self) -> NDArray:
+        """Return the pixels in RGB channel order. The result is a view on the buffer."""
+        return self.buffer[..., ::-1]
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        """Return the frame's (width, height)."""
+        return self.buffer.shape[1], self.buffer.shape[0]
+
+    def to_image(self) -> Image:
+        """Return the frame as an Image."""
+        return Image(PILImage.fromarray(np.ascontiguousarray(self.rgb)))
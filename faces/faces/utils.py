@@ -4,6 +4,27 @@ from PIL import Image
 
 EXIF_ORIENTATION_KEY = 274
 
+# rotation angle by EXIF orientation
+EXIF_ORIENTATION_ANGLE = {3: 180, 6: 270, 8: 90}
+
+
+def exif_rotation(img: Image.Image) -> int:
+    """Return the angle by which *img* has to be rotated according to its EXIF information.
+    Only reads the image header, i.e., does not decode the image.
+    """
+    return EXIF_ORIENTATION_ANGLE.get(img.getexif().get(EXIF_ORIENTATION_KEY, None), 0)
+
+
+def target_dimensions(
+    size: typing.Tuple[int, int], target_size: int
+) -> typing.Tuple[int, int]:
+    """Return the (width, height) of an image of *size* whose larger side is scaled to *target_size*."""
+    width, height = size
+    if width >= height:  # landscape
+        return target_size, int(height / width * target_size)
+    # portrait
+    return int(width / height * target_size), target_size
+
 
 def preprocess(
     img: Image.Image,
@@ -16,28 +37,15 @@ def preprocess(
     2. Rotate by angle *rotate*, or auto-rotate if *rotate=None* (the default).
 
     """
+    if rotate is None:
+        # auto-rotate according to EXIF information
+        rotate = exif_rotation(img)
+
     # scale image
-    if img.size[0] > img.size[1]:  # landscape
-        img = img.resize(
-            (target_size, int(img.height / img.width * target_size)), reducing_gap=3
-        )
-    elif img.size[0] < img.size[1]:  # portrait
-        img = img.resize(
-            (int(img.width / img.height * target_size), target_size), reducing_gap=3
-        )
+    img = img.resize(target_dimensions(img.size, target_size), reducing_gap=3)
 
     # rotate image (if need be)
-    if rotate is None:
-        # auto-rotate according to EXIF information
-        img_ori = img.getexif().get(EXIF_ORIENTATION_KEY, None)
-        if img_ori == 3:
-            img = img.rotate(180, expand=True)
-        elif img_ori == 6:
-            img = img.rotate(270, expand=True)
-        elif img_ori == 8:
-            img = img.rotate(90, expand=True)
-    elif rotate != 0:
-        # manually rotate
+    if rotate != 0:
         img = img.rotate(rotate, expand=True)
 
     return img
@@ -35,6 +35,7 @@ setup(
         'opencv-python==4.8.1.78',
         'pillow==10.1.0',
         'torch==2.0.1',
+        'torchvision==0.15.2',
         'facenet_pytorch==2.5.3',
         ),
     extras_require={
@@ -0,0 +1,68 @@
+import io
+import json
+import tempfile
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import torch
+
+from faces.batch import BatchProcessor, prefetch
+from faces.builder import DefaultBuilder
+
+
+class TestPrefetch(unittest.TestCase):
+    def test_order(self) -> None:
+        def _slow(item: int) -> int:
+            time.sleep(0.01 * (5 - item))
+            return item * item
+
+        with ThreadPoolExecutor(4) as executor:
+            self.assertEqual(
+                [
+                    (item, future.result())
+                    for item, future in prefetch(executor, _slow, range(5), 2)
+                ],
+                [(0, 0), (1, 1), (2, 4), (3, 9), (4, 16)],
+            )
+
+
+class TestBatchProcessor(unittest.TestCase):
+    def setUp(self) -> None:
+        self.images = Path(__file__).parent / "data" / "images"
+        self.tmp = tempfile.TemporaryDirectory()
+        self.builder = DefaultBuilder(
+            device=torch.device("cpu"),
+            registry_path=Path(self.tmp.name) / "registry.pkl",
+        )
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def test_detect(self) -> None:
+        output_dir = Path(self.tmp.name) / "output"
+        output_dir.mkdir()
+        results = io.StringIO()
+        paths = [
+            self.images / "douglas_adams.jpg",
+            self.images / "missing.jpg",
+            self.images / "monty_python.jpg",
+            self.images / "douglas_adams.jpg",
+        ]
+        statistics = BatchProcessor(
+            self.builder, output_dir=output_dir, results=results, workers=2
+        ).run(paths)
+        self.assertEqual(statistics.images, 3)
+        self.assertEqual(statistics.errors, 1)
+
+        records = [json.loads(line) for line in results.getvalue().splitlines()]
+        self.assertEqual([record["path"] for record in records], list(map(str, paths)))
+        self.assertIn("error", records[1])
+        self.assertEqual(len(records[0]["faces"]), 1)
+        self.assertEqual(len(records[2]["faces"]), 7)
+        self.assertEqual(statistics.faces, 9)
+        self.assertEqual(
+            sorted(path.name for path in output_dir.iterdir()),
+            ["douglas_adams-1.jpg", "douglas_adams.jpg", "monty_python.jpg"],
+        )
@@ -0,0 +1,129 @@
+import shutil
+import unittest
+from pathlib import Path
+from tempfile import mkdtemp
+from unittest import mock
+
+import numpy as np
+import torch
+
+from faces import FacePatch
+from faces.builder import DefaultBuilder
+from faces.main import Main
+from faces.registry import ColumnarRegistry, PickleRegistry
+
+
+class TestRefresh(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = Path(mkdtemp(prefix="faces-test-"))
+        self.registry_path = self.directory / "faces.pkl"
+        shutil.copy(
+            Path(__file__).parent / "data" / "registry" / "faces.pkl",
+            self.registry_path,
+        )
+        self.patch = FacePatch(
+            np.load(Path(__file__).parent / "data" / "patches" / "eric-idle.npy")
+        )
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.directory)
+
+    def _add_face(self) -> None:
+        # as another process would
+        PickleRegistry.open(self.registry_path, torch.device("cpu")).add(
+            self.patch, "eric-idle.npy"
+        )
+
+    def test_refresh(self) -> None:
+        builder = DefaultBuilder(
+            device="cpu", registry_path=self.registry_path, distance_threshold=0.01
+        )
+        # nothing to refresh before the identifier has been fitted
+        self.assertFalse(builder.refresh())
+        self.assertEqual(builder.identifier(self.patch), "Anonymous")
+        self.assertFalse(builder.refresh())
+        self._add_face()
+        self.assertTrue(builder.refresh())
+        self.assertEqual(builder.identifier(self.patch), "eric-idle.npy")
+        self.assertFalse(builder.refresh())
+
+    def test_reload(self) -> None:
+        builder = DefaultBuilder(
+            device="cpu", registry_path=self.registry_path, dedupe_threshold=0.3
+        )
+        registry = builder.registry
+        self.assertIsNotNone(builder.identifier)
+        builder.reload()
+        # the deduplicating registry is opened again
+        self.assertIsNot(builder.registry, registry)
+
+    def test_background_refresh(self) -> None:
+        builder = DefaultBuilder(
+            device="cpu",
+            registry_path=self.registry_path,
+            distance_threshold=0.01,
+            background_refresh=True,
+        )
+        previous = builder.identifier
+        self._add_face()
+        self.assertTrue(builder.refresh())
+        # the previous identifier is used until the new one is ready
+        assert builder._refit is not None
+        builder._refit.join()
+        self.assertIsNot(builder.identifier, previous)
+        self.assertEqual(previous(self.patch), "Anonymous")
+        self.assertEqual(builder.identifier(self.patch), "eric-idle.npy")
+        self.assertFalse(builder.refresh())
+
+
+class TestThreads(unittest.TestCase):
+    def test_from_args(self) -> None:
+        with mock.patch.object(Main, "act") as act, mock.patch(
+            "torch.set_num_threads"
+        ) as set_num_threads, mock.patch(
+            "torch.get_num_interop_threads", return_value=1
+        ), mock.patch(
+            "torch.set_num_interop_threads"
+        ) as set_num_interop_threads:
+            Main().main(["--threads", "2", "--interop-threads", "3", "db", "list"])
+        builder = act.call_args.args[0]
+        self.assertEqual((builder.threads, builder.interop_threads), (2, 3))
+        set_num_threads.assert_called_once_with(2)
+        set_num_interop_threads.assert_called_once_with(3)
+
+    def test_interop_threads_started(self) -> None:
+        # torch refuses once parallel work has run, e.g. for a second builder
+        with mock.patch("torch.get_num_interop_threads", return_value=1), mock.patch(
+            "torch.set_num_interop_threads", side_effect=RuntimeError
+        ), self.assertLogs("faces.builder", "WARNING"):
+            builder = DefaultBuilder(
+                device=torch.device("cpu"),
+                registry_path=Path("faces.pkl"),
+                interop_threads=3,
+            )
+        self.assertEqual(builder.interop_threads, 3)
+
+
+class TestStoredEncodings(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = Path(mkdtemp(prefix="faces-test-"))
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.directory)
+
+    def test_fit(self) -> None:
+        source = PickleRegistry.open(
+            Path(__file__).parent / "data" / "registry" / "faces.pkl",
+            torch.device("cpu"),
+        )
+        encodings = torch.randn(len(source), 512)
+        ColumnarRegistry.write(self.directory / "faces.npz", source, encodings)
+        builder = DefaultBuilder(
+            device="cpu", registry_path=self.directory / "faces.npz"
+        )
+        # the exported encodings are used rather than encoding the faces again
+        torch.testing.assert_close(builder.identifier.classifier.encodings, encodings)
+
+
+if __name__ == "__main__":
+    unittest.main()
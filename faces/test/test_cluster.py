@@ -0,0 +1,116 @@
+import io
+import tempfile
+import unittest
+from pathlib import Path
+
+import torch
+
+from faces import BoundingBox
+from faces.builder import DefaultBuilder
+from faces.cluster import (
+    InvertedIndex,
+    cluster,
+    enrol_clusters,
+    read_clusters,
+    write_clusters,
+)
+from faces.library import LibraryFace
+
+
+class TestCluster(unittest.TestCase):
+    def test_cluster(self) -> None:
+        generator = torch.Generator().manual_seed(0)
+        centers = torch.nn.functional.normalize(
+            torch.randn(3, 512, generator=generator), dim=1
+        )
+        sizes = [5, 3, 1]
+        encodings = torch.cat(
+            [
+                center + 0.01 * torch.randn(size, 512, generator=generator)
+                for center, size in zip(centers, sizes)
+            ]
+        )
+        # interleave the groups
+        order = torch.randperm(len(encodings), generator=generator)
+        encodings = encodings[order]
+        clusters = cluster(encodings, distance_threshold=0.5, chunk_size=2)
+        self.assertListEqual([len(group) for group in clusters], sizes)
+        for group, label in zip(clusters, (0, 1, 2)):
+            self.assertSetEqual(
+                {int(order[index]) for index in group},
+                set(range(sum(sizes[:label]), sum(sizes[: label + 1]))),
+            )
+
+    def test_cluster_chain(self) -> None:
+        # distant encodings are linked through intermediate ones
+        encodings = torch.tensor([[0.0], [0.4], [0.8], [1.2], [3.0]])
+        self.assertListEqual(
+            cluster(encodings, distance_threshold=0.5, neighbours=1),
+            [[0, 1, 2, 3], [4]],
+        )
+
+    def test_cluster_empty(self) -> None:
+        self.assertListEqual(cluster(torch.empty((0, 512)), 0.5), [])
+
+    def test_inverted_index(self) -> None:
+        generator = torch.Generator().manual_seed(0)
+        encodings = torch.randn(100, 8, generator=generator)
+        index = InvertedIndex.fit(encodings, cells=10)
+        self.assertEqual(len(index.centroids), 10)
+        self.assertListEqual(sorted(index.order.tolist()), list(range(100)))
+        # probing all cells is exact
+        distances, indices = index.search(encodings[:20], 3, probes=10)
+        expected = torch.topk(
+            torch.cdist(encodings[:20], encodings), 3, dim=1, largest=False
+        )
+        self.assertTrue(torch.equal(indices, expected.indices))
+        self.assertTrue(torch.allclose(distances, expected.values, atol=1e-2))
+        # a single cell holds fewer than k references
+        distances, indices = InvertedIndex.fit(encodings, cells=50).search(
+            encodings[:1], 10, probes=1
+        )
+        self.assertEqual(int(indices[0, 0]), 0)
+        self.assertTrue(torch.all(indices[distances.isinf()] == -1))
+
+    def test_read_write(self) -> None:
+        faces = [
+            LibraryFace(Path("a.jpg"), BoundingBox(0, 0, 10, 10), 0.9),
+            LibraryFace(Path("b.jpg"), BoundingBox(1, 2, 3, 4), 0.8),
+        ]
+        stream = io.StringIO()
+        write_clusters(stream, [faces, faces[:1]])
+        stream.seek(0)
+        self.assertListEqual(
+            read_clusters(stream),
+            [
+                (None, [(face.path, face.box) for face in faces]),
+                (None, [(faces[0].path, faces[0].box)]),
+            ],
+        )
+
+    def test_enrol_clusters(self) -> None:
+        images = Path(__file__).parent / "data" / "images"
+        with tempfile.TemporaryDirectory() as tmp:
+            builder = DefaultBuilder(
+                device=torch.device("cpu"),
+                registry_path=Path(tmp) / "registry.pkl",
+            )
+            boxes = [
+                box
+                for box, _ in builder.detector.detect(
+                    builder.open_image(images / "monty_python.jpg")
+                )
+            ]
+            skipped = enrol_clusters(
+                builder,
+                [
+                    ("john", [(images / "monty_python.jpg", box) for box in boxes[:2]]),
+                    (None, [(images / "monty_python.jpg", boxes[2])]),
+                    ("douglas", [(images / "monty_python.jpg", boxes[3])]),
+                ],
+            )
+            self.assertListEqual(skipped, [])
+            self.assertListEqual(
+                sorted(identity for _, identity in builder.registry),
+                ["douglas", "john", "john"],
+            )
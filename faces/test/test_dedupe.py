@@ -0,0 +1,83 @@
+import unittest
+from pathlib import Path
+
+import numpy as np
+import torch
+
+from faces import FacePatch
+from faces.dedupe import DeduplicatingRegistry, duplicates, find_near_duplicates
+from faces.encoder import ResnetEncoder
+from faces.registry import InMemoryRegistry
+
+
+class TestDuplicates(unittest.TestCase):
+    def test_duplicates(self) -> None:
+        encodings = torch.tensor([[0.0], [0.1], [1.0], [0.2], [1.05], [0.35]])
+        self.assertListEqual(
+            duplicates(encodings, 0.25, chunk_size=4).tolist(),
+            [False, True, False, True, True, False],
+        )
+
+    def test_empty(self) -> None:
+        self.assertEqual(len(duplicates(torch.empty((0, 512)), 0.25)), 0)
+
+
+class TestDeduplicatingRegistry(unittest.TestCase):
+    def setUp(self) -> None:
+        self.encoder = ResnetEncoder(torch.device("cpu"))
+        self.queries = (
+            "eric-idle.npy",
+            "graham-chapman.npy",
+            "john-cleese.npy",
+        )
+        self.patches = [
+            FacePatch(np.load(Path(__file__).parent / "data" / "patches" / query))
+            for query in self.queries
+        ]
+
+    def test_find_near_duplicates(self) -> None:
+        near = self.patches[0] + 0.01 * torch.randn_like(self.patches[0])
+        samples = list(zip(self.patches, self.queries)) + [
+            (near, self.queries[0]),
+            (near, self.queries[1]),  # not a duplicate of another identity
+        ]
+        found = find_near_duplicates(
+            samples, encoder=self.encoder, distance_threshold=0.3
+        )
+        self.assertEqual(len(found), 1)
+        self.assertIs(found[0][0], near)
+        self.assertEqual(found[0][1], self.queries[0])
+
+    def test_add(self) -> None:
+        registry = DeduplicatingRegistry(
+            InMemoryRegistry(), encoder=self.encoder, distance_threshold=0.3
+        )
+        for patch, identity in zip(self.patches, self.queries):
+            registry.add(patch, identity)
+        near = self.patches[0] + 0.01 * torch.randn_like(self.patches[0])
+        self.assertRaises(ValueError, registry.add, near, self.queries[0])
+        registry.add(near, "someone else")
+        self.assertEqual(len(registry), 4)
+
+    def test_add_many(self) -> None:
+        inner = InMemoryRegistry()
+        inner.add(self.patches[0], self.queries[0])
+        registry = DeduplicatingRegistry(
+            inner, encoder=self.encoder, distance_threshold=0.3
+        )
+        near = self.patches[1] + 0.01 * torch.randn_like(self.patches[1])
+        skipped = registry.add_many(
+            [
+                (self.patches[0] + 0.01, self.queries[0]),
+                (self.patches[1], self.queries[1]),
+                (near, self.queries[1]),
+            ]
+        )
+        self.assertEqual(len(skipped), 2)
+        self.assertEqual(len(inner), 2)
+
+        # discard
+        registry.discard([item for item in registry if item[1] == self.queries[1]])
+        self.assertEqual(len(registry), 1)
+        registry.add(near, self.queries[1])
+        self.assertEqual(len(registry), 2)
@@ -1,11 +1,13 @@
 import unittest
 from pathlib import Path
+from typing import List
 
+import cv2
 import numpy as np
 import torch
 
-from faces import BoundingBox, Image
-from faces.detector import MTCNNDetector
+from faces import BoundingBox, Frame, Image
+from faces.detector import DetectionProfile, MTCNNDetector
 
 
 class TestDetector(unittest.TestCase):
@@ -157,6 +159,121 @@ class TestDetector(unittest.TestCase):
             )
         )
 
+    def test_many(self) -> None:
+        images = [
+            Image.open(Path(__file__).parent / "data" / "images" / name)
+            for name in ("douglas_adams.jpg", "monty_python.jpg", "douglas_adams.jpg")
+        ]
+        detector = MTCNNDetector(torch.device("cpu"))
+        detections = detector.many(images)
+        # images of the same size are detected at once, with the same results
+        self.assertEqual(len(detections), 3)
+        for image, boxes_and_probability in zip(images, detections):
+            expected = list(detector.detect(image))
+            self.assertEqual(len(boxes_and_probability), len(expected))
+            for (box, _), (other, _) in zip(boxes_and_probability, expected):
+                self.assertLess(
+                    abs(np.array(box.as_tuple) - np.array(other.as_tuple)).max(), 1
+                )
+        self.assertEqual(detector.many([]), [])
+
+    def test_detect_tiled(self) -> None:
+        detector = MTCNNDetector(
+            device=torch.device("cpu"),
+            probability_threshold=0.99,
+            tile_size=500,
+            tile_overlap=150,
+        )
+        image = Image.open(
+            Path(__file__).parent / "data" / "images" / "monty_python.jpg"
+        )
+        expected = {
+            box
+            for box, prob in self.detector.detect(image)
+            if prob >= detector.probability_threshold
+        }
+        tiled = [box for box, _ in detector.detect(image)]
+        # finds the same faces, without duplicates
+        self.assertEqual(len(tiled), len(expected))
+        for box in expected:
+            self.assertTrue(
+                any(
+                    abs(np.array(box.as_tuple) - np.array(other.as_tuple)).max() < 10
+                    for other in tiled
+                )
+            )
+        # small images are not tiled
+        image = Image.open(
+            Path(__file__).parent / "data" / "images" / "douglas_adams.jpg",
+            target_size=400,
+        )
+        self.assertSetEqual(
+            set(MTCNNDetector(torch.device("cpu"), tile_size=500).detect(image)),
+            set(MTCNNDetector(torch.device("cpu")).detect(image)),
+        )
+
+    def test_detect_tiled_source(self) -> None:
+        path = Path(__file__).parent / "data" / "images" / "monty_python.jpg"
+        image = Image.open(path, target_size=500, keep_source=True)
+        detector = MTCNNDetector(
+            device=torch.device("cpu"),
+            probability_threshold=0.99,
+            tile_size=800,
+            tile_overlap=200,
+        )
+        expected = [
+            box
+            for box, prob in self.detector.detect(image)
+            if prob >= detector.probability_threshold
+        ]
+        tiled = [box for box, _ in detector.detect(image)]
+        # tiles of the source image find the faces, in downsized coordinates
+        for box in expected:
+            self.assertTrue(
+                any(
+                    abs(np.array(box.as_tuple) - np.array(other.as_tuple)).max() < 10
+                    for other in tiled
+                )
+            )
+        for box in tiled:
+            self.assertLessEqual(box.upper_left, image.image.width + 1)
+            self.assertLessEqual(box.upper_top, image.image.height + 1)
+
+    def test_profile(self) -> None:
+        path = Path(__file__).parent / "data" / "images" / "douglas_adams.jpg"
+        profiles: List[DetectionProfile] = []
+        detector = MTCNNDetector(torch.device("cpu"), profile=profiles.append)
+        detections = list(detector.detect(Image.open(path)))
+        self.assertSetEqual(
+            set(detections), set(self.detector.detect(Image.open(path)))
+        )
+        (profile,) = profiles
+        self.assertEqual((profile.width, profile.height), Image.open(path).image.size)
+        self.assertGreater(profile.scales, 0)
+        self.assertGreaterEqual(profile.rnet_candidates, profile.onet_candidates)
+        self.assertGreaterEqual(profile.onet_candidates, profile.faces)
+        self.assertEqual(profile.faces, len(detections))
+        self.assertGreater(profile.pnet_seconds, 0)
+        self.assertGreater(profile.rnet_seconds, 0)
+        self.assertGreater(profile.onet_seconds, 0)
+        # larger faces need fewer pyramid scales
+        MTCNNDetector(
+            torch.device("cpu"), min_face_size=80, profile=profiles.append
+        ).detect(Image.open(path))
+        self.assertEqual(len(profiles), 1)  # detection is lazy
+        list(
+            MTCNNDetector(
+                torch.device("cpu"), min_face_size=80, profile=profiles.append
+            ).detect(Image.open(path))
+        )
+        self.assertLess(profiles[1].scales, profile.scales)
+        # frames
+        list(detector.detect(Frame.from_array(cv2.imread(str(path)))))
+        self.assertEqual(
+            (profiles[2].width, profiles[2].height), (profile.width, profile.height)
+        )
+        self.assertEqual(profiles[2].faces, 1)
+
     def test_extract(self) -> None:
         image = Image.open(
             Path(__file__).parent / "data" / "images" / "monty_python.jpg"
@@ -198,6 +315,46 @@ class TestDetector(unittest.TestCase):
             )
         )
 
+    def test_frame(self) -> None:
+        path = Path(__file__).parent / "data" / "images" / "douglas_adams.jpg"
+        frame = Frame.from_array(cv2.imread(str(path)))
+        ((box, prob),) = self.detector.detect(Image.open(path))
+        ((frame_box, frame_prob),) = self.detector.detect(frame)
+        self.assertAlmostEqual(frame_prob, prob, places=3)
+        self.assertLess(
+            abs(np.array(frame_box.as_tuple) - np.array(box.as_tuple)).max(), 5
+        )
+        ((extracted_box, patch),) = self.detector.extract(frame)
+        self.assertEqual(extracted_box, frame_box)
+        self.assertEqual(patch.shape, (3, 160, 160))
+
+    def test_crop(self) -> None:
+        image = Image.open(
+            Path(__file__).parent / "data" / "images" / "monty_python.jpg"
+        )
+        boxes = [box for box, _ in self.detector.detect(image)]
+        patches = self.detector.crop(image, boxes)
+        self.assertEqual(patches.shape, (len(boxes), 3, 160, 160))
+        for (box, patch), expected in zip(self.detector.extract(image), patches):
+            self.assertTrue(torch.equal(patch, expected))
+        # no boxes
+        self.assertEqual(self.detector.crop(image, []).shape, (0, 3, 160, 160))
+
+    def test_crop_from_source(self) -> None:
+        path = Path(__file__).parent / "data" / "images" / "monty_python.jpg"
+        image = Image.open(path, target_size=500, keep_source=True)
+        self.assertEqual(image.source.size, (1700, 956))
+        boxes_and_patches = list(self.detector.extract(image))
+        self.assertTrue(boxes_and_patches)
+        for box, patch in boxes_and_patches:
+            # boxes refer to the downsized image
+            self.assertLessEqual(box.upper_left, image.image.width)
+            self.assertEqual(patch.shape, (3, 160, 160))
+        # patches are cropped from the source image
+        box, patch = boxes_and_patches[0]
+        proxy = Image(image.image)
+        self.assertFalse(torch.equal(self.detector.crop(proxy, [box])[0], patch))
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -1,10 +1,12 @@
 import unittest
 from pathlib import Path
 
+import cv2
+import numpy as np
 from PIL import Image as PILImage
 
-from faces import BoundingBox, Image
-from faces.drawing import PILAnnotate
+from faces import BoundingBox, Frame, Image
+from faces.drawing import CVAnnotate, PILAnnotate, as_bgr, as_pil
 
 
 class TestAnnotate(unittest.TestCase):
@@ -47,6 +49,73 @@ class TestAnnotate(unittest.TestCase):
         self.assertIsInstance(annotated_image, PILImage.Image)
         self.assertEqual(annotated_image.size, self.image.image.size)
 
+    def test_frame(self) -> None:
+        frame = Frame.from_array(np.zeros((100, 200, 3), dtype=np.uint8))
+        annotated_image = self.annotate(frame, self.bounding_boxes)
+        self.assertIsInstance(annotated_image, PILImage.Image)
+        self.assertEqual(annotated_image.size, frame.size)
+        # the frame is not modified
+        self.assertFalse(frame.buffer.any())
+
+
+class TestCVAnnotate(unittest.TestCase):
+    def setUp(self) -> None:
+        self.buffer = cv2.imread(
+            str(Path(__file__).parent / "data" / "images" / "douglas_adams.jpg")
+        )
+        self.annotate = CVAnnotate()
+        self.bounding_boxes = [
+            BoundingBox(10, 20, 30, 40),
+            BoundingBox(40, 10, 60, 20),
+            BoundingBox(80, 50, 160, 60),
+        ]
+
+    def test_in_place(self) -> None:
+        frame = Frame.from_array(self.buffer.copy(), target_size=1600)
+        annotated = self.annotate.with_identity(
+            frame, ((box, "Hello world") for box in self.bounding_boxes)
+        )
+        self.assertIs(annotated, frame)
+        self.assertFalse(np.array_equal(frame.buffer, self.buffer))
+        # box color
+        np.testing.assert_array_equal(frame.buffer[20, 10], (0, 0, 255))
+
+    def test_copy(self) -> None:
+        frame = Frame.from_array(self.buffer.copy(), target_size=1600)
+        annotated = CVAnnotate(copy=True)(frame, self.bounding_boxes)
+        self.assertIsNot(annotated.buffer, frame.buffer)
+        np.testing.assert_array_equal(frame.buffer, self.buffer)
+        self.assertFalse(np.array_equal(annotated.buffer, self.buffer))
+
+    def test_image(self) -> None:
+        image = Image.open(
+            Path(__file__).parent / "data" / "images" / "douglas_adams.jpg"
+        )
+        for annotated in (
+            self.annotate.with_probability(
+                image, ((box, 0.5) for box in self.bounding_boxes)
+            ),
+            self.annotate.with_enumeration(image, self.bounding_boxes),
+            self.annotate(image, self.bounding_boxes),
+        ):
+            self.assertIsInstance(annotated, Frame)
+            self.assertEqual(annotated.size, image.image.size)
+        # the image is not modified
+        self.assertEqual(
+            np.asarray(image.image).tobytes(),
+            np.asarray(
+                Image.open(
+                    Path(__file__).parent / "data" / "images" / "douglas_adams.jpg"
+                ).image
+            ).tobytes(),
+        )
+
+    def test_conversion(self) -> None:
+        frame = self.annotate(Frame.from_array(self.buffer.copy()), [])
+        self.assertIs(as_bgr(frame), frame.buffer)
+        np.testing.assert_array_equal(np.asarray(as_pil(frame)), frame.rgb)
+        np.testing.assert_array_equal(as_bgr(as_pil(frame)), frame.buffer)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -43,6 +43,25 @@ class TestEncoder(unittest.TestCase):
                 np.load(Path(__file__).parent / "data" / "encodings" / query),
             )
 
+    def test_many(self) -> None:
+        patches = torch.stack(
+            [
+                FacePatch(np.load(Path(__file__).parent / "data" / "patches" / query))
+                for query in (
+                    "eric-idle.npy",
+                    "graham-chapman.npy",
+                    "john-cleese.npy",
+                )
+            ]
+        )
+        encodings = self.encoder.many(patches)
+        self.assertEqual(encodings.shape, (3, 512))
+        # batched encoding
+        for batch_size in (1, 2, 3, 4):
+            torch.testing.assert_close(
+                self.encoder.many(patches, batch_size=batch_size), encodings
+            )
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,98 @@
+import json
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+import torch
+
+from faces.builder import DefaultBuilder
+from faces.enrol import BulkEnrolment, identity_from_path, walk
+
+
+class TestEnrol(unittest.TestCase):
+    def setUp(self) -> None:
+        images = Path(__file__).parent / "data" / "images"
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name) / "archive"
+        (self.root / "douglas-adams" / "2001").mkdir(parents=True)
+        (self.root / "monty-python").mkdir()
+        shutil.copy(images / "douglas_adams.jpg", self.root / "douglas-adams" / "a.jpg")
+        shutil.copy(
+            images / "douglas_adams.jpg", self.root / "douglas-adams" / "2001" / "b.jpg"
+        )
+        shutil.copy(images / "monty_python.jpg", self.root / "monty-python" / "c.jpg")
+        (self.root / "notes.txt").write_text("not an image")
+
+        self.builder = DefaultBuilder(
+            device=torch.device("cpu"),
+            registry_path=Path(self.tmp.name) / "registry.pkl",
+        )
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def test_identity_from_path(self) -> None:
+        self.assertEqual(identity_from_path(Path("a/john-cleese.jpg")), "john cleese")
+        self.assertEqual(identity_from_path(Path("a/eric_idle")), "eric idle")
+
+    def test_walk(self) -> None:
+        self.assertListEqual(
+            [
+                (path.relative_to(self.root), label.name)
+                for path, label in walk([self.root])
+            ],
+            [
+                (Path("douglas-adams/2001/b.jpg"), "douglas-adams"),
+                (Path("douglas-adams/a.jpg"), "douglas-adams"),
+                (Path("monty-python/c.jpg"), "monty-python"),
+            ],
+        )
+
+    def test_walk_flat(self) -> None:
+        # a directory of images of one person
+        self.assertListEqual(
+            [
+                (path.name, label.name)
+                for path, label in walk([self.root / "monty-python"])
+            ],
+            [("c.jpg", "monty-python")],
+        )
+        shutil.copy(
+            self.root / "monty-python" / "c.jpg", self.root / "monty-python" / "d.jpg"
+        )
+        self.assertSetEqual(
+            {label for _, label in walk([self.root / "monty-python"])},
+            {self.root / "monty-python"},
+        )
+
+    def test_run(self) -> None:
+        review_path = Path(self.tmp.name) / "review.jsonl"
+        checkpoint_path = Path(self.tmp.name) / "checkpoint"
+        statistics = BulkEnrolment(
+            self.builder,
+            review_path=review_path,
+            checkpoint_path=checkpoint_path,
+            workers=2,
+            batch_size=2,
+        ).run([self.root])
+        self.assertEqual(statistics.images, 3)
+        self.assertEqual(statistics.review, 1)
+        # identical patches are added once
+        self.assertEqual(statistics.added, 1)
+        self.assertEqual(statistics.known, 1)
+        self.assertEqual(len(self.builder.registry), 1)
+        self.assertSetEqual(
+            {identity for _, identity in self.builder.registry}, {"douglas adams"}
+        )
+        (review,) = map(json.loads, review_path.read_text().splitlines())
+        self.assertEqual(review["identity"], "monty python")
+        self.assertEqual(len(review["boxes"]), 7)
+        self.assertEqual(len(checkpoint_path.read_text().splitlines()), 3)
+
+        # resume
+        statistics = BulkEnrolment(self.builder, checkpoint_path=checkpoint_path).run(
+            [self.root]
+        )
+        self.assertEqual(statistics.resumed, 3)
+        self.assertEqual(statistics.images, 0)
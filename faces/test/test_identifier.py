@@ -1,13 +1,189 @@
 import unittest
 from os.path import basename
 from pathlib import Path
+from tempfile import mkstemp
 
 import numpy as np
 import torch
 
 from faces import FacePatch, Identity
 from faces.encoder import ResnetEncoder
-from faces.identifier import ConstrainedNearestNeighbourClassifier
+from faces.identifier import (
+    ConstrainedNearestNeighbourClassifier,
+    CosineNearestNeighbour,
+    NearestNeighbour,
+    Projection,
+    ShortlistNearestNeighbour,
+    VotingNearestNeighbourClassifier,
+)
+
+
+class TestNearestNeighbour(unittest.TestCase):
+    def setUp(self) -> None:
+        generator = torch.Generator().manual_seed(0)
+        self.encodings = torch.nn.functional.normalize(
+            torch.randn((100, 512), generator=generator), dim=1
+        )
+        self.targets = torch.arange(100)
+        self.queries = torch.nn.functional.normalize(
+            self.encodings[:10] + 0.01 * torch.randn((10, 512), generator=generator),
+            dim=1,
+        )
+
+    def test_precision(self) -> None:
+        exact = NearestNeighbour(encodings=self.encodings, targets=self.targets)
+        for precision, dtype, tolerance in (
+            ("float32", torch.float32, 1e-5),
+            ("float16", torch.float16, 1e-3),
+            ("int8", torch.int8, 1e-2),
+        ):
+            classifier = CosineNearestNeighbour.from_encodings(
+                self.encodings, self.targets, precision
+            )
+            self.assertEqual(classifier.encodings.dtype, dtype)
+            self.assertEqual(classifier.encodings.shape, (100, 512))
+            torch.testing.assert_close(
+                classifier.distances(self.queries),
+                exact.distances(self.queries),
+                atol=tolerance,
+                rtol=0,
+            )
+            for index, query in enumerate(self.queries):
+                self.assertEqual(classifier(query)[0], index)
+
+        self.assertRaises(
+            ValueError,
+            CosineNearestNeighbour.from_encodings,
+            self.encodings,
+            self.targets,
+            "int4",
+        )
+
+    def test_search(self) -> None:
+        classifier = NearestNeighbour(
+            encodings=self.encodings, targets=self.targets % 10
+        )
+        distances, targets = classifier.search(self.queries, 3)
+        self.assertEqual(distances.shape, (10, 3))
+        self.assertEqual(targets.shape, (10, 3))
+        # sorted by ascending distance
+        self.assertTrue(torch.all(distances[:, :-1] <= distances[:, 1:]))
+        # nearest neighbour first
+        self.assertListEqual(targets[:, 0].tolist(), list(range(10)))
+        for query, (target, distance) in zip(
+            self.queries, zip(targets[:, 0], distances[:, 0])
+        ):
+            self.assertEqual(classifier(query)[0], int(target))
+            self.assertAlmostEqual(classifier(query)[1], distance.item(), places=5)
+        # k exceeds the number of references
+        self.assertEqual(classifier.search(self.queries, 1000)[0].shape, (10, 100))
+
+    def test_gathered_distances(self) -> None:
+        index = torch.randint(
+            0, 100, (10, 7), generator=torch.Generator().manual_seed(0)
+        )
+        for classifier in (
+            NearestNeighbour(encodings=self.encodings, targets=self.targets),
+            CosineNearestNeighbour.from_encodings(
+                self.encodings, self.targets, "float16"
+            ),
+            CosineNearestNeighbour.from_encodings(self.encodings, self.targets, "int8"),
+        ):
+            torch.testing.assert_close(
+                classifier.gathered_distances(self.queries, index),
+                torch.gather(classifier.distances(self.queries), 1, index),
+            )
+        # chunked by queries
+        classifier = CosineNearestNeighbour.from_encodings(
+            self.encodings, self.targets, "int8"
+        )
+        chunked = CosineNearestNeighbour(
+            encodings=classifier.encodings,
+            targets=classifier.targets,
+            scales=classifier.scales,
+            chunk_size=15,
+        )
+        torch.testing.assert_close(
+            chunked.gathered_distances(self.queries, index),
+            classifier.gathered_distances(self.queries, index),
+        )
+
+    def test_chunk_size(self) -> None:
+        classifier = CosineNearestNeighbour.from_encodings(
+            self.encodings, self.targets, "int8"
+        )
+        chunked = CosineNearestNeighbour(
+            encodings=classifier.encodings,
+            targets=classifier.targets,
+            scales=classifier.scales,
+            chunk_size=7,
+        )
+        torch.testing.assert_close(
+            chunked.distances(self.queries), classifier.distances(self.queries)
+        )
+
+
+class TestProjection(unittest.TestCase):
+    def setUp(self) -> None:
+        generator = torch.Generator().manual_seed(0)
+        # encodings that mostly vary along few directions
+        self.encodings = torch.randn((200, 8), generator=generator) @ torch.randn(
+            (8, 512), generator=generator
+        ) + 0.01 * torch.randn((200, 512), generator=generator)
+        self.path = Path(mkstemp(prefix="faces-test-")[1])
+
+    def tearDown(self) -> None:
+        self.path.unlink(missing_ok=True)
+
+    def test_fit(self) -> None:
+        projection = Projection.fit(self.encodings, 16)
+        self.assertEqual(projection.dims, 16)
+        self.assertEqual(projection.num_samples, 200)
+        self.assertEqual(projection(self.encodings).shape, (200, 16))
+        # distances are mostly preserved
+        torch.testing.assert_close(
+            torch.cdist(projection(self.encodings), projection(self.encodings)),
+            torch.cdist(self.encodings, self.encodings),
+            atol=1.0,
+            rtol=0.01,
+        )
+
+    def test_save_and_load(self) -> None:
+        projection = Projection.fit(self.encodings, 16)
+        projection.save(self.path)
+        loaded = Projection.load(self.path, torch.device("cpu"))
+        self.assertEqual(loaded.num_samples, projection.num_samples)
+        torch.testing.assert_close(loaded.mean, projection.mean)
+        torch.testing.assert_close(loaded.components, projection.components)
+
+    def test_shortlist(self) -> None:
+        targets = torch.arange(200)
+        exact = NearestNeighbour(encodings=self.encodings, targets=targets)
+        classifier = ShortlistNearestNeighbour.from_classifier(
+            exact, self.encodings, Projection.fit(self.encodings, 16), shortlist=10
+        )
+        self.assertEqual(classifier.encodings.shape, (200, 512))
+        self.assertEqual(classifier.targets.shape, (200,))
+        self.assertFalse(classifier.is_empty)
+        for query in self.encodings[:20] + 0.01:
+            index, distance = classifier(query)
+            self.assertEqual(index, exact(query)[0])
+            self.assertAlmostEqual(distance, exact(query)[1], places=2)
+
+        # re-ranks on the compressed references
+        compressed = CosineNearestNeighbour.from_encodings(
+            self.encodings, targets, "int8"
+        )
+        classifier = ShortlistNearestNeighbour.from_classifier(
+            compressed, self.encodings, Projection.fit(self.encodings, 16), 10
+        )
+        for index, query in enumerate(self.encodings[:20]):
+            self.assertEqual(classifier(query)[0], index)
+        # queries are re-ranked at once
+        distances, indices = classifier.search(self.encodings[:20], 3)
+        self.assertEqual(distances.shape, (20, 3))
+        self.assertListEqual(indices[:, 0].tolist(), list(range(20)))
+        self.assertTrue(torch.all(distances[:, :-1] <= distances[:, 1:]))
 
 
 class TestIdentifier(unittest.TestCase):
@@ -37,6 +213,19 @@ class TestIdentifier(unittest.TestCase):
         self.assertEqual(identifier.classifier.targets.shape, (4,))
         self.assertEqual(len(identifier.index2identity), 4)
 
+        # batched encoding
+        for samples_ in (samples, iter(samples)):
+            batched = ConstrainedNearestNeighbourClassifier.fit(
+                samples=samples_,
+                distance_threshold=1.1,
+                restklasse="Anonymous",
+                encoder=self.encoder,
+                batch_size=3,
+            )
+            torch.testing.assert_close(
+                batched.classifier.encodings, identifier.classifier.encodings
+            )
+
         # empty data
         identifier = ConstrainedNearestNeighbourClassifier.fit(
             samples=[],
@@ -88,6 +277,58 @@ class TestIdentifier(unittest.TestCase):
         self.assertEqual(identifier(idle[0]), "terry-jones.npy")
         self.assertEqual(identifier(chapman[0]), "Anonymous")
 
+        # compressed references
+        for precision in ("float32", "float16", "int8"):
+            identifier = ConstrainedNearestNeighbourClassifier.fit(
+                samples=samples_train,
+                distance_threshold=1.1,
+                restklasse="Anonymous",
+                encoder=self.encoder,
+                precision=precision,
+            )
+            for patch, target in samples_train:
+                self.assertEqual(identifier(patch), target)
+            self.assertEqual(identifier(idle[0]), "terry-jones.npy")
+            self.assertEqual(identifier(chapman[0]), "Anonymous")
+
+        # coarse search
+        identifier = ConstrainedNearestNeighbourClassifier.fit(
+            samples=samples_train,
+            distance_threshold=1.1,
+            restklasse="Anonymous",
+            encoder=self.encoder,
+            pca_dims=2,
+            shortlist=2,
+        )
+        self.assertIsNotNone(identifier.projection)
+        for patch, target in samples_train:
+            self.assertEqual(identifier(patch), target)
+
+        # top k
+        neighbours = identifier.top_k(idle[0], 3)
+        self.assertEqual(len(neighbours), 3)
+        self.assertEqual(neighbours[0][0], "terry-jones.npy")
+        self.assertListEqual(
+            [dist for _, dist in neighbours], sorted(dist for _, dist in neighbours)
+        )
+        self.assertListEqual(
+            identifier.many_top_k(torch.stack([idle[0], chapman[0]]), 2),
+            [identifier.top_k(idle[0], 2), identifier.top_k(chapman[0], 2)],
+        )
+
+        # voting
+        identifier = VotingNearestNeighbourClassifier.fit(
+            samples=samples_train,
+            distance_threshold=1.1,
+            restklasse="Anonymous",
+            encoder=self.encoder,
+            k=3,
+        )
+        self.assertEqual(identifier.k, 3)
+        for patch, target in samples_train:
+            self.assertEqual(identifier(patch), target)
+        self.assertEqual(identifier(chapman[0]), "Anonymous")
+
         # empty identifier
         identifier = ConstrainedNearestNeighbourClassifier.fit(
             samples=[],
@@ -97,6 +338,7 @@ class TestIdentifier(unittest.TestCase):
         )
         self.assertEqual(identifier(idle[0]), "Anonymous")
         self.assertEqual(identifier(chapman[0]), "Anonymous")
+        self.assertListEqual(identifier.top_k(idle[0], 3), [])
 
 
 if __name__ == "__main__":
@@ -0,0 +1,173 @@
+import os
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import torch
+
+from faces import BoundingBox
+from faces.builder import DefaultBuilder
+from faces.library import Library, LibraryIndexer, LibrarySearch
+
+
+class TestLibrary(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+        self.library = Library(self.root / "library.sqlite")
+
+    def tearDown(self) -> None:
+        self.library.close()
+        self.tmp.cleanup()
+
+    def test_update(self) -> None:
+        path = self.root / "a.jpg"
+        path.write_bytes(b"a")
+        stat = path.stat()
+        self.assertFalse(self.library.is_current(path, stat))
+
+        encodings = torch.randn(2, 512)
+        faces = [(BoundingBox(0, 0, 10, 10), 0.9), (BoundingBox(5, 5, 20, 30), 0.8)]
+        self.library.update(path, stat, (100, 50), faces, encodings)
+        self.library.commit()
+        self.assertTrue(self.library.is_current(path, stat))
+        self.assertEqual(len(self.library), 1)
+
+        # reopen the database
+        self.library.close()
+        self.library = Library(self.root / "library.sqlite")
+        stored, stored_encodings = self.library.encodings()
+        self.assertListEqual([box for box, _ in faces], [f.box for f in stored])
+        self.assertTrue(torch.equal(stored_encodings, encodings))
+
+        # replace
+        self.library.update(path, stat, (100, 50), faces[:1], encodings[:1])
+        stored, stored_encodings = self.library.encodings()
+        self.assertEqual(len(stored), 1)
+        self.assertEqual(stored_encodings.shape, (1, 512))
+
+        # changed file
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+        self.assertFalse(self.library.is_current(path, path.stat()))
+
+    def test_encodings_under(self) -> None:
+        for name in ("a/x.jpg", "b/y.jpg"):
+            path = self.root / name
+            path.parent.mkdir()
+            path.write_bytes(b"x")
+            self.library.update(
+                path,
+                path.stat(),
+                (10, 10),
+                [(BoundingBox(0, 0, 1, 1), 1.0)],
+                torch.randn(1, 512),
+            )
+        faces, encodings = self.library.encodings(under=[self.root / "a"])
+        self.assertListEqual([face.path for face in faces], [self.root / "a/x.jpg"])
+        self.assertEqual(encodings.shape, (1, 512))
+        self.assertEqual(self.library.encodings(under=[self.root / "c"]), ([], None))
+
+    def test_remove(self) -> None:
+        path = self.root / "a.jpg"
+        path.write_bytes(b"a")
+        self.library.update(
+            path,
+            path.stat(),
+            (10, 10),
+            [(BoundingBox(0, 0, 1, 1), 1.0)],
+            torch.randn(1, 512),
+        )
+        self.library.remove([path])
+        self.assertEqual(len(self.library), 0)
+        self.assertEqual(self.library.encodings(), ([], None))
+
+
+class TestLibrarySearch(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+        self.library = Library(self.root / "library.sqlite")
+
+    def tearDown(self) -> None:
+        self.library.close()
+        self.tmp.cleanup()
+
+    def test_search(self) -> None:
+        encodings = torch.nn.functional.normalize(torch.randn(5, 512), dim=1)
+        for name, rows in (("a.jpg", [0, 1]), ("b.jpg", [2, 3, 4])):
+            path = self.root / name
+            path.write_bytes(b"x")
+            self.library.update(
+                path,
+                path.stat(),
+                (10, 10),
+                [(BoundingBox(row, 0, row + 1, 1), 1.0) for row in rows],
+                encodings[rows],
+            )
+        search = LibrarySearch.from_library(self.library, torch.device("cpu"))
+        matches, other = search(encodings[[3, 0]], k=2)
+        self.assertEqual(matches[0][0].path, self.root / "b.jpg")
+        self.assertEqual(matches[0][0].box.lower_left, 3)
+        self.assertAlmostEqual(matches[0][1], 0.0, places=3)
+        self.assertLess(matches[0][1], matches[1][1])
+        self.assertEqual(other[0][0].path, self.root / "a.jpg")
+        self.assertEqual(other[0][0].box.lower_left, 0)
+
+    def test_empty(self) -> None:
+        search = LibrarySearch.from_library(self.library, torch.device("cpu"))
+        self.assertEqual(search(torch.randn(2, 512), k=3), [[], []])
+
+
+class TestLibraryIndexer(unittest.TestCase):
+    def setUp(self) -> None:
+        images = Path(__file__).parent / "data" / "images"
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name) / "photos"
+        self.root.mkdir()
+        shutil.copy(images / "douglas_adams.jpg", self.root / "a.jpg")
+        shutil.copy(images / "monty_python.jpg", self.root / "b.jpg")
+        self.builder = DefaultBuilder(
+            device=torch.device("cpu"),
+            registry_path=Path(self.tmp.name) / "registry.pkl",
+        )
+        self.library = Library(Path(self.tmp.name) / "library.sqlite")
+
+    def tearDown(self) -> None:
+        self.library.close()
+        self.tmp.cleanup()
+
+    def test_run(self) -> None:
+        statistics = LibraryIndexer(self.builder, self.library, workers=2).run(
+            [self.root]
+        )
+        self.assertEqual(statistics.indexed, 2)
+        self.assertEqual(statistics.faces, 8)
+        faces, encodings = self.library.encodings()
+        self.assertEqual(encodings.shape, (8, 512))
+
+        # rescan skips unchanged files
+        statistics = LibraryIndexer(self.builder, self.library).run([self.root])
+        self.assertEqual(statistics.indexed, 0)
+        self.assertEqual(statistics.unchanged, 2)
+
+        # rescan picks up changed and removed files
+        shutil.copy(self.root / "a.jpg", self.root / "b.jpg")
+        (self.root / "a.jpg").unlink()
+        statistics = LibraryIndexer(self.builder, self.library).run([self.root])
+        self.assertEqual(statistics.indexed, 1)
+        self.assertEqual(statistics.removed, 1)
+        faces, encodings = self.library.encodings()
+        self.assertListEqual(
+            [face.path for face in faces], [(self.root / "b.jpg").resolve()]
+        )
+
+    def test_vanished(self) -> None:
+        # a file removed between listing the directory and reading it
+        vanished = self.root / "c.jpg"
+        with mock.patch("faces.library.walk", return_value=[vanished]):
+            statistics = LibraryIndexer(self.builder, self.library).run([self.root])
+        self.assertEqual(statistics.files, 1)
+        self.assertEqual(statistics.errors, 1)
+        self.assertEqual(statistics.indexed, 0)
@@ -0,0 +1,117 @@
+import time
+import unittest
+from pathlib import Path
+
+import numpy as np
+import torch
+
+from faces import FacePatch, Image
+from faces.detector import MTCNNDetector
+from faces.drawing import PILAnnotate
+from faces.encoder import ResnetEncoder
+from faces.identifier import ConstrainedNearestNeighbourClassifier
+from faces.metrics import (
+    Histogram,
+    Metrics,
+    TimedAnnotate,
+    TimedDetector,
+    TimedEncoder,
+    TimedIdentifier,
+)
+
+
+class TestHistogram(unittest.TestCase):
+    def test_observe(self) -> None:
+        histogram = Histogram(buckets=(0.1, 1.0, float("inf")))
+        for seconds in (0.05, 0.1, 0.5, 2.0):
+            histogram.observe(seconds)
+        self.assertListEqual(histogram.counts, [2, 1, 1])
+        self.assertEqual(histogram.count, 4)
+        self.assertAlmostEqual(histogram.total, 2.65)
+        self.assertEqual(histogram.maximum, 2.0)
+        self.assertEqual(histogram.quantile(0.5), 0.1)
+        self.assertEqual(histogram.quantile(0.75), 1.0)
+        self.assertEqual(histogram.quantile(1.0), 2.0)
+
+
+class TestMetrics(unittest.TestCase):
+    def test_timer(self) -> None:
+        metrics = Metrics()
+        with metrics.timer("detect"):
+            pass
+        with self.assertRaises(ValueError):
+            with metrics.timer("detect"):
+                raise ValueError()
+        self.assertEqual(metrics.histograms["detect"].count, 2)
+        self.assertIn("detect", metrics.summary())
+
+    def test_prometheus(self) -> None:
+        metrics = Metrics()
+        metrics.observe("encode", 0.002)
+        metrics.observe("encode", 20.0)
+        lines = metrics.prometheus().splitlines()
+        self.assertIn("# TYPE faces_stage_seconds histogram", lines)
+        self.assertIn('faces_stage_seconds_bucket{stage="encode",le="0.001"} 0', lines)
+        self.assertIn('faces_stage_seconds_bucket{stage="encode",le="0.0025"} 1', lines)
+        self.assertIn('faces_stage_seconds_bucket{stage="encode",le="+Inf"} 2', lines)
+        self.assertIn('faces_stage_seconds_sum{stage="encode"} 20.002', lines)
+        self.assertIn('faces_stage_seconds_count{stage="encode"} 2', lines)
+
+
+class TestTimed(unittest.TestCase):
+    def setUp(self) -> None:
+        self.metrics = Metrics()
+        self.image = Image.open(
+            Path(__file__).parent / "data" / "images" / "monty_python.jpg"
+        )
+
+    def test_detector(self) -> None:
+        detector = MTCNNDetector(device=torch.device("cpu"))
+        timed = TimedDetector(detector, self.metrics)
+        self.assertEqual(len(list(timed.extract(self.image))), 7)
+        self.assertEqual(self.metrics.histograms["detect"].count, 1)
+        self.assertEqual(self.metrics.histograms["crop"].count, 1)
+        # a batch counts once per image
+        self.assertEqual(len(timed.many([self.image, self.image])[1]), 7)
+        self.assertEqual(self.metrics.histograms["detect"].count, 3)
+        # other attributes are those of the detector
+        self.assertIs(timed.model, detector.model)
+
+    def test_identifier(self) -> None:
+        encoder = ResnetEncoder(torch.device("cpu"), pretrained=False)
+        patch = FacePatch(
+            np.load(Path(__file__).parent / "data" / "patches" / "eric-idle.npy")
+        )
+        identifier = ConstrainedNearestNeighbourClassifier.fit(
+            samples=[(patch, "eric-idle")], encoder=encoder, distance_threshold=0.1
+        )
+        timed = TimedIdentifier(
+            identifier, TimedEncoder(encoder, self.metrics), self.metrics
+        )
+        self.assertEqual(timed(patch), identifier(patch))
+        self.assertListEqual(timed.many(patch.unsqueeze(0)), ["eric-idle"])
+        self.assertEqual(self.metrics.histograms["encode"].count, 2)
+        self.assertEqual(self.metrics.histograms["search"].count, 2)
+        self.assertEqual(timed.restklasse, "Anonymous")
+
+    def test_annotate(self) -> None:
+        timed = TimedAnnotate(PILAnnotate(), self.metrics)
+        timed(self.image, [])
+        timed.with_identity(self.image, [])
+        self.assertEqual(self.metrics.histograms["annotate"].count, 2)
+
+    def test_annotate_lazy(self) -> None:
+        def boxes():
+            time.sleep(0.1)
+            yield from ()
+
+        timed = TimedAnnotate(PILAnnotate(), self.metrics)
+        timed.with_probability(self.image, boxes())
+        timed.with_enumeration(self.image, boxes())
+        # the upstream stages producing the boxes are not counted as drawing
+        self.assertEqual(self.metrics.histograms["annotate"].count, 2)
+        self.assertLess(self.metrics.histograms["annotate"].total, 0.1)
+
+
+if __name__ == "__main__":
+    unittest.main()
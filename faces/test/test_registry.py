@@ -1,13 +1,49 @@
+import multiprocessing
+import shutil
 import unittest
 from pathlib import Path
-from tempfile import mkstemp
+from tempfile import mkdtemp, mkstemp
 from typing import Iterable, Tuple
 
 import numpy as np
 import torch
 
 from faces import FacePatch, Identity
-from faces.registry import InMemoryRegistry, PickleRegistry
+from faces.registry import (
+    ColumnarRegistry,
+    InMemoryRegistry,
+    PickleRegistry,
+    open_registry,
+    pack_patch,
+    patch_digest,
+    stored_generation,
+    unpack_patch,
+)
+
+
+def _add_faces(path: Path, identity: Identity, seed: int) -> None:
+    """Add five random faces of *identity* to the registry at *path*."""
+    generator = torch.Generator().manual_seed(seed)
+    for _ in range(5):
+        registry = PickleRegistry.open(path, device=torch.device("cpu"))
+        registry.add(torch.rand(3, 160, 160, generator=generator), identity)
+
+
+class TestPackPatch(unittest.TestCase):
+    def test_pack(self) -> None:
+        patch = FacePatch(
+            np.load(Path(__file__).parent / "data" / "patches" / "john-cleese.npy")
+        )
+        packed = pack_patch(patch)
+        self.assertEqual(packed.dtype, torch.uint8)
+        self.assertTrue(torch.equal(unpack_patch(packed), patch))
+
+    def test_lossy(self) -> None:
+        # values that are not standardized 8-bit pixels are kept as they are
+        for patch in (torch.rand(3, 160, 160), torch.full((3, 160, 160), 2.0)):
+            packed = pack_patch(patch)
+            self.assertEqual(packed.dtype, torch.float32)
+            self.assertTrue(torch.equal(unpack_patch(packed), patch))
 
 
 class TestInMemoryRegistry(unittest.TestCase):
@@ -52,6 +88,15 @@ class TestInMemoryRegistry(unittest.TestCase):
         registry, queries, patches = self._initialize_registry()
         self.assertSetEqual(set(registry), set(zip(patches, queries)))
 
+    def test_counts(self) -> None:
+        registry, queries, patches = self._initialize_registry()
+        self.assertDictEqual(registry.counts(), {query: 1 for query in queries})
+
+    def test_discard(self) -> None:
+        registry, queries, patches = self._initialize_registry()
+        registry.discard([item for item in registry if item[1] == queries[0]])
+        self.assertSetEqual(set(registry), set(zip(patches[1:], queries[1:])))
+
     def test_len(self) -> None:
         registry = InMemoryRegistry()
         # new registry
@@ -69,6 +114,9 @@ class TestPickleRegistry(unittest.TestCase):
     def tearDown(self) -> None:
         self.registry_base_path.unlink(missing_ok=True)
         self.registry_path.unlink(missing_ok=True)
+        self.registry_path.with_name(self.registry_path.name + ".lock").unlink(
+            missing_ok=True
+        )
 
     def test_open(self) -> None:
         # open new registry
@@ -129,6 +177,111 @@ class TestPickleRegistry(unittest.TestCase):
         self.assertEqual(len(registry.data), 6)
         self.assertSetEqual(set(registry.data), set(zip(patches, queries)))
 
+    def test_add_many(self) -> None:
+        registry, queries, patches = self._initialize_registry()
+        patch = patches[0] + 1.0
+        skipped = registry.add_many(
+            [
+                (patches[0].clone(), queries[0]),  # known, skipped silently
+                (patches[1].clone(), "new name"),  # known as another identity
+                (patch, "new name"),
+                (patch.clone(), "new name"),  # duplicate within the batch
+            ]
+        )
+        self.assertEqual(len(skipped), 1)
+        self.assertEqual(len(registry.data), 7)
+        # registry has been saved
+        reloaded = PickleRegistry.open(self.registry_path, device=torch.device("cpu"))
+        self.assertEqual(len(reloaded.data), 7)
+
+    def test_compact(self) -> None:
+        registry, queries, patches = self._initialize_registry()
+        # patches are stored as uint8
+        self.assertLess(
+            self.registry_path.stat().st_size,
+            sum(patch.nbytes for patch in patches) / 3,
+        )
+        reloaded = PickleRegistry.open(self.registry_path, device=torch.device("cpu"))
+        self.assertSetEqual(
+            {(patch_digest(patch), identity) for patch, identity in reloaded},
+            {(patch_digest(patch), query) for patch, query in zip(patches, queries)},
+        )
+
+    def test_counts(self) -> None:
+        registry, queries, patches = self._initialize_registry()
+        registry.add(patches[0] + 1.0, queries[0])
+        self.assertDictEqual(
+            registry.counts(),
+            {query: 2 if query == queries[0] else 1 for query in queries},
+        )
+        # the counts are read without loading the faces
+        reloaded = PickleRegistry.open(self.registry_path, device=torch.device("cpu"))
+        self.assertNotIn("data", vars(reloaded))
+        self.assertDictEqual(reloaded.counts(), registry.counts())
+        self.assertEqual(len(reloaded), 7)
+        self.assertNotIn("data", vars(reloaded))
+        # faces are loaded on demand
+        self.assertEqual(len(list(reloaded)), 7)
+        # registry without header
+        registry = PickleRegistry.open(
+            Path(__file__).parent / "data" / "registry" / "faces.pkl",
+            device=torch.device("cpu"),
+        )
+        self.assertEqual(sum(registry.counts().values()), 4)
+
+    def test_discard(self) -> None:
+        registry, queries, patches = self._initialize_registry()
+        registry.discard([item for item in registry if item[1] in queries[:2]])
+        self.assertEqual(len(registry), 4)
+        # registry has been saved
+        reloaded = PickleRegistry.open(self.registry_path, device=torch.device("cpu"))
+        self.assertEqual(len(reloaded), 4)
+
+    def test_refresh(self) -> None:
+        registry, queries, patches = self._initialize_registry()
+        other = PickleRegistry.open(self.registry_path, device=torch.device("cpu"))
+        self.assertFalse(other.refresh())
+        self.assertEqual(len(list(other)), 6)
+        # changes of another instance are picked up
+        registry.add(patches[0] + 1.0, queries[0])
+        self.assertGreater(registry.generation, other.generation)
+        self.assertEqual(stored_generation(self.registry_path), registry.generation)
+        self.assertEqual(len(list(other)), 6)
+        self.assertTrue(other.refresh())
+        self.assertEqual(other.generation, registry.generation)
+        self.assertEqual(len(list(other)), 7)
+        # changes are made on the latest generation
+        registry.remove(queries[1])
+        other.add(patches[1] + 1.0, queries[1])
+        registry.refresh()
+        self.assertEqual(registry.counts()[queries[1]], 1)
+        self.assertEqual(len(registry), 7)
+        # no temporary files are left behind
+        self.assertListEqual(
+            sorted(self.registry_path.parent.glob(f".{self.registry_path.name}.*")),
+            [],
+        )
+
+    def test_concurrent(self) -> None:
+        processes = [
+            multiprocessing.Process(
+                target=_add_faces,
+                args=(self.registry_path, f"person {index}", index),
+            )
+            for index in range(4)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+            self.assertEqual(process.exitcode, 0)
+        registry = PickleRegistry.open(self.registry_path, device=torch.device("cpu"))
+        self.assertEqual(registry.generation, 20)
+        self.assertDictEqual(
+            registry.counts(), {f"person {index}": 5 for index in range(4)}
+        )
+        self.assertEqual(len(list(registry)), 20)
+
     def test_query(self) -> None:
         # new registry
         registry, queries, patches = self._initialize_registry()
@@ -153,5 +306,94 @@ class TestPickleRegistry(unittest.TestCase):
         self.assertEqual(len(registry), 4)
 
 
+class TestColumnarRegistry(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = Path(mkdtemp(prefix="faces-test-"))
+        self.source = PickleRegistry.open(
+            Path(__file__).parent / "data" / "registry" / "faces.pkl",
+            device=torch.device("cpu"),
+        )
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.directory)
+
+    def _digests(self, registry) -> set:
+        return {(patch_digest(patch), identity) for patch, identity in registry}
+
+    def test_roundtrip(self) -> None:
+        for path in (self.directory / "faces", self.directory / "faces.npz"):
+            ColumnarRegistry.write(path, self.source)
+            registry = open_registry(path, device=torch.device("cpu"))
+            self.assertIsInstance(registry, ColumnarRegistry)
+            self.assertEqual(len(registry), 4)
+            self.assertDictEqual(registry.counts(), self.source.counts())
+            self.assertSetEqual(self._digests(registry), self._digests(self.source))
+            self.assertIsNone(registry.encodings)
+
+    def test_mmap(self) -> None:
+        path = self.directory / "faces"
+        ColumnarRegistry.write(path, self.source, torch.zeros(4, 512))
+        registry = ColumnarRegistry.open(path, device=torch.device("cpu"))
+        self.assertIsInstance(registry.patches, np.memmap)
+        self.assertEqual(registry.patches.dtype, np.uint8)
+        self.assertEqual(registry.encodings.shape, (4, 512))
+        stored = registry.stored_encodings()
+        assert stored is not None
+        self.assertListEqual(stored[0], [identity for _, identity in registry])
+        self.assertEqual(stored[1].shape, (4, 512))
+        self.assertIsNone(self.source.stored_encodings())
+
+    def test_open_empty(self) -> None:
+        registry = open_registry(self.directory / "new.npz", torch.device("cpu"))
+        self.assertEqual(len(registry), 0)
+        self.assertDictEqual(registry.counts(), {})
+        # an empty directory is an empty registry
+        registry = open_registry(self.directory, torch.device("cpu"))
+        self.assertIsInstance(registry, ColumnarRegistry)
+        self.assertEqual(len(registry), 0)
+        self.assertIsInstance(
+            open_registry(self.directory / "new.pkl", torch.device("cpu")),
+            PickleRegistry,
+        )
+
+    def test_modify(self) -> None:
+        for path in (self.directory / "faces", self.directory / "faces.npz"):
+            ColumnarRegistry.write(path, self.source, torch.zeros(4, 512))
+            registry = ColumnarRegistry.open(path, device=torch.device("cpu"))
+            patch, identity = next(iter(registry))
+            # known faces are skipped
+            self.assertListEqual(registry.add_many([(patch, identity)]), [])
+            self.assertRaises(ValueError, registry.add, patch, "someone else")
+            registry.add(patch + 1.0, identity)
+            self.assertEqual(len(registry), 5)
+            # stale encodings are dropped
+            self.assertIsNone(registry.encodings)
+            registry.discard([(patch, identity)])
+            registry.remove("nobody")
+            self.assertEqual(len(registry), 4)
+            reloaded = ColumnarRegistry.open(path, device=torch.device("cpu"))
+            self.assertSetEqual(self._digests(reloaded), self._digests(registry))
+            registry.remove(identity)
+            self.assertNotIn(identity, registry.counts())
+
+    def test_refresh(self) -> None:
+        for path in (self.directory / "faces", self.directory / "faces.npz"):
+            ColumnarRegistry.write(path, self.source)
+            registry = ColumnarRegistry.open(path, device=torch.device("cpu"))
+            other = ColumnarRegistry.open(path, device=torch.device("cpu"))
+            patch, identity = next(iter(registry))
+            registry.add(patch + 1.0, identity)
+            self.assertEqual(stored_generation(path), registry.generation)
+            self.assertEqual(len(other), 4)
+            self.assertTrue(other.refresh())
+            self.assertFalse(other.refresh())
+            self.assertEqual(len(other), 5)
+            # changes are made on the latest generation
+            other.remove(identity)
+            registry.add(patch + 2.0, "someone else")
+            self.assertEqual(len(registry), 4)
+            self.assertNotIn(identity, registry.counts())
+
+
 if __name__ == "__main__":
     unittest.main()
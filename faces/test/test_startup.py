@@ -0,0 +1,76 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from typing import Dict, List
+
+# modules that take long to import, and must not be imported at startup
+HEAVY_MODULES = ("torch", "cv2", "facenet_pytorch", "matplotlib", "numpy", "PIL")
+
+# upper bound of the cumulative import time of faces.main, in seconds
+IMPORT_TIME_BUDGET = 0.5
+
+
+class TestStartup(unittest.TestCase):
+    def _import_times(self, code: str, *args: str) -> Dict[str, float]:
+        """Run *code* in a fresh interpreter and return the cumulative
+        import time in seconds of each imported module.
+        """
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(
+            [str(Path(__file__).parent.parent), env.get("PYTHONPATH", "")]
+        )
+        process = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code, *args],
+            env=env,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        times = {}
+        for line in process.stderr.splitlines():
+            # import time: self [us] | cumulative | imported package
+            if line.startswith("import time:") and "|" in line:
+                _, cumulative, name = line.split("|")
+                if cumulative.strip().isdigit():
+                    times[name.strip()] = int(cumulative) / 1e6
+        return times
+
+    def _assert_light(self, modules: List[str]) -> None:
+        for heavy in HEAVY_MODULES:
+            self.assertNotIn(heavy, modules, f"{heavy} is imported at startup")
+
+    def test_import(self) -> None:
+        times = self._import_times("import faces, faces.main, faces.builder")
+        self._assert_light(list(times))
+        self.assertLess(times["faces.main"], IMPORT_TIME_BUDGET)
+
+    def test_help(self) -> None:
+        times = self._import_times("from faces.main import main; main(['--help'])")
+        self._assert_light(list(times))
+
+    def test_db_list(self) -> None:
+        import torch
+
+        from faces.registry import PickleRegistry
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / "faces.pkl"
+            PickleRegistry.open(path, torch.device("cpu")).add(
+                torch.zeros((3, 160, 160)), "douglas_adams"
+            )
+            times = self._import_times(
+                "import sys; from faces.main import main; main(sys.argv[1:])",
+                "--registry-path",
+                str(path),
+                "db",
+                "list",
+            )
+        self._assert_light(list(times))
+
+    def test_lazy_types(self) -> None:
+        times = self._import_times("from faces import BoundingBox, Builder")
+        self.assertIn("torch", times)
+        self.assertIn("faces.types", times)
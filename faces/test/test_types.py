@@ -1,10 +1,13 @@
 import unittest
 from pathlib import Path
+from tempfile import mkstemp
 
+import cv2
 import numpy as np
 from PIL import Image as PILImage
 
-from faces import BoundingBox, Image
+from faces import BoundingBox, Frame, Image
+from faces.utils import EXIF_ORIENTATION_KEY, preprocess
 
 
 class TestImage(unittest.TestCase):
@@ -20,6 +23,86 @@ class TestImage(unittest.TestCase):
         image = Image.open(Path(__file__).parent / "data" / "images" / "cactus.jpg")
         self.assertEqual(image.image.size, (1000, 664))
 
+    def test_open_keep_source(self) -> None:
+        path = Path(__file__).parent / "data" / "images" / "douglas_adams.jpg"
+        image = Image.open(path, target_size=500)
+        self.assertIsNone(image.source)
+        self.assertEqual(image.source_scale, 1.0)
+        image = Image.open(path, target_size=500, keep_source=True)
+        self.assertEqual(image.image.size, (500, 321))
+        self.assertEqual(image.source.size, (1600, 1029))
+        self.assertEqual(image.source_scale, 3.2)
+        image = Image.open(path, target_size=500, rotate=90, keep_source=True)
+        self.assertEqual(image.image.size, (321, 500))
+        self.assertEqual(image.source.size, (1029, 1600))
+
+    def test_open_draft(self) -> None:
+        path = Path(mkstemp(prefix="faces-test-", suffix=".jpg")[1])
+        try:
+            # large image
+            PILImage.open(
+                Path(__file__).parent / "data" / "images" / "douglas_adams.jpg"
+            ).resize((4800, 3087)).save(path)
+            image = Image.open(path)
+            self.assertEqual(image.image.size, (1000, 643))
+            # similar to decoding the full image
+            reference = preprocess(PILImage.open(path))
+            self.assertLess(
+                np.abs(
+                    np.array(image.image, dtype=float)
+                    - np.array(reference, dtype=float)
+                ).mean(),
+                5.0,
+            )
+            # rotated image
+            img = PILImage.open(path)
+            exif = img.getexif()
+            exif[EXIF_ORIENTATION_KEY] = 6
+            img.save(path, exif=exif)
+            self.assertEqual(Image.open(path).image.size, (643, 1000))
+            self.assertEqual(Image.open(path, rotate=0).image.size, (1000, 643))
+        finally:
+            path.unlink()
+
+
+class TestFrame(unittest.TestCase):
+    def setUp(self) -> None:
+        self.buffer = cv2.imread(
+            str(Path(__file__).parent / "data" / "images" / "douglas_adams.jpg")
+        )
+
+    def test_from_array(self) -> None:
+        frame = Frame.from_array(self.buffer)
+        self.assertEqual(frame.size, (1000, 643))
+        self.assertEqual(frame.buffer.shape, (643, 1000, 3))
+        # rotation
+        self.assertEqual(Frame.from_array(self.buffer, rotate=90).size, (643, 1000))
+        self.assertEqual(Frame.from_array(self.buffer, rotate=180).size, (1000, 643))
+        self.assertEqual(Frame.from_array(self.buffer, rotate=-90).size, (643, 1000))
+        # buffers of the target size are not copied
+        self.assertIs(
+            Frame.from_array(self.buffer, target_size=1600).buffer, self.buffer
+        )
+
+    def test_rgb(self) -> None:
+        frame = Frame.from_array(self.buffer, target_size=1600)
+        self.assertTrue(np.shares_memory(frame.rgb, frame.buffer))
+        np.testing.assert_array_equal(
+            frame.rgb,
+            np.array(
+                PILImage.open(
+                    Path(__file__).parent / "data" / "images" / "douglas_adams.jpg"
+                )
+            ),
+        )
+
+    def test_to_image(self) -> None:
+        frame = Frame.from_array(self.buffer)
+        image = frame.to_image()
+        self.assertIsInstance(image, Image)
+        self.assertEqual(image.image.size, frame.size)
+        np.testing.assert_array_equal(np.array(image.image), frame.rgb)
+
 
 class TestBoundingBox(unittest.TestCase):
     pass
@@ -3,7 +3,7 @@ from pathlib import Path
 
 import PIL.Image
 
-from faces.utils import preprocess
+from faces.utils import exif_rotation, preprocess, target_dimensions
 
 
 class TestUtils(unittest.TestCase):
@@ -18,6 +18,19 @@ class TestUtils(unittest.TestCase):
         self.assertEqual(preprocess(image, 1000, rotate=270).size, (643, 1000))
         self.assertEqual(preprocess(image, 1000, rotate=360).size, (1000, 643))
         self.assertEqual(preprocess(image, 1000, rotate=450).size, (643, 1000))
+        # square image
+        self.assertEqual(preprocess(image.crop((0, 0, 500, 500)), 100).size, (100, 100))
+
+    def test_target_dimensions(self):
+        self.assertEqual(target_dimensions((1600, 1029), 1000), (1000, 643))
+        self.assertEqual(target_dimensions((1029, 1600), 1000), (643, 1000))
+        self.assertEqual(target_dimensions((500, 500), 1000), (1000, 1000))
+
+    def test_exif_rotation(self):
+        image = PIL.Image.open(
+            Path(__file__).parent / "data" / "images" / "douglas_adams.jpg"
+        )
+        self.assertEqual(exif_rotation(image), 0)
 
 
 if __name__ == "__main__":